@@ -3,15 +3,33 @@ LILYGO T5 Weather Display - Middleware API
 Aggregates data from multiple upstream APIs to optimize battery life on display board
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 import requests
 import os
 import json
 import logging
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
 import threading
 
+from breaker import (DEFAULT_FAILURE_THRESHOLD, DEFAULT_MAX_OPEN_SECONDS, DEFAULT_OPEN_SECONDS, CircuitBreakers,
+                     CircuitOpen, is_failure_status)
+from budget import DEFAULT_QUOTAS, DEFAULT_RESERVE, QuotaExceeded, RateBudget
+from cache import FrameHistory, ResultCache
+from conditional import conditional_response
+from forecast import FORECAST_HOURS, ForecastSeries, serve_time
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from payload import PAYLOAD_MIMETYPE, encode_payload
+from render import FRAME_HISTORY, FRAME_MIMETYPE, AssetsMissing, get_frame, parse_frame_crc
+from streamjson import CHUNK_SIZE, extract_fields
+from wake import next_change, next_wake_seconds
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -37,7 +55,9 @@ def load_config():
                 'api_key': os.getenv('OPENWEATHERMAP_API_KEY', ''),
                 'city': os.getenv('WEATHER_CITY', 'Sydney'),
                 'country': os.getenv('WEATHER_COUNTRY', 'AU'),
-                'units': os.getenv('WEATHER_UNITS', 'metric')
+                'units': os.getenv('WEATHER_UNITS', 'metric'),
+                'latitude': os.getenv('WEATHER_LATITUDE'),
+                'longitude': os.getenv('WEATHER_LONGITUDE')
             },
             'crypto': {
                 'api_key': os.getenv('COINGECKO_API_KEY', ''),
@@ -86,33 +106,458 @@ def load_config():
 
 config = load_config()
 
-# Cache for stock data (MarketStack has 100 requests/month limit on free tier)
-# We cache for 24 hours to make ~1 request per day
-stock_cache = {
-    'data': None,
-    'timestamp': None,
+# Shared HTTP client
+# One pooled keep-alive session per upstream host lives for the whole process,
+# so repeated fetches reuse TCP/TLS connections instead of handshaking again.
+DEFAULT_HTTP_TIMEOUT = 10
+DEFAULT_HTTP_POOL_SIZE = 4
+
+http_sessions = {
+    'sessions': {},
+    'lock': threading.Lock()
+}
+
+def _get_http_config():
+    return config.get('http', {}) or {}
+
+def get_http_session(host):
+    """Return the pooled session for an upstream host, creating it on first use"""
+    with http_sessions['lock']:
+        session = http_sessions['sessions'].get(host)
+        if session is None:
+            pool_size = int(_get_http_config().get('pool_size', DEFAULT_HTTP_POOL_SIZE))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            http_sessions['sessions'][host] = session
+            logger.info(f"Created HTTP session for {host} (pool size: {pool_size})")
+        return session
+
+def get_http_timeout(host):
+    """Per-host timeout in seconds from the 'http.timeouts' config, falling back to the default"""
+    http_config = _get_http_config()
+    timeouts = http_config.get('timeouts', {}) or {}
+    return float(timeouts.get(host, http_config.get('timeout', DEFAULT_HTTP_TIMEOUT)))
+
+# Circuit breakers (see breaker.py)
+# An upstream that keeps failing is skipped for a while instead of costing a
+# timeout on every fetch; the result cache serves its last good value meanwhile.
+def _get_breaker_config():
+    return _get_http_config().get('circuit_breaker', {}) or {}
+
+circuit_breakers = CircuitBreakers(
+    failure_threshold=int(_get_breaker_config().get('failure_threshold', DEFAULT_FAILURE_THRESHOLD)),
+    open_seconds=float(_get_breaker_config().get('open_seconds', DEFAULT_OPEN_SECONDS)),
+    max_open_seconds=float(_get_breaker_config().get('max_open_seconds', DEFAULT_MAX_OPEN_SECONDS))
+)
+
+def begin_upstream_call(name, upstream=None):
+    """
+    Check an upstream's circuit breaker and charge its quota before a call.
+    Returns the breaker to record the outcome on; raises CircuitOpen or
+    QuotaExceeded if the call must not be made.
+    """
+    breaker = circuit_breakers.get(name)
+    try:
+        breaker.before_call()
+    except CircuitOpen as e:
+        metrics.inc('middleware_circuit_skipped_total', (('upstream', name),))
+        logger.warning(f"Skipping {name} call: {e}")
+        raise
+    try:
+        charge_upstream(upstream)
+    except QuotaExceeded:
+        breaker.release()
+        raise
+    return breaker
+
+def http_get(url, upstream=None, **kwargs):
+    """
+    GET an upstream URL through the shared session of its host.
+    
+    Pooling can be turned off with 'http.pooling: false' (one connection per
+    request, as before), which is mainly useful for benchmarking.
+    
+    Latency, errors and in-flight calls are recorded per upstream (the
+    'upstream' name, or the host). Calls to a named upstream count against
+    its provider's quota and raise QuotaExceeded once it is used up; calls
+    to an upstream whose circuit breaker is open raise CircuitOpen.
+    """
+    host = urlparse(url).netloc
+    kwargs.setdefault('timeout', get_http_timeout(host))
+    labels = (('upstream', upstream or host),)
+    breaker = begin_upstream_call(upstream or host, upstream)
+    
+    metrics.inc('middleware_upstream_in_flight', labels)
+    start = time.perf_counter()
+    try:
+        if not _get_http_config().get('pooling', True):
+            response = requests.get(url, **kwargs)
+        else:
+            response = get_http_session(host).get(url, **kwargs)
+    except Exception:
+        metrics.inc('middleware_upstream_errors_total', labels)
+        breaker.record(False)
+        raise
+    finally:
+        metrics.observe('middleware_upstream_request_seconds', labels, time.perf_counter() - start)
+        metrics.dec('middleware_upstream_in_flight', labels)
+    
+    if response.status_code >= 400:
+        metrics.inc('middleware_upstream_errors_total', labels)
+    breaker.record(not is_failure_status(response.status_code))
+    return response
+
+# Upstream base URLs
+# Each can be overridden in the 'upstreams' config section, e.g. to point every
+# upstream at the mock server in mockupstream.py for offline benchmarks.
+DEFAULT_UPSTREAM_URLS = {
+    'geocode': 'https://maps.googleapis.com',
+    'weather': 'https://weather.googleapis.com',
+    'crypto': 'https://api.coingecko.com',
+    'stock': 'http://api.marketstack.com',
+    'train': 'https://api.transport.nsw.gov.au'
+}
+
+def get_upstream_url(upstream):
+    """Base URL of an upstream (scheme and host, no trailing slash)"""
+    urls = config.get('upstreams', {}) or {}
+    return urls.get(upstream, DEFAULT_UPSTREAM_URLS[upstream]).rstrip('/')
+
+# Long-lived executor used to fan out work across the four sources
+fetch_executor = ThreadPoolExecutor(
+    max_workers=int(_get_http_config().get('max_workers', 4)),
+    thread_name_prefix='fetch'
+)
+
+# Result cache shared by all worker processes (SQLite next to config.json),
+# so cached results survive restarts and N workers don't make N upstream calls
+CACHE_FILE = os.getenv(
+    'CACHE_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(os.getenv('CONFIG_FILE', 'config.json'))), 'cache.sqlite3')
+)
+
+# Cache duration per source in seconds
+DEFAULT_CACHE_TTLS = {
+    # The hourly forecast is served until then, current conditions only
+    # are refetched every 10 minutes (see get_forecast_ttl)
+    'weather': 10800,   # 3 hours
+    'crypto': 300,      # 5 minutes
+    # MarketStack has 100 requests/month limit on free tier
+    # We cache for 24 hours to make ~1 request per day
+    'stock': 86400,
+    # Trips are kept as a timetable of upcoming departures, refetched sooner
+    # when it runs low (see get_timetable_ttl)
+    'train': 600        # 10 minutes, so real-time estimates stay current
+}
+
+result_cache = ResultCache(CACHE_FILE)
+
+# Frames served to each display, shared by the workers for /api/frame diffs
+frame_history = FrameHistory(CACHE_FILE, FRAME_HISTORY)
+
+def get_cache_ttl(name):
+    """Return the cache TTL in seconds for a source (never shorter than its quota allows)"""
+    ttls = config.get('cache', {}).get('ttl_seconds', {})
+    ttl = int(ttls.get(name, DEFAULT_CACHE_TTLS[name]))
+    if name == 'weather':
+        ttl = min(ttl, get_forecast_ttl())
+    if name == 'train':
+        ttl = min(ttl, get_timetable_ttl())
+    return max(ttl, get_budget_interval(name))
+
+# Upstream quotas (see budget.py)
+# Calls are counted per provider in the cache database, so the counts survive
+# restarts and are shared by all workers. When traffic would use up a quota
+# before its period ends, refresh intervals and cache TTLs grow to make it
+# last; once it is used up, calls are refused and the cache serves stale data.
+UPSTREAM_PROVIDERS = {
+    'geocode': 'google',
+    'weather': 'google',
+    'crypto': 'coingecko',
+    'stock': 'marketstack',
+    'train': 'transportnsw'
+}
+
+def get_budget_quotas():
+    """DEFAULT_QUOTAS with the 'budget.quotas' config ({provider: {period: limit}}) on top"""
+    quotas = dict(DEFAULT_QUOTAS)
+    for provider, limits in (config.get('budget', {}).get('quotas', {}) or {}).items():
+        quotas[provider] = [(int(limit), period) for period, limit in (limits or {}).items()]
+    return quotas
+
+rate_budget = RateBudget(
+    CACHE_FILE, get_budget_quotas(),
+    reserve=float(config.get('budget', {}).get('reserve', DEFAULT_RESERVE))
+)
+
+def charge_upstream(upstream):
+    """Count a call to an upstream against its provider's quota, raising QuotaExceeded if it is used up"""
+    provider = UPSTREAM_PROVIDERS.get(upstream)
+    if provider is None:
+        return
+    try:
+        rate_budget.acquire(provider)
+    except QuotaExceeded as e:
+        metrics.inc('middleware_budget_refused_total', (('provider', provider),))
+        logger.warning(f"Refusing {upstream} call: {e}")
+        raise
+
+def get_budget_interval(name):
+    """Shortest refresh interval of a source in seconds that keeps its provider within quota"""
+    # Weather and trains make one call per distinct item (weather two with its forecast);
+    # crypto and stock batch every item into one
+    if name == 'weather':
+        calls = sum(1 + bool(get_forecast_hours(item)) for item in get_source_items(name).values())
+    else:
+        calls = len(get_source_items(name)) if name == 'train' else 1
+    return int(rate_budget.interval(UPSTREAM_PROVIDERS[name], calls))
+
+# Geocode cache (the configured city never moves, so its coordinates are
+# stored on disk and reused across requests and restarts)
+GEOCODE_CACHE_FILE = os.getenv(
+    'GEOCODE_CACHE_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(os.getenv('CONFIG_FILE', 'config.json'))), 'geocode_cache.json')
+)
+
+# Cache duration: 30 days
+GEOCODE_CACHE_DURATION = timedelta(days=30)
+
+geocode_cache = {
+    'entries': {},
     'lock': threading.Lock()
 }
 
-# Cache duration: 24 hours
-STOCK_CACHE_DURATION = timedelta(hours=24)
+def _normalize_address(city, country):
+    """Build the geocode cache key, e.g. ' New  York', 'US' -> 'new york,us'"""
+    return ','.join(' '.join(part.split()).lower() for part in (city, country))
 
-def _get_stale_cached_stock_data(error_type):
+def load_geocode_cache():
+    """Load the geocode cache from disk at startup"""
+    if not os.path.exists(GEOCODE_CACHE_FILE):
+        return
+    
+    try:
+        with open(GEOCODE_CACHE_FILE, 'r') as f:
+            entries = json.load(f)
+        with geocode_cache['lock']:
+            geocode_cache['entries'] = entries
+        logger.info(f"Loaded {len(entries)} geocode cache entries from {GEOCODE_CACHE_FILE}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not load geocode cache from {GEOCODE_CACHE_FILE}: {e}")
+
+def _save_geocode_cache(entries):
+    """Write the geocode cache atomically so a crash never leaves a truncated file"""
+    try:
+        tmp_file = f"{GEOCODE_CACHE_FILE}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_file, GEOCODE_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"Could not save geocode cache to {GEOCODE_CACHE_FILE}: {e}")
+
+def get_known_coordinates(weather_config):
     """
-    Helper function to retrieve stale cached stock data when API fails.
-    Returns cached data if available, otherwise None.
+    Return (latitude, longitude) without any upstream call, or None.
+    
+    Explicit 'latitude'/'longitude' in the weather config skip geocoding
+    entirely; otherwise the geocode cache is used while its entry is younger
+    than GEOCODE_CACHE_DURATION.
     """
-    with stock_cache['lock']:
-        if stock_cache['data'] is not None:
-            cache_age = datetime.utcnow() - stock_cache['timestamp'] if stock_cache['timestamp'] else None
-            logger.warning(f"{error_type}, returning stale cached data (age: {cache_age})")
-            return stock_cache['data']
+    if weather_config.get('latitude') is not None and weather_config.get('longitude') is not None:
+        return float(weather_config['latitude']), float(weather_config['longitude'])
+    
+    key = _normalize_address(weather_config.get('city', 'Sydney'), weather_config.get('country', 'AU'))
+    
+    with geocode_cache['lock']:
+        entry = geocode_cache['entries'].get(key)
+    
+    if entry is not None:
+        cache_age = datetime.utcnow() - datetime.fromisoformat(entry['timestamp'])
+        if cache_age < GEOCODE_CACHE_DURATION:
+            return entry['lat'], entry['lng']
+        logger.info(f"Geocode cache expired for {key} (age: {cache_age})")
+    
     return None
 
-def fetch_weather_data():
-    """Fetch weather data from Google Weather API"""
+def build_geocode_url(weather_config):
+    city = weather_config.get('city', 'Sydney')
+    country = weather_config.get('country', 'AU')
+    logger.info(f"Geocoding request: {city}, {country}")
+    return f"{get_upstream_url('geocode')}/maps/api/geocode/json?address={city},{country}&key={weather_config.get('api_key')}"
+
+def store_geocode_result(weather_config, geocode_data):
+    """Validate a Geocoding API response, cache it on disk and return (latitude, longitude)"""
+    if geocode_data.get('status') != 'OK':
+        logger.error(f"Geocoding error: {geocode_data.get('status')}")
+        raise ValueError(f"Geocoding error: {geocode_data.get('status')}")
+    
+    location = geocode_data['results'][0]['geometry']['location']
+    key = _normalize_address(weather_config.get('city', 'Sydney'), weather_config.get('country', 'AU'))
+    
+    with geocode_cache['lock']:
+        geocode_cache['entries'][key] = {
+            'lat': location['lat'],
+            'lng': location['lng'],
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        entries = dict(geocode_cache['entries'])
+    _save_geocode_cache(entries)
+    
+    return location['lat'], location['lng']
+
+def get_coordinates(weather_config):
+    """Resolve the configured location to (latitude, longitude), calling the Geocoding API only on a cache miss"""
+    coordinates = get_known_coordinates(weather_config)
+    if coordinates is not None:
+        return coordinates
+    
+    geocode_response = http_get(build_geocode_url(weather_config), upstream='geocode')
+    geocode_response.raise_for_status()
+    return store_geocode_result(weather_config, geocode_response.json())
+
+load_geocode_cache()
+
+def build_weather_url(api_key, latitude, longitude):
+    return f"{get_upstream_url('weather')}/v1/currentConditions:lookup?key={api_key}&location.latitude={latitude}&location.longitude={longitude}"
+
+def build_forecast_url(api_key, latitude, longitude, hours):
+    return f"{get_upstream_url('weather')}/v1/forecast/hours:lookup?key={api_key}&location.latitude={latitude}&location.longitude={longitude}&hours={hours}&pageSize={hours}"
+
+def to_display_temperature(celsius, units):
+    return celsius * 9.0 / 5.0 + 32.0 if units == 'imperial' else celsius
+
+def wind_speed_ms(wind):
+    """Speed of a Google Weather 'wind' object in m/s"""
+    value = wind.get('speed', {}).get('value', 0.0)
+    # Convert from km/h to m/s if unit is KILOMETERS_PER_HOUR
+    if wind.get('speed', {}).get('unit', 'KILOMETERS_PER_HOUR') == 'KILOMETERS_PER_HOUR':
+        return value / 3.6
+    return value
+
+def parse_weather_response(data, city, units):
+    """Convert a Google Weather currentConditions response to the display format"""
+    # Extract weather data from Google Weather API format
+    temp_celsius = data.get('temperature', {}).get('degrees', 0.0)
+    feels_celsius = data.get('feelsLikeTemperature', {}).get('degrees', 0.0)
+    precipitation_prob = data.get('precipitation', {}).get('probability', {}).get('percent', 0)
+    
+    # Wind speed in m/s
+    wind_ms = wind_speed_ms(data.get('wind', {}))
+    
+    # Get max/min from history
+    history = data.get('currentConditionsHistory', {})
+    max_celsius = history.get('maxTemperature', {}).get('degrees', temp_celsius)
+    min_celsius = history.get('minTemperature', {}).get('degrees', temp_celsius)
+    
+    # Get weather condition
+    weather_condition = data.get('weatherCondition', {})
+    condition_desc = weather_condition.get('description', {}).get('text', 'Unknown')
+    condition_type = weather_condition.get('type', 'UNKNOWN')
+    is_daytime = data.get('isDaytime', True)
+    
+    # Convert to imperial if needed
+    temp_celsius = to_display_temperature(temp_celsius, units)
+    feels_celsius = to_display_temperature(feels_celsius, units)
+    max_celsius = to_display_temperature(max_celsius, units)
+    min_celsius = to_display_temperature(min_celsius, units)
+    
+    logger.info(f"Weather data fetched successfully - {city}: {temp_celsius}°{units[0].upper()}")
+    
+    return {
+        'temp': round(temp_celsius, 1),
+        'feels_like': round(feels_celsius, 1),
+        'temp_max': round(max_celsius, 1),
+        'temp_min': round(min_celsius, 1),
+        'precipitation_prob': precipitation_prob,
+        'wind_speed': round(wind_ms, 1),
+        'condition': condition_desc,
+        'condition_type': condition_type,
+        'is_daytime': is_daytime,
+        'city': city,
+        'units': units
+    }
+
+# Hourly forecast
+# Weather is fetched every few hours with the forecast for the next
+# FORECAST_HOURS (one extra call), and the values in between are
+# interpolated over it (see forecast.py). 'forecast_hours': 0 in a weather
+# config fetches current conditions only, every CURRENT_CONDITIONS_TTL.
+CURRENT_CONDITIONS_TTL = 600
+
+# Refetch once the forecast covers less than this much time ahead
+FORECAST_MIN_AHEAD_SECONDS = 6 * 3600
+
+# Forecast hours included in each weather response
+SERVED_FORECAST_HOURS = 3
+
+def get_forecast_hours(weather_config):
+    return min(int(weather_config.get('forecast_hours', FORECAST_HOURS)), FORECAST_HOURS)
+
+def parse_forecast_response(data, current, units, fetched_at):
+    """
+    Google Weather hourly forecast as a series (see forecast.py) starting
+    with the current conditions at the time they were fetched.
+    """
+    points = [(fetched_at, current)]
+    for hour in data.get('forecastHours', []):
+        start = hour.get('interval', {}).get('startTime')
+        if not start or parse_utc(start) <= fetched_at:
+            continue
+        weather_condition = hour.get('weatherCondition', {})
+        points.append((parse_utc(start), {
+            'temp': to_display_temperature(hour.get('temperature', {}).get('degrees', 0.0), units),
+            'feels_like': to_display_temperature(hour.get('feelsLikeTemperature', {}).get('degrees', 0.0), units),
+            'precipitation_prob': hour.get('precipitation', {}).get('probability', {}).get('percent', 0),
+            'wind_speed': wind_speed_ms(hour.get('wind', {})),
+            'condition': weather_condition.get('description', {}).get('text', 'Unknown'),
+            'condition_type': weather_condition.get('type', 'UNKNOWN'),
+            'is_daytime': hour.get('isDaytime', True)
+        }))
+    return ForecastSeries.from_points(points).to_dict()
+
+def current_weather(weather, now=None):
+    """Weather at the current serve step, interpolated over the cached forecast"""
+    if 'error' in weather or 'forecast' not in weather:
+        return weather
+    series = ForecastSeries.from_dict(weather['forecast'])
+    moment = serve_time(now or datetime.utcnow())
+    
+    served = {key: value for key, value in weather.items() if key != 'forecast'}
+    served.update(series.at(moment))
+    served['temp_max'] = max(served['temp_max'], served['temp'])
+    served['temp_min'] = min(served['temp_min'], served['temp'])
+    served['hourly'] = series.hourly(moment, SERVED_FORECAST_HOURS)
+    return served
+
+def get_forecast_ttl():
+    """
+    Age in seconds at which the cached weather needs refetching: when the
+    first forecast covers less than FORECAST_MIN_AHEAD_SECONDS ahead, or
+    after CURRENT_CONDITIONS_TTL when a location has no forecast.
+    """
+    entry = result_cache.get(cache_key('weather'))
+    if entry is None or 'error' in entry[0]:
+        return CURRENT_CONDITIONS_TTL
+    
+    items, stored_at = entry
+    ends = []
+    for key in get_source_items('weather'):
+        forecast = (items.get(key) or {}).get('forecast')
+        if not forecast:
+            return CURRENT_CONDITIONS_TTL
+        ends.append(ForecastSeries.from_dict(forecast).end)
+    
+    if not ends:
+        return CURRENT_CONDITIONS_TTL
+    ahead = (min(ends) - stored_at).total_seconds() - FORECAST_MIN_AHEAD_SECONDS
+    return max(int(ahead), CURRENT_CONDITIONS_TTL)
+
+def fetch_weather_data(weather_config=None):
+    """Fetch weather data from Google Weather API (global weather config unless a profile's is given)"""
     try:
-        weather_config = config.get('weather', {})
+        weather_config = weather_config or config.get('weather', {})
         api_key = weather_config.get('api_key')
         city = weather_config.get('city', 'Sydney')
         country = weather_config.get('country', 'AU')
@@ -124,78 +569,28 @@ def fetch_weather_data():
         
         logger.info(f"Fetching weather data for {city}, {country}")
         
-        # Step 1: Get latitude and longitude using Geocoding API
-        geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={city},{country}&key={api_key}"
-        logger.info(f"Geocoding request: {city}, {country}")
-        
-        geocode_response = requests.get(geocode_url, timeout=10)
-        geocode_response.raise_for_status()
-        geocode_data = geocode_response.json()
-        
-        if geocode_data.get('status') != 'OK':
-            logger.error(f"Geocoding error: {geocode_data.get('status')}")
-            return {'error': f"Geocoding error: {geocode_data.get('status')}"}
-        
-        location = geocode_data['results'][0]['geometry']['location']
-        latitude = location['lat']
-        longitude = location['lng']
+        # Step 1: Get latitude and longitude (config or geocode cache, rarely the Geocoding API)
+        latitude, longitude = get_coordinates(weather_config)
         
         logger.info(f"Location found: Lat={latitude}, Lng={longitude}")
         
         # Step 2: Get weather data using coordinates
-        weather_url = f"https://weather.googleapis.com/v1/currentConditions:lookup?key={api_key}&location.latitude={latitude}&location.longitude={longitude}"
-        weather_response = requests.get(weather_url, timeout=10)
+        weather_url = build_weather_url(api_key, latitude, longitude)
+        fetched_at = datetime.utcnow()
+        weather_response = http_get(weather_url, upstream='weather')
         weather_response.raise_for_status()
+        weather = parse_weather_response(weather_response.json(), city, units)
         
-        data = weather_response.json()
-        
-        # Extract weather data from Google Weather API format
-        temp_celsius = data.get('temperature', {}).get('degrees', 0.0)
-        feels_celsius = data.get('feelsLikeTemperature', {}).get('degrees', 0.0)
-        precipitation_prob = data.get('precipitation', {}).get('probability', {}).get('percent', 0)
-        
-        # Wind speed - check unit and convert to m/s if needed
-        wind_value = data.get('wind', {}).get('speed', {}).get('value', 0.0)
-        wind_unit = data.get('wind', {}).get('speed', {}).get('unit', 'KILOMETERS_PER_HOUR')
-        wind_ms = wind_value
-        
-        # Convert from km/h to m/s if unit is KILOMETERS_PER_HOUR
-        if wind_unit == 'KILOMETERS_PER_HOUR':
-            wind_ms = wind_value / 3.6
-        
-        # Get max/min from history
-        history = data.get('currentConditionsHistory', {})
-        max_celsius = history.get('maxTemperature', {}).get('degrees', temp_celsius)
-        min_celsius = history.get('minTemperature', {}).get('degrees', temp_celsius)
-        
-        # Get weather condition
-        weather_condition = data.get('weatherCondition', {})
-        condition_desc = weather_condition.get('description', {}).get('text', 'Unknown')
-        condition_type = weather_condition.get('type', 'UNKNOWN')
-        is_daytime = data.get('isDaytime', True)
-        
-        # Convert to imperial if needed
-        if units == 'imperial':
-            temp_celsius = temp_celsius * 9.0 / 5.0 + 32.0
-            feels_celsius = feels_celsius * 9.0 / 5.0 + 32.0
-            max_celsius = max_celsius * 9.0 / 5.0 + 32.0
-            min_celsius = min_celsius * 9.0 / 5.0 + 32.0
-        
-        logger.info(f"Weather data fetched successfully - {city}: {temp_celsius}°{units[0].upper()}")
-        
-        return {
-            'temp': round(temp_celsius, 1),
-            'feels_like': round(feels_celsius, 1),
-            'temp_max': round(max_celsius, 1),
-            'temp_min': round(min_celsius, 1),
-            'precipitation_prob': precipitation_prob,
-            'wind_speed': round(wind_ms, 1),
-            'condition': condition_desc,
-            'condition_type': condition_type,
-            'is_daytime': is_daytime,
-            'city': city,
-            'units': units
-        }
+        # Step 3: The hourly forecast, served until the next fetch (see current_weather)
+        hours = get_forecast_hours(weather_config)
+        if hours > 0:
+            try:
+                forecast_response = http_get(build_forecast_url(api_key, latitude, longitude, hours), upstream='weather')
+                forecast_response.raise_for_status()
+                weather['forecast'] = parse_forecast_response(forecast_response.json(), weather, units, fetched_at)
+            except Exception as e:
+                logger.warning(f"Forecast unavailable, serving current conditions only: {e}")
+        return weather
     except requests.exceptions.HTTPError as e:
         status_code = e.response.status_code if e.response else 'unknown'
         logger.error(f"HTTP error fetching weather data: {status_code} - {e}")
@@ -207,56 +602,65 @@ def fetch_weather_data():
         logger.error(f"Error fetching weather data: {e}")
         return {'error': str(e)}
 
-def fetch_crypto_data():
-    """Fetch cryptocurrency data from CoinGecko API"""
+# Map common symbols to CoinGecko IDs
+CRYPTO_SYMBOL_TO_ID = {
+    'btc': 'bitcoin',
+    'eth': 'ethereum',
+    'ada': 'cardano',
+    'sol': 'solana',
+    'bnb': 'binancecoin',
+    'xrp': 'ripple',
+    'doge': 'dogecoin',
+    'dot': 'polkadot',
+    'matic': 'matic-network',
+    'avax': 'avalanche-2',
+    'link': 'chainlink',
+    'uni': 'uniswap'
+}
+
+def build_crypto_url(coin_ids):
+    return f"{get_upstream_url('crypto')}/api/v3/simple/price?ids={','.join(coin_ids)}&vs_currencies=usd&include_24hr_change=true"
+
+def parse_crypto_response(data, symbol, coin_id):
+    """Convert a CoinGecko simple/price response to the display format"""
+    if coin_id in data:
+        price = int(data[coin_id].get('usd', 0))
+        change = round(data[coin_id].get('usd_24h_change', 0), 2)
+        logger.info(f"Crypto data fetched successfully - {symbol.upper()}: ${price} ({change:+.2f}%)")
+        return {
+            'symbol': symbol.upper(),
+            'price': price,
+            'change_24h': change
+        }
+    else:
+        logger.warning(f"Crypto symbol/ID not found: {symbol}")
+        return {'error': f'Crypto symbol/ID not found: {symbol}'}
+
+def fetch_crypto_data(symbols):
+    """
+    Fetch cryptocurrency data from CoinGecko API.
+    
+    simple/price accepts many ids, so all symbols are fetched in one call.
+    Returns {symbol: result}, or a single error dict if the call failed.
+    """
     try:
-        crypto_config = config.get('crypto', {})
-        api_key = crypto_config.get('api_key')
-        symbol = crypto_config.get('symbol', 'btc').lower()
+        api_key = config.get('crypto', {}).get('api_key')
         
         if not api_key:
             logger.warning("Crypto API key not configured")
             return {'error': 'Crypto API key not configured'}
         
-        # Map common symbols to CoinGecko IDs
-        symbol_to_id = {
-            'btc': 'bitcoin',
-            'eth': 'ethereum',
-            'ada': 'cardano',
-            'sol': 'solana',
-            'bnb': 'binancecoin',
-            'xrp': 'ripple',
-            'doge': 'dogecoin',
-            'dot': 'polkadot',
-            'matic': 'matic-network',
-            'avax': 'avalanche-2',
-            'link': 'chainlink',
-            'uni': 'uniswap'
-        }
-        
-        # Convert symbol to CoinGecko ID if it's a known symbol, otherwise use as-is
-        coin_id = symbol_to_id.get(symbol, symbol)
+        # Convert symbols to CoinGecko IDs if they are known symbols, otherwise use as-is
+        coin_ids = {symbol: CRYPTO_SYMBOL_TO_ID.get(symbol, symbol) for symbol in symbols}
         
-        logger.info(f"Fetching crypto data for {symbol.upper()} (ID: {coin_id})")
-        url = f"https://api.coingecko.com/api/v3/simple/price?ids={coin_id}&vs_currencies=usd&include_24hr_change=true"
+        logger.info(f"Fetching crypto data for {', '.join(s.upper() for s in symbols)}")
+        url = build_crypto_url(sorted(set(coin_ids.values())))
         headers = {'x-cg-demo-api-key': api_key}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_get(url, upstream='crypto', headers=headers)
         response.raise_for_status()
         
         data = response.json()
-        
-        if coin_id in data:
-            price = int(data[coin_id].get('usd', 0))
-            change = round(data[coin_id].get('usd_24h_change', 0), 2)
-            logger.info(f"Crypto data fetched successfully - {symbol.upper()}: ${price} ({change:+.2f}%)")
-            return {
-                'symbol': symbol.upper(),
-                'price': price,
-                'change_24h': change
-            }
-        else:
-            logger.warning(f"Crypto symbol/ID not found: {symbol}")
-            return {'error': f'Crypto symbol/ID not found: {symbol}'}
+        return {symbol: parse_crypto_response(data, symbol, coin_id) for symbol, coin_id in coin_ids.items()}
     except requests.exceptions.HTTPError as e:
         status_code = e.response.status_code if e.response else 'unknown'
         logger.error(f"HTTP error fetching crypto data: {status_code} - {e}")
@@ -268,104 +672,190 @@ def fetch_crypto_data():
         logger.error(f"Error fetching crypto data: {e}")
         return {'error': str(e)}
 
-def fetch_stock_data():
+def build_stock_url(api_key, symbols):
+    return f"{get_upstream_url('stock')}/v1/eod/latest?access_key={api_key}&symbols={','.join(symbols)}"
+
+def parse_stock_response(data, symbols):
+    """Convert a MarketStack eod/latest response to {symbol: result} in the display format"""
+    entries = {}
+    for stock_data in data.get('data') or []:
+        entries.setdefault(str(stock_data.get('symbol', '')).upper(), stock_data)
+    
+    # A single-symbol response is matched even if the entry carries no symbol
+    if len(symbols) == 1 and not entries.get(symbols[0]) and data.get('data'):
+        entries[symbols[0]] = data['data'][0]
+    
+    return {symbol: _parse_stock_entry(entries.get(symbol), symbol) for symbol in symbols}
+
+def _parse_stock_entry(stock_data, symbol):
+    if stock_data is not None:
+        open_price = stock_data.get('open', 0)
+        close_price = stock_data.get('close', 0)
+        change = close_price - open_price
+        
+        result = {
+            'symbol': symbol,
+            'price': round(close_price, 2),
+            'currency': 'USD',  # MarketStack free tier is US stocks only
+            'change': round(change, 2)
+        }
+        
+        logger.info(f"Stock data fetched successfully - {symbol}: ${close_price:.2f} ({change:+.2f})")
+        return result
+    else:
+        logger.warning(f"Stock symbol not found: {symbol}")
+        return {'error': 'Stock symbol not found'}
+
+def fetch_stock_data(symbols):
     """
-    Fetch stock market data from MarketStack API with 24-hour caching.
+    Fetch stock market data from MarketStack API.
     
     MarketStack free tier allows only 100 requests per month (~3 per day).
-    To conserve API quota, we cache the stock data for 24 hours and only
-    fetch new data once per day.
+    To conserve API quota, the result cache keeps stock data for 24 hours
+    (see DEFAULT_CACHE_TTLS) and serves the last good value if a fetch fails.
+    eod/latest accepts comma-separated symbols, so all symbols cost one call.
+    Returns {symbol: result}, or a single error dict if the call failed.
     """
-    global stock_cache
-    
     try:
-        stock_config = config.get('stock', {})
-        api_key = stock_config.get('api_key')
-        symbol = stock_config.get('symbol', 'AAPL').upper()
+        api_key = config.get('stock', {}).get('api_key')
         
         if not api_key:
             logger.warning("Stock API key not configured")
             return {'error': 'Stock API key not configured'}
         
-        # Use lock to ensure thread-safe access and prevent duplicate API calls
-        with stock_cache['lock']:
-            # Check if we have valid cached data
-            if (stock_cache['data'] is not None and 
-                stock_cache['timestamp'] is not None):
-                
-                cache_age = datetime.utcnow() - stock_cache['timestamp']
-                
-                if cache_age < STOCK_CACHE_DURATION:
-                    # Cache is still valid, return cached data
-                    logger.info(f"Returning cached stock data for {symbol} (age: {cache_age})")
-                    return stock_cache['data']
-                else:
-                    logger.info(f"Stock cache expired (age: {cache_age}), fetching fresh data")
-            
-            # Cache miss or expired - fetch fresh data while holding the lock
-            # This ensures only one thread fetches data at a time
-            logger.info(f"Fetching stock data for {symbol} from MarketStack API")
-            url = f"http://api.marketstack.com/v1/eod/latest?access_key={api_key}&symbols={symbol}"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if 'data' in data and len(data['data']) > 0:
-                stock_data = data['data'][0]
-                open_price = stock_data.get('open', 0)
-                close_price = stock_data.get('close', 0)
-                change = close_price - open_price
-                
-                result = {
-                    'symbol': symbol,
-                    'price': round(close_price, 2),
-                    'currency': 'USD',  # MarketStack free tier is US stocks only
-                    'change': round(change, 2)
-                }
-                
-                # Update cache
-                stock_cache['data'] = result
-                stock_cache['timestamp'] = datetime.utcnow()
-                
-                logger.info(f"Stock data fetched and cached successfully - {symbol}: ${close_price:.2f} ({change:+.2f})")
-                return result
-            else:
-                logger.warning(f"Stock symbol not found: {symbol}")
-                return {'error': 'Stock symbol not found'}
+        logger.info(f"Fetching stock data for {', '.join(symbols)} from MarketStack API")
+        response = http_get(build_stock_url(api_key, symbols), upstream='stock')
+        response.raise_for_status()
+        
+        return parse_stock_response(response.json(), symbols)
     except requests.exceptions.HTTPError as e:
         status_code = e.response.status_code if e.response else 'unknown'
         logger.error(f"HTTP error fetching stock data: {status_code} - {e}")
-        
-        # Try to return stale cached data as fallback
-        stale_data = _get_stale_cached_stock_data("API error")
-        if stale_data:
-            return stale_data
-        
         return {'error': f'HTTP {status_code}: {str(e)}'}
     except requests.exceptions.RequestException as e:
         logger.error(f"Network error fetching stock data: {e}")
-        
-        # Try to return stale cached data as fallback
-        stale_data = _get_stale_cached_stock_data("Network error")
-        if stale_data:
-            return stale_data
-        
         return {'error': f'Network error: {str(e)}'}
     except Exception as e:
         logger.error(f"Error fetching stock data: {e}")
-        
-        # Try to return stale cached data as fallback
-        stale_data = _get_stale_cached_stock_data("Unexpected error")
-        if stale_data:
-            return stale_data
-        
         return {'error': str(e)}
 
-def fetch_train_data():
-    """Fetch train schedule data from Transport NSW API"""
+def build_train_url():
+    return f"{get_upstream_url('train')}/v1/tp/trip"
+
+# Journeys fetched per trip call; they are kept as a timetable and the next
+# departure is served from it until fewer than min_departures are left
+DEFAULT_TRAIN_TRIPS = 6
+DEFAULT_TRAIN_MIN_DEPARTURES = 2
+
+# Upcoming departures included in each response
+SERVED_DEPARTURES = 3
+
+# Shortest time between timetable refetches, for late-night lists that are short anyway
+MIN_TIMETABLE_TTL = 60
+
+def build_train_params(origin, destination, trips=DEFAULT_TRAIN_TRIPS):
+    return {
+        'outputFormat': 'rapidJSON',
+        'coordOutputFormat': 'EPSG:4326',
+        'depArrMacro': 'dep',
+        'type_origin': 'any',
+        'name_origin': origin,
+        'type_destination': 'any',
+        'name_destination': destination,
+        'calcNumberOfTrips': str(trips),
+        'excludedMeans': 'checkbox',
+        'exclMOT_5': '1',
+        'TfNSWTR': 'true',
+        'version': '10.2.1.42',
+        'itOptionsActive': '1',
+        'cycleSpeed': '16'
+    }
+
+def build_train_headers(api_key):
+    return {
+        'Authorization': f'apikey {api_key}',
+        'Accept': 'application/json'
+    }
+
+def parse_utc(value):
+    """ISO 8601 UTC timestamp ('Z' suffix) to a naive UTC datetime, like datetime.utcnow()"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
+
+# Fields of the trip response the display uses. The response is large (stop
+# sequences, path coordinates, fares): up to streamjson.MAX_WHOLE_DOCUMENT it
+# is parsed whole, beyond that only these are read from the stream and the
+# rest of the body is skipped (see streamjson.py).
+def train_departure_paths(journey):
+    """(estimated, planned, via) paths of a journey's departure"""
+    leg = ('journeys', journey, 'legs', 0)
+    return (leg + ('origin', 'departureTimeEstimated'), leg + ('origin', 'departureTimePlanned'),
+            leg + ('transportation', 'destination', 'name'))
+
+def train_fields(trips):
+    return [path for journey in range(trips) for path in train_departure_paths(journey)]
+
+def parse_train_fields(fields, trips):
+    """Timetable of the departures (sorted) read from a Transport NSW rapidJSON trip response"""
+    departures = []
+    for journey in range(trips):
+        estimated, planned, via = train_departure_paths(journey)
+        departure_time_utc = fields.get(estimated) or fields.get(planned)
+        if departure_time_utc:
+            departures.append({'departure_time': departure_time_utc, 'via': fields.get(via, '')})
+    
+    if departures:
+        departures.sort(key=lambda departure: parse_utc(departure['departure_time']))
+        logger.info(f"Train data fetched successfully - {len(departures)} departures from {departures[0]['departure_time']}")
+        return {'departures': departures}
+    
+    logger.warning("No train data available")
+    return {'error': 'No train data available'}
+
+def get_train_trips(train_config):
+    return int(train_config.get('trips', DEFAULT_TRAIN_TRIPS))
+
+def upcoming_departures(timetable, now=None):
+    """The next departure and the ones after it, served from a cached timetable"""
+    if 'error' in timetable:
+        return timetable
+    now = now or datetime.utcnow()
+    upcoming = [departure for departure in timetable['departures'] if parse_utc(departure['departure_time']) > now]
+    if not upcoming:
+        return {'error': 'No upcoming departures'}
+    return {
+        'departure_time': upcoming[0]['departure_time'],
+        'via': upcoming[0]['via'],
+        'departures': upcoming[:SERVED_DEPARTURES]
+    }
+
+def get_timetable_ttl():
+    """
+    Age in seconds at which the cached timetables run low: the first time
+    any trip has fewer than its min_departures upcoming departures left.
+    """
+    entry = result_cache.get(cache_key('train'))
+    if entry is None or 'error' in entry[0]:
+        return MIN_TIMETABLE_TTL
+    
+    timetables, stored_at = entry
+    low_at = None
+    for key, train_config in get_source_items('train').items():
+        departures = (timetables.get(key) or {}).get('departures')
+        if not departures:
+            continue
+        min_departures = int(train_config.get('min_departures', DEFAULT_TRAIN_MIN_DEPARTURES))
+        # Once this departure has left, fewer than min_departures are left
+        departure = parse_utc(departures[max(len(departures) - min_departures, 0)]['departure_time'])
+        low_at = departure if low_at is None else min(low_at, departure)
+    
+    if low_at is None:
+        return MIN_TIMETABLE_TTL
+    return max(int((low_at - stored_at).total_seconds()), MIN_TIMETABLE_TTL)
+
+def fetch_train_data(train_config=None):
+    """Fetch train schedule data from Transport NSW API (global train config unless a profile's is given)"""
     try:
-        train_config = config.get('train', {})
+        train_config = train_config or config.get('train', {})
         api_key = train_config.get('api_key')
         origin = train_config.get('origin')
         destination = train_config.get('destination')
@@ -375,50 +865,13 @@ def fetch_train_data():
             return {'error': 'Train API not fully configured'}
         
         logger.info(f"Fetching train data from {origin} to {destination}")
-        url = f"https://api.transport.nsw.gov.au/v1/tp/trip"
-        params = {
-            'outputFormat': 'rapidJSON',
-            'coordOutputFormat': 'EPSG:4326',
-            'depArrMacro': 'dep',
-            'type_origin': 'any',
-            'name_origin': origin,
-            'type_destination': 'any',
-            'name_destination': destination,
-            'calcNumberOfTrips': '1',
-            'excludedMeans': 'checkbox',
-            'exclMOT_5': '1',
-            'TfNSWTR': 'true',
-            'version': '10.2.1.42',
-            'itOptionsActive': '1',
-            'cycleSpeed': '16'
-        }
-        
-        headers = {
-            'Authorization': f'apikey {api_key}',
-            'Accept': 'application/json'
-        }
-        
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if 'journeys' in data and len(data['journeys']) > 0:
-            journey = data['journeys'][0]
-            if 'legs' in journey and len(journey['legs']) > 0:
-                leg = journey['legs'][0]
-                
-                departure_time_utc = leg['origin'].get('departureTimeEstimated', '')
-                via_destination = leg['transportation']['destination'].get('name', '')
-                
-                logger.info(f"Train data fetched successfully - Next departure at {departure_time_utc}")
-                return {
-                    'departure_time': departure_time_utc,
-                    'via': via_destination
-                }
-        
-        logger.warning("No train data available")
-        return {'error': 'No train data available'}
+        trips = get_train_trips(train_config)
+        response = http_get(build_train_url(), upstream='train', params=build_train_params(origin, destination, trips),
+                            headers=build_train_headers(api_key), stream=True)
+        # Closing the response once the fields are read drops the unread rest of the body
+        with response:
+            response.raise_for_status()
+            return parse_train_fields(extract_fields(response.iter_content(CHUNK_SIZE), train_fields(trips)), trips)
     except requests.exceptions.HTTPError as e:
         status_code = e.response.status_code if e.response else 'unknown'
         logger.error(f"HTTP error fetching train data: {status_code} - {e}")
@@ -435,10 +888,462 @@ def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': datetime.utcnow().isoformat(),
+        'cache': result_cache.get_stats(),
+        'budget': rate_budget.get_stats(),
+        'circuits': circuit_breakers.get_stats()
     })
 
+# Metrics (see metrics.py)
+# Request timing and sizes are recorded by request hooks; values other parts
+# already keep (cache statistics, snapshot ages) are read at scrape time.
+def collect_cache_metrics():
+    """Result cache counters and hit ratios, from the statistics the cache keeps anyway"""
+    stats = result_cache.get_stats()
+    # Every lookup is exactly one of hit, fetch (this caller fetches) or coalesced (joins a fetch)
+    lookups = stats['hits'] + stats['fetches'] + stats['coalesced']
+    lookups_help = 'Result cache lookups by result'
+    return [
+        ('middleware_cache_lookups_total', 'counter', lookups_help, (('result', 'hit'),), stats['hits']),
+        ('middleware_cache_lookups_total', 'counter', lookups_help, (('result', 'fetch'),), stats['fetches']),
+        ('middleware_cache_lookups_total', 'counter', lookups_help, (('result', 'coalesced'),), stats['coalesced']),
+        ('middleware_cache_stale_served_total', 'counter', 'Lookups answered with a stale value while refreshing',
+         (), stats['stale_served']),
+        ('middleware_cache_hit_ratio', 'gauge', 'Share of lookups answered fresh from the cache',
+         (), stats['hits'] / lookups if lookups else 0.0),
+        ('middleware_cache_stale_hit_ratio', 'gauge', 'Share of lookups answered with a stale value',
+         (), stats['stale_served'] / lookups if lookups else 0.0)
+    ]
+
+def collect_snapshot_metrics():
+    """Age of each source's snapshot"""
+    now = datetime.utcnow()
+    samples = []
+    with snapshot['lock']:
+        for name, entry in snapshot['sources'].items():
+            if entry['timestamp'] is not None:
+                samples.append(('middleware_source_age_seconds', 'gauge', 'Age of the latest data of each source',
+                                (('source', name),), (now - entry['timestamp']).total_seconds()))
+    return samples
+
+def collect_budget_metrics():
+    """Calls made and allowed in the current quota window of each provider"""
+    samples = []
+    for provider, periods in rate_budget.get_stats().items():
+        for period, stats in periods.items():
+            labels = (('provider', provider), ('period', period))
+            samples.append(('middleware_budget_used', 'gauge', 'Upstream calls made in the current quota window',
+                            labels, stats['used']))
+            samples.append(('middleware_budget_limit', 'gauge', 'Upstream calls allowed per quota window',
+                            labels, stats['limit']))
+    return samples
+
+def collect_circuit_metrics():
+    """Whether calls to each upstream are being skipped (1 while its breaker is open or half-open)"""
+    return [('middleware_circuit_open', 'gauge', 'Circuit breaker of an upstream is open (1) or closed (0)',
+             (('upstream', name),), 0 if stats['state'] == 'closed' else 1)
+            for name, stats in circuit_breakers.get_stats().items()]
+
+metrics.add_collector(collect_cache_metrics)
+metrics.add_collector(collect_snapshot_metrics)
+metrics.add_collector(collect_budget_metrics)
+metrics.add_collector(collect_circuit_metrics)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = (('endpoint', request.url_rule.rule if request.url_rule else 'unmatched'),)
+    g.metrics_start = time.perf_counter()
+    metrics.inc('middleware_requests_in_flight', g.metrics_endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    metrics.observe('middleware_request_seconds', g.metrics_endpoint, time.perf_counter() - g.metrics_start)
+    size = response.calculate_content_length()
+    if size is not None:
+        metrics.observe('middleware_response_bytes', g.metrics_endpoint, size)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+    if 'metrics_endpoint' in g:
+        metrics.dec('middleware_requests_in_flight', g.metrics_endpoint)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics of this worker process"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Background refresh scheduler
+# Each source is refreshed on its own interval by a daemon thread and the
+# latest result is kept in an in-memory snapshot. The display endpoints only
+# read the snapshot, so the board never waits on a slow upstream API.
+DEFAULT_REFRESH_INTERVALS = {
+    'weather': 600,    # 10 minutes
+    'crypto': 300,     # 5 minutes
+    'stock': 3600,     # 1 hour (MarketStack results are also cached for 24 hours)
+    'train': 60        # 1 minute
+}
+
+# Device profiles
+# Each display can select a profile from the 'profiles' config section with
+# ?device=<id> or an X-Device-ID header. A profile overrides fields of the
+# global sections (e.g. a different city or stock symbol). Every source keeps
+# one item per distinct setting across all profiles, refreshed together.
+def get_profile_config(section, device_id=None):
+    """Section config for a device: the global section with the profile's overrides on top"""
+    section_config = dict(config.get(section, {}) or {})
+    if device_id is not None:
+        profile = (config.get('profiles', {}) or {}).get(device_id, {}) or {}
+        section_config.update(profile.get(section, {}) or {})
+    return section_config
+
+def resolve_device_id(device_id):
+    """Return the device ID if it names a configured profile; unknown devices get the default profile"""
+    if not device_id:
+        return None
+    if device_id not in (config.get('profiles', {}) or {}):
+        logger.warning(f"Unknown device profile '{device_id}', using default profile")
+        return None
+    return device_id
+
+def weather_item_key(weather_config):
+    if weather_config.get('latitude') is not None and weather_config.get('longitude') is not None:
+        location = f"{weather_config['latitude']},{weather_config['longitude']}"
+    else:
+        location = _normalize_address(weather_config.get('city', 'Sydney'), weather_config.get('country', 'AU'))
+    return f"{location}|{weather_config.get('units', 'metric')}"
+
+def crypto_item_key(crypto_config):
+    return crypto_config.get('symbol', 'btc').lower()
+
+def stock_item_key(stock_config):
+    return stock_config.get('symbol', 'AAPL').upper()
+
+def train_item_key(train_config):
+    return f"{train_config.get('origin')}>{train_config.get('destination')}"
+
+SOURCE_ITEM_KEYS = {
+    'weather': weather_item_key,
+    'crypto': crypto_item_key,
+    'stock': stock_item_key,
+    'train': train_item_key
+}
+
+def get_source_items(name):
+    """All distinct {item key: section config} of a source across the default config and every profile"""
+    items = {}
+    for device_id in [None] + list(config.get('profiles', {}) or {}):
+        section_config = get_profile_config(name, device_id)
+        items.setdefault(SOURCE_ITEM_KEYS[name](section_config), section_config)
+    return items
+
+def fetch_weather_items():
+    """Weather can't be batched upstream: one call per distinct location"""
+    return {key: fetch_weather_data(item) for key, item in get_source_items('weather').items()}
+
+def fetch_crypto_items():
+    """All crypto symbols of all profiles in one CoinGecko call"""
+    return fetch_crypto_data(list(get_source_items('crypto')))
+
+def fetch_stock_items():
+    """All stock symbols of all profiles in one MarketStack call"""
+    return fetch_stock_data(list(get_source_items('stock')))
+
+def fetch_train_items():
+    """Trips can't be batched upstream: one call per distinct origin/destination"""
+    return {key: fetch_train_data(item) for key, item in get_source_items('train').items()}
+
+SOURCE_FETCHERS = {
+    'weather': fetch_weather_items,
+    'crypto': fetch_crypto_items,
+    'stock': fetch_stock_items,
+    'train': fetch_train_items
+}
+
+# What is served from a cached item, when it is not the item itself
+SOURCE_VIEWS = {
+    'weather': current_weather,
+    'train': upcoming_departures
+}
+
+def cache_key(name):
+    """Result cache key of a source (its value is the {item key: result} map)"""
+    return f"{name}:items"
+
+def keep_good_items(name, items):
+    """Replace failed items of a fresh fetch with their last good cached value"""
+    if 'error' in items:
+        return items
+    
+    previous = result_cache.get(cache_key(name))
+    if previous is not None and 'error' not in previous[0]:
+        for key, item in items.items():
+            if 'error' in item and key in previous[0] and 'error' not in previous[0][key]:
+                logger.warning(f"Refresh of {name} item {key} failed ({item['error']}), keeping previous value")
+                items[key] = previous[0][key]
+    return items
+
+snapshot = {
+    'sources': {name: {'data': None, 'timestamp': None} for name in SOURCE_FETCHERS},
+    'lock': threading.Lock()
+}
+
+scheduler_stop = threading.Event()
+scheduler_running = threading.Event()
+
+def get_refresh_interval(name):
+    """Return the refresh interval in seconds for a source (never shorter than its quota allows)"""
+    intervals = config.get('scheduler', {}).get('intervals_seconds', {})
+    return max(int(intervals.get(name, DEFAULT_REFRESH_INTERVALS[name])), get_budget_interval(name))
+
+def refresh_source(name, background=False):
+    """
+    Fetch a single source and store the result in the snapshot.
+    
+    The upstream is only called when the shared result cache has no entry
+    younger than the source's TTL, and concurrent refreshes of the same
+    source share one fetch. With background=True a stale cached value is
+    returned right away and the snapshot is updated when the fetch is done.
+    
+    If the upstream call fails and we already have good data, the previous
+    value is kept so the display keeps showing something useful; its age
+    keeps growing so the staleness is still visible.
+    """
+    data, timestamp = result_cache.get_or_fetch(
+        cache_key(name), get_cache_ttl(name), lambda: keep_good_items(name, SOURCE_FETCHERS[name]()),
+        background=fetch_executor if background else None,
+        on_complete=lambda data, timestamp: store_source_data(name, data, timestamp)
+    )
+    return store_source_data(name, data, timestamp)
+
+def store_source_data(name, data, timestamp=None):
+    """Store a result and the time it was fetched in the snapshot and return the value now served"""
+    with snapshot['lock']:
+        entry = snapshot['sources'][name]
+        if 'error' in data and entry['data'] is not None and 'error' not in entry['data']:
+            logger.warning(f"Refresh of {name} failed ({data['error']}), keeping previous snapshot")
+            return entry['data']
+        
+        entry['data'] = data
+        entry['timestamp'] = timestamp or datetime.utcnow()
+    
+    return data
+
+def _refresh_loop(name):
+    """Refresh a source forever on its interval, re-read after every refresh as the quota is used"""
+    interval = get_refresh_interval(name)
+    logger.info(f"Scheduler started for {name} (interval: {interval}s)")
+    
+    while not scheduler_stop.is_set():
+        try:
+            refresh_source(name)
+        except Exception as e:
+            logger.error(f"Scheduler error refreshing {name}: {e}")
+        interval = log_interval_change(name, interval, get_refresh_interval(name))
+        scheduler_stop.wait(interval)
+
+def log_interval_change(name, previous, interval):
+    """Log when quota pacing changes a source's refresh interval and return the new interval"""
+    if interval != previous:
+        logger.info(f"Refresh interval of {name} is now {interval}s (was {previous}s) to stay within quota")
+    return interval
+
+def refresh_all_sources():
+    """Refresh every source in parallel on the shared executor and wait for all of them"""
+    futures = {name: fetch_executor.submit(refresh_source, name) for name in SOURCE_FETCHERS}
+    return {name: future.result() for name, future in futures.items()}
+
+def warm_snapshot():
+    """Fill the snapshot from the result cache so a restart serves the last known data immediately"""
+    for name in SOURCE_FETCHERS:
+        entry = result_cache.get(cache_key(name))
+        if entry is not None:
+            store_source_data(name, *entry)
+            logger.info(f"Warm-loaded {name} from cache (age: {datetime.utcnow() - entry[1]})")
+
+def start_scheduler():
+    """Start one background refresh thread per source"""
+    scheduler_running.set()
+    for name in SOURCE_FETCHERS:
+        thread = threading.Thread(target=_refresh_loop, args=(name,), name=f"refresh-{name}", daemon=True)
+        thread.start()
+
+def get_source_data(name, device_id=None):
+    """
+    Return a device's item from the snapshot of a source with its age in seconds.
+    
+    The upstream is only fetched inline before the first refresh has
+    completed (cold start). When the scheduler is disabled and the snapshot
+    is older than the refresh interval, the stale snapshot is returned and
+    refreshed in the background.
+    """
+    data, timestamp, expired = read_snapshot(name)
+    
+    if data is None:
+        logger.info(f"No snapshot for {name} yet, fetching inline")
+        metrics.inc('middleware_snapshot_reads_total', (('source', name), ('result', 'miss')))
+        refresh_source(name)
+        data, timestamp, _ = read_snapshot(name)
+    elif expired:
+        metrics.inc('middleware_snapshot_reads_total', (('source', name), ('result', 'stale')))
+        refresh_source(name, background=True)
+    else:
+        metrics.inc('middleware_snapshot_reads_total', (('source', name), ('result', 'fresh')))
+    
+    return with_age(select_item(name, data, device_id), timestamp)
+
+def select_item(name, data, device_id):
+    """Pick a device's item out of a source's {item key: result} map"""
+    if 'error' in data:
+        return data
+    item_key = SOURCE_ITEM_KEYS[name](get_profile_config(name, device_id))
+    item = data.get(item_key, {'error': f'No {name} data for this device'})
+    view = SOURCE_VIEWS.get(name)
+    return view(item) if view else item
+
+def read_snapshot(name):
+    """
+    Return (data, timestamp, expired) for a source. 'expired' is only set
+    when the scheduler is not running and the snapshot is older than the
+    refresh interval.
+    """
+    with snapshot['lock']:
+        entry = snapshot['sources'][name]
+        data = entry['data']
+        timestamp = entry['timestamp']
+    
+    expired = (timestamp is not None and not scheduler_running.is_set() and
+               (datetime.utcnow() - timestamp).total_seconds() >= get_refresh_interval(name))
+    return data, timestamp, expired
+
+def with_age(data, timestamp):
+    """Copy of a snapshot entry with its 'age_seconds' field"""
+    result = dict(data)
+    result['age_seconds'] = int((datetime.utcnow() - timestamp).total_seconds())
+    return result
+
+# Serving mode: 'flask' (gunicorn + threads, default) or 'asgi' (uvicorn + asyncio, see asgi.py)
+SERVER_MODE = os.getenv('SERVER_MODE', 'flask').lower()
+
+def is_scheduler_enabled():
+    """The scheduler can be disabled via config or the SCHEDULER_ENABLED environment variable"""
+    env_value = os.getenv('SCHEDULER_ENABLED')
+    if env_value is not None:
+        return env_value.lower() == 'true'
+    return config.get('scheduler', {}).get('enabled', True)
+
+# Response deadlines
+# The firmware's HTTP client gives up after 5 seconds, so /api/data answers
+# within 'deadlines.total_seconds' even when a source has to be fetched
+# inline. A source that is not ready within its own deadline is answered
+# with its last good value, flagged 'stale'; its fetch carries on and fills
+# the cache and snapshot for the next request.
+DEFAULT_AGGREGATE_DEADLINE = 4.0
+DEFAULT_SOURCE_DEADLINES = {
+    'weather': 3.5,     # geocoding and weather on a cold start
+    'crypto': 2.5,
+    'stock': 2.5,
+    'train': 3.0
+}
+
+def get_source_deadlines():
+    """Seconds from the start of a request each source may take, capped by the overall deadline"""
+    deadline_config = config.get('deadlines', {}) or {}
+    total = float(deadline_config.get('total_seconds', DEFAULT_AGGREGATE_DEADLINE))
+    sources = deadline_config.get('sources_seconds', {}) or {}
+    return {name: min(float(sources.get(name, DEFAULT_SOURCE_DEADLINES[name])), total) for name in SOURCE_FETCHERS}
+
+def late_source_data(name, device_id=None):
+    """Last good value of a source that missed its deadline, flagged 'stale' (from the cache on a cold start)"""
+    metrics.inc('middleware_deadline_missed_total', (('source', name),))
+    data, timestamp, _ = read_snapshot(name)
+    if data is None or 'error' in data:
+        entry = result_cache.get(cache_key(name))
+        if entry is not None:
+            data, timestamp = entry
+    if data is None:
+        logger.warning(f"{name} missed its deadline and has no previous data")
+        return {'error': f'No {name} data yet'}
+    
+    logger.warning(f"{name} missed its deadline, serving data from {timestamp.isoformat()}")
+    result = with_age(select_item(name, data, device_id), timestamp)
+    result['stale'] = True
+    return result
+
+def build_aggregate(device_id=None):
+    """The /api/data response: every source for a device, with the current time"""
+    # Sources are read in parallel so a cold start waits for the slowest
+    # upstream only, not for the sum of all of them, and no longer than its deadline
+    start = time.monotonic()
+    deadlines = get_source_deadlines()
+    futures = {name: fetch_executor.submit(get_source_data, name, device_id) for name in SOURCE_FETCHERS}
+    
+    sections = {}
+    for name, future in futures.items():
+        try:
+            sections[name] = future.result(timeout=max(start + deadlines[name] - time.monotonic(), 0))
+        except FutureTimeoutError:
+            sections[name] = late_source_data(name, device_id)
+    
+    return {'timestamp': datetime.utcnow().isoformat(), **sections,
+            'next_refresh_seconds': get_next_refresh_seconds(sections)}
+
+def get_next_refresh_seconds(sections, now=None):
+    """Seconds until any of the served sections can change (see wake.py), for the display to sleep until then"""
+    now = now or datetime.utcnow()
+    changes = []
+    for name, section in sections.items():
+        fetched_at = now - timedelta(seconds=section.get('age_seconds', 0))
+        refresh_at = fetched_at + timedelta(seconds=max(get_cache_ttl(name), get_refresh_interval(name)))
+        if 'age_seconds' not in section:
+            # Nothing served yet (missed its deadline on a cold start); its fetch is still running
+            refresh_at = now
+        changes.append(next_change(name, section, fetched_at, refresh_at, now))
+    return next_wake_seconds(changes, now)
+
+def prefers_binary_payload(path, accept):
+    """Binary payload for /api/data.bin, or for /api/data when the Accept header (q-values included) prefers it"""
+    if path.endswith('.bin'):
+        return True
+    accepted = parse_accept_header(accept, MIMEAccept)
+    return accepted.best_match(['application/json', PAYLOAD_MIMETYPE]) == PAYLOAD_MIMETYPE
+
+def wants_binary_payload():
+    return prefers_binary_payload(request.path, request.headers.get('Accept'))
+
+# The firmware shows local time for Australia Eastern (ausET in main.ino)
+DEFAULT_DISPLAY_TIMEZONE = 'Australia/Sydney'
+
+def get_display_timezone():
+    return ZoneInfo(config.get('display', {}).get('timezone', DEFAULT_DISPLAY_TIMEZONE))
+
+def get_display_labels(device_id=None):
+    """Configured names the firmware shows next to the data (city and symbols)"""
+    return {
+        'city': get_profile_config('weather', device_id).get('city', 'Sydney'),
+        'crypto_symbol': get_profile_config('crypto', device_id).get('symbol', 'btc'),
+        'stock_symbol': get_profile_config('stock', device_id).get('symbol', 'AAPL')
+    }
+
+def get_request_device_id():
+    """Device profile of the current request (?device=<id> or X-Device-ID header)"""
+    return resolve_device_id(request.args.get('device') or request.headers.get('X-Device-ID'))
+
+def make_conditional_response(data, body, representation, mimetype):
+    """Response for data encoded as body: 304 if the client holds its ETag, compressed if accepted"""
+    status, body, headers = conditional_response(data, body, representation, request.headers.get('If-None-Match'),
+                                                 request.headers.get('Accept-Encoding'))
+    if status == 304:
+        metrics.inc('middleware_not_modified_total', g.metrics_endpoint)
+    return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+def source_response(name):
+    """Response of a per-source endpoint"""
+    data = get_source_data(name, get_request_device_id())
+    return make_conditional_response(data, jsonify(data).get_data(), 'json', 'application/json')
+
 @app.route('/api/data', methods=['POST', 'GET'])
+@app.route('/api/data.bin', methods=['POST', 'GET'])
 def get_aggregated_data():
     """
     Main endpoint that aggregates all data sources.
@@ -449,6 +1354,19 @@ def get_aggregated_data():
     POST is also accepted for backward compatibility with existing
     ESP32 firmware, which issues POST requests with an empty body
     when fetching the aggregated data.
+    
+    Data is served from the background refresh snapshot. Each section
+    carries an 'age_seconds' field telling how stale it is, and
+    'next_refresh_seconds' tells the display how long it can sleep before
+    any of them can change.
+    
+    /api/data.bin (or Accept: application/octet-stream) returns the same
+    data as the compact binary payload defined in payload.py.
+    
+    Responses carry an ETag of the displayed data and are answered with 304
+    when it matches If-None-Match; bodies are compressed when the client
+    accepts it (see conditional.py). X-Next-Refresh repeats
+    next_refresh_seconds so a 304 carries it too.
     """
     try:
         # Log incoming request
@@ -456,29 +1374,15 @@ def get_aggregated_data():
         method = request.method
         logger.info(f"Received {method} request from {client_ip} for aggregated data")
         
-        # Fetch all data in parallel for better performance
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            weather_future = executor.submit(fetch_weather_data)
-            crypto_future = executor.submit(fetch_crypto_data)
-            stock_future = executor.submit(fetch_stock_data)
-            train_future = executor.submit(fetch_train_data)
-            
-            # Wait for all results
-            weather = weather_future.result()
-            crypto = crypto_future.result()
-            stock = stock_future.result()
-            train = train_future.result()
-        
-        response = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'weather': weather,
-            'crypto': crypto,
-            'stock': stock,
-            'train': train
-        }
+        response = build_aggregate(get_request_device_id())
         
         logger.info(f"Successfully aggregated data for {client_ip}")
-        return jsonify(response)
+        if wants_binary_payload():
+            result = make_conditional_response(response, encode_payload(response), 'binary', PAYLOAD_MIMETYPE)
+        else:
+            result = make_conditional_response(response, jsonify(response).get_data(), 'json', 'application/json')
+        result.headers['X-Next-Refresh'] = str(response['next_refresh_seconds'])
+        return result
     except Exception as e:
         logger.error(f"Error aggregating data: {e}")
         return jsonify({
@@ -486,29 +1390,74 @@ def get_aggregated_data():
             'timestamp': datetime.utcnow().isoformat()
         }), 500
 
+@app.route('/api/frame', methods=['GET'])
+def get_display_frame():
+    """
+    The whole display, rendered by the middleware (see render.py).
+    
+    Returns a zlib-compressed 960x540 4bpp framebuffer the board only has
+    to inflate and blit. Frames are cached until the displayed values change.
+    
+    A board that sends the CRC of the frame it shows (X-Frame-Hash header or
+    ?hash=) gets only the changed rectangles, or a full frame if the
+    middleware no longer has that frame.
+    
+    The X-Next-Refresh header carries the aggregate's next_refresh_seconds.
+    Without the font and icon headers (see render.ASSETS_DIR) it answers 503.
+    """
+    try:
+        device_id = get_request_device_id()
+        logger.info(f"Received request from {request.remote_addr} for display frame")
+        
+        device_crc = parse_frame_crc(request.headers.get('X-Frame-Hash') or request.args.get('hash'))
+        aggregate = build_aggregate(device_id)
+        frame = get_frame(device_id, aggregate, get_display_labels(device_id), get_display_timezone(),
+                          frame_history, device_crc)
+        return Response(frame, mimetype=FRAME_MIMETYPE,
+                        headers={'X-Next-Refresh': str(aggregate['next_refresh_seconds'])})
+    except AssetsMissing as e:
+        # The board draws locally instead; nothing to retry until the headers are there
+        logger.error(f"Cannot render frames: {e}")
+        return jsonify({
+            'error': str(e),
+            'timestamp': datetime.utcnow().isoformat()
+        }), 503
+    except Exception as e:
+        logger.error(f"Error rendering frame: {e}")
+        return jsonify({
+            'error': str(e),
+            'timestamp': datetime.utcnow().isoformat()
+        }), 500
+
 @app.route('/api/weather', methods=['GET'])
 def get_weather():
     """Endpoint for weather data only"""
     logger.info(f"Received request from {request.remote_addr} for weather data")
-    return jsonify(fetch_weather_data())
+    return source_response('weather')
 
 @app.route('/api/crypto', methods=['GET'])
 def get_crypto():
     """Endpoint for crypto data only"""
     logger.info(f"Received request from {request.remote_addr} for crypto data")
-    return jsonify(fetch_crypto_data())
+    return source_response('crypto')
 
 @app.route('/api/stock', methods=['GET'])
 def get_stock():
     """Endpoint for stock data only"""
     logger.info(f"Received request from {request.remote_addr} for stock data")
-    return jsonify(fetch_stock_data())
+    return source_response('stock')
 
 @app.route('/api/train', methods=['GET'])
 def get_train():
     """Endpoint for train data only"""
     logger.info(f"Received request from {request.remote_addr} for train data")
-    return jsonify(fetch_train_data())
+    return source_response('train')
+
+warm_snapshot()
+
+# In ASGI mode the asyncio app runs its own refresh tasks
+if SERVER_MODE == 'flask' and is_scheduler_enabled():
+    start_scheduler()
 
 if __name__ == '__main__':
     # Run the Flask app
@@ -516,5 +1465,9 @@ if __name__ == '__main__':
     host = os.getenv('HOST', '0.0.0.0')
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
     
-    logger.info(f"Starting middleware server on {host}:{port}")
-    app.run(host=host, port=port, debug=debug)
+    logger.info(f"Starting middleware server on {host}:{port} ({SERVER_MODE} mode)")
+    if SERVER_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run('asgi:app', host=host, port=port)
+    else:
+        app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,482 @@
+"""
+LILYGO T5 Weather Display - Middleware API (ASGI mode)
+Asyncio alternative to the Flask + threads server in app.py, selected with SERVER_MODE=asgi.
+
+The endpoints and response format are identical to app.py, so existing
+firmware works unchanged. Upstream requests are made with a shared
+httpx.AsyncClient and fanned out with asyncio.gather instead of threads.
+Request building, response parsing and the caches are shared with app.py.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Imported by uvicorn without SERVER_MODE=asgi, app.py would also start its
+# thread scheduler next to the refresh tasks below and fetch everything twice
+os.environ['SERVER_MODE'] = 'asgi'
+
+import app as middleware
+from app import config, logger
+from conditional import conditional_response
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from payload import PAYLOAD_MIMETYPE, encode_payload
+from render import FRAME_MIMETYPE, AssetsMissing, get_frame, parse_frame_crc
+from streamjson import CHUNK_SIZE, FieldExtractor
+
+http_client = {
+    'client': None
+}
+
+def get_http_client():
+    """Return the process-wide async client, creating it on first use"""
+    if http_client['client'] is None:
+        http_config = middleware._get_http_config()
+        pool_size = int(http_config.get('pool_size', middleware.DEFAULT_HTTP_POOL_SIZE))
+        # One client for all hosts; httpx keeps a keep-alive pool per host internally
+        limits = httpx.Limits(max_connections=pool_size * len(middleware.SOURCE_FETCHERS),
+                              max_keepalive_connections=pool_size * len(middleware.SOURCE_FETCHERS))
+        http_client['client'] = httpx.AsyncClient(limits=limits)
+    return http_client['client']
+
+async def http_get(url, upstream=None, stream=False, **kwargs):
+    """
+    Async counterpart of app.http_get, using the same per-host timeouts and metrics.
+    With stream=True the body is not read; the caller reads it and closes the response.
+    """
+    host = urlparse(url).netloc
+    kwargs.setdefault('timeout', middleware.get_http_timeout(host))
+    labels = (('upstream', upstream or host),)
+    breaker = await asyncio.to_thread(middleware.begin_upstream_call, upstream or host, upstream)
+
+    metrics.inc('middleware_upstream_in_flight', labels)
+    start = time.perf_counter()
+    try:
+        client = get_http_client()
+        response = await client.send(client.build_request('GET', url, **kwargs), stream=stream)
+    except Exception:
+        metrics.inc('middleware_upstream_errors_total', labels)
+        breaker.record(False)
+        raise
+    finally:
+        metrics.observe('middleware_upstream_request_seconds', labels, time.perf_counter() - start)
+        metrics.dec('middleware_upstream_in_flight', labels)
+
+    if response.status_code >= 400:
+        metrics.inc('middleware_upstream_errors_total', labels)
+    breaker.record(not middleware.is_failure_status(response.status_code))
+    return response
+
+def _error_result(source, e):
+    """Map an httpx exception to the same error dict the sync fetchers return"""
+    if isinstance(e, httpx.HTTPStatusError):
+        status_code = e.response.status_code
+        logger.error(f"HTTP error fetching {source} data: {status_code} - {e}")
+        return {'error': f'HTTP {status_code}: {str(e)}'}
+    if isinstance(e, httpx.RequestError):
+        logger.error(f"Network error fetching {source} data: {e}")
+        return {'error': f'Network error: {str(e)}'}
+    logger.error(f"Error fetching {source} data: {e}")
+    return {'error': str(e)}
+
+async def fetch_weather_data(weather_config):
+    """Fetch weather data and the hourly forecast from Google Weather API"""
+    try:
+        api_key = weather_config.get('api_key')
+        city = weather_config.get('city', 'Sydney')
+        units = weather_config.get('units', 'metric')
+
+        if not api_key:
+            logger.warning("Weather API key not configured")
+            return {'error': 'Weather API key not configured'}
+
+        coordinates = middleware.get_known_coordinates(weather_config)
+        if coordinates is None:
+            geocode_response = await http_get(middleware.build_geocode_url(weather_config), upstream='geocode')
+            geocode_response.raise_for_status()
+            coordinates = await asyncio.to_thread(middleware.store_geocode_result, weather_config,
+                                                  geocode_response.json())
+
+        fetched_at = datetime.utcnow()
+        weather_response = await http_get(middleware.build_weather_url(api_key, *coordinates), upstream='weather')
+        weather_response.raise_for_status()
+        weather = middleware.parse_weather_response(weather_response.json(), city, units)
+
+        hours = middleware.get_forecast_hours(weather_config)
+        if hours > 0:
+            try:
+                forecast_response = await http_get(middleware.build_forecast_url(api_key, *coordinates, hours),
+                                                   upstream='weather')
+                forecast_response.raise_for_status()
+                weather['forecast'] = middleware.parse_forecast_response(forecast_response.json(), weather, units,
+                                                                         fetched_at)
+            except Exception as e:
+                logger.warning(f"Forecast unavailable, serving current conditions only: {e}")
+        return weather
+    except Exception as e:
+        return _error_result('weather', e)
+
+async def fetch_crypto_data(symbols):
+    """Fetch cryptocurrency data for all symbols in one CoinGecko call"""
+    try:
+        api_key = config.get('crypto', {}).get('api_key')
+
+        if not api_key:
+            logger.warning("Crypto API key not configured")
+            return {'error': 'Crypto API key not configured'}
+
+        coin_ids = {symbol: middleware.CRYPTO_SYMBOL_TO_ID.get(symbol, symbol) for symbol in symbols}
+        response = await http_get(middleware.build_crypto_url(sorted(set(coin_ids.values()))), upstream='crypto',
+                                  headers={'x-cg-demo-api-key': api_key})
+        response.raise_for_status()
+
+        data = response.json()
+        return {symbol: middleware.parse_crypto_response(data, symbol, coin_id) for symbol, coin_id in coin_ids.items()}
+    except Exception as e:
+        return _error_result('crypto', e)
+
+async def fetch_stock_data(symbols):
+    """Fetch stock market data for all symbols in one MarketStack call (kept for 24 hours by the result cache)"""
+    try:
+        api_key = config.get('stock', {}).get('api_key')
+
+        if not api_key:
+            logger.warning("Stock API key not configured")
+            return {'error': 'Stock API key not configured'}
+
+        response = await http_get(middleware.build_stock_url(api_key, symbols), upstream='stock')
+        response.raise_for_status()
+
+        return middleware.parse_stock_response(response.json(), symbols)
+    except Exception as e:
+        return _error_result('stock', e)
+
+async def fetch_train_data(train_config):
+    """Fetch train schedule data from Transport NSW API"""
+    try:
+        api_key = train_config.get('api_key')
+        origin = train_config.get('origin')
+        destination = train_config.get('destination')
+
+        if not api_key or not origin or not destination:
+            logger.warning("Train API not fully configured")
+            return {'error': 'Train API not fully configured'}
+
+        trips = middleware.get_train_trips(train_config)
+        response = await http_get(middleware.build_train_url(), upstream='train',
+                                  params=middleware.build_train_params(origin, destination, trips),
+                                  headers=middleware.build_train_headers(api_key), stream=True)
+        try:
+            response.raise_for_status()
+            extractor = FieldExtractor(middleware.train_fields(trips))
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                if extractor.feed(chunk):
+                    break
+            return middleware.parse_train_fields(extractor.results if extractor.done else extractor.close(), trips)
+        finally:
+            await response.aclose()
+    except Exception as e:
+        return _error_result('train', e)
+
+async def _fetch_each(fetch, items):
+    """Fetch unbatchable items (one location or trip each) concurrently"""
+    results = await asyncio.gather(*(fetch(item) for item in items.values()))
+    return dict(zip(items, results))
+
+async def fetch_weather_items():
+    return await _fetch_each(fetch_weather_data, middleware.get_source_items('weather'))
+
+async def fetch_crypto_items():
+    return await fetch_crypto_data(list(middleware.get_source_items('crypto')))
+
+async def fetch_stock_items():
+    return await fetch_stock_data(list(middleware.get_source_items('stock')))
+
+async def fetch_train_items():
+    return await _fetch_each(fetch_train_data, middleware.get_source_items('train'))
+
+ASYNC_FETCHERS = {
+    'weather': fetch_weather_items,
+    'crypto': fetch_crypto_items,
+    'stock': fetch_stock_items,
+    'train': fetch_train_items
+}
+
+# Tasks that outlive the request that started them (stale-while-revalidate
+# fetches, sources past their deadline). The event loop only keeps weak
+# references to tasks, and a collected fetch would leave its waiters hanging.
+background_tasks = set()
+
+def spawn(coroutine):
+    """Run a coroutine as a task that is kept alive until it is done"""
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def _run_fetch(name, ttl, future):
+    """
+    Leader side of a fetch (see ResultCache._run_fetch). The file lock and
+    every cache database access run off the event loop, so a busy database
+    never stalls the other requests.
+    """
+    result_cache = middleware.result_cache
+    key = middleware.cache_key(name)
+    try:
+        lock_file = await asyncio.to_thread(result_cache.acquire, key)
+        try:
+            entry = await asyncio.to_thread(result_cache.get_fresh, key, ttl)
+            if entry is None:
+                fetched = await ASYNC_FETCHERS[name]()
+                items = await asyncio.to_thread(middleware.keep_good_items, name, fetched)
+                entry = await asyncio.to_thread(result_cache.resolve, key, items)
+        finally:
+            result_cache.release(lock_file)
+        middleware.store_source_data(name, *entry)
+    except Exception as e:
+        logger.error(f"Fetching {name} failed: {e}")
+        result_cache.finish(key, future, exception=e)
+        return
+    result_cache.finish(key, future, entry)
+
+async def refresh_source(name, background=False):
+    """
+    Async counterpart of app.refresh_source, going through the same result
+    cache and sharing in-flight fetches with concurrent callers.
+    """
+    result_cache = middleware.result_cache
+    ttl = await asyncio.to_thread(middleware.get_cache_ttl, name)
+
+    entry, future, leader = await asyncio.to_thread(result_cache.claim, middleware.cache_key(name), ttl)
+    if future is None:
+        return middleware.store_source_data(name, *entry)
+
+    if leader:
+        if entry is not None and background:
+            spawn(_run_fetch(name, ttl, future))
+            result_cache.count('stale_served')
+            return middleware.store_source_data(name, *entry)
+        await _run_fetch(name, ttl, future)
+    elif entry is not None:
+        result_cache.count('stale_served')
+        return middleware.store_source_data(name, *entry)
+
+    return middleware.store_source_data(name, *await asyncio.wrap_future(future))
+
+async def _refresh_loop(name):
+    """Refresh a source forever on its interval, re-read after every refresh as the quota is used"""
+    interval = await asyncio.to_thread(middleware.get_refresh_interval, name)
+    logger.info(f"Async scheduler started for {name} (interval: {interval}s)")
+
+    while True:
+        try:
+            await refresh_source(name)
+        except Exception as e:
+            logger.error(f"Scheduler error refreshing {name}: {e}")
+        interval = middleware.log_interval_change(name, interval,
+                                                  await asyncio.to_thread(middleware.get_refresh_interval, name))
+        await asyncio.sleep(interval)
+
+async def get_source_data(name, device_id=None):
+    """Async counterpart of app.get_source_data"""
+    data, timestamp, expired = await asyncio.to_thread(middleware.read_snapshot, name)
+
+    if data is None:
+        logger.info(f"No snapshot for {name} yet, fetching inline")
+        metrics.inc('middleware_snapshot_reads_total', (('source', name), ('result', 'miss')))
+        await refresh_source(name)
+        data, timestamp, _ = await asyncio.to_thread(middleware.read_snapshot, name)
+    elif expired:
+        metrics.inc('middleware_snapshot_reads_total', (('source', name), ('result', 'stale')))
+        await refresh_source(name, background=True)
+    else:
+        metrics.inc('middleware_snapshot_reads_total', (('source', name), ('result', 'fresh')))
+
+    return middleware.with_age(middleware.select_item(name, data, device_id), timestamp)
+
+def get_request_device_id(request):
+    """Device profile of a request (?device=<id> or X-Device-ID header)"""
+    return middleware.resolve_device_id(request.query_params.get('device') or request.headers.get('x-device-id'))
+
+def wants_binary_payload(request):
+    return middleware.prefers_binary_payload(request.url.path, request.headers.get('accept'))
+
+async def get_source_data_within(name, device_id, deadline):
+    """A source's data, or its last good value if it is not ready by the deadline (the fetch carries on)"""
+    task = spawn(get_source_data(name, device_id))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), max(deadline - time.monotonic(), 0))
+    except asyncio.TimeoutError:
+        return await asyncio.to_thread(middleware.late_source_data, name, device_id)
+
+async def build_aggregate(device_id=None):
+    """Async counterpart of app.build_aggregate"""
+    start = time.monotonic()
+    deadlines = middleware.get_source_deadlines()
+    weather, crypto, stock, train = await asyncio.gather(
+        *(get_source_data_within(name, device_id, start + deadlines[name])
+          for name in ('weather', 'crypto', 'stock', 'train'))
+    )
+
+    sections = {
+        'weather': weather,
+        'crypto': crypto,
+        'stock': stock,
+        'train': train
+    }
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        **sections,
+        'next_refresh_seconds': await asyncio.to_thread(middleware.get_next_refresh_seconds, sections)
+    }
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'cache': middleware.result_cache.get_stats(),
+        'budget': await asyncio.to_thread(middleware.rate_budget.get_stats),
+        'circuits': middleware.circuit_breakers.get_stats()
+    })
+
+def conditional(request, data, body, representation, media_type):
+    """Counterpart of app.make_conditional_response: 304 if the client holds the ETag, compressed if accepted"""
+    status, body, headers = conditional_response(data, body, representation, request.headers.get('if-none-match'),
+                                                 request.headers.get('accept-encoding'))
+    if status == 304:
+        metrics.inc('middleware_not_modified_total', (('endpoint', request.url.path),))
+    return Response(body, status_code=status, headers=headers, media_type=media_type)
+
+async def get_aggregated_data(request):
+    """Main endpoint that aggregates all data sources (GET, or POST for older firmware; JSON or binary)"""
+    try:
+        client_ip = request.client.host if request.client else 'unknown'
+        logger.info(f"Received {request.method} request from {client_ip} for aggregated data")
+
+        response = await build_aggregate(get_request_device_id(request))
+
+        logger.info(f"Successfully aggregated data for {client_ip}")
+        if wants_binary_payload(request):
+            result = conditional(request, response, encode_payload(response), 'binary', PAYLOAD_MIMETYPE)
+        else:
+            result = conditional(request, response, JSONResponse(response).body, 'json', 'application/json')
+        result.headers['x-next-refresh'] = str(response['next_refresh_seconds'])
+        return result
+    except Exception as e:
+        logger.error(f"Error aggregating data: {e}")
+        return JSONResponse({
+            'error': str(e),
+            'timestamp': datetime.utcnow().isoformat()
+        }, status_code=500)
+
+async def get_display_frame(request):
+    """The whole display rendered by the middleware, or a diff; rendering runs off the event loop"""
+    try:
+        client_ip = request.client.host if request.client else 'unknown'
+        logger.info(f"Received request from {client_ip} for display frame")
+
+        device_id = get_request_device_id(request)
+        device_crc = parse_frame_crc(request.headers.get('x-frame-hash') or request.query_params.get('hash'))
+        aggregate = await build_aggregate(device_id)
+        frame = await asyncio.to_thread(get_frame, device_id, aggregate, middleware.get_display_labels(device_id),
+                                        middleware.get_display_timezone(), middleware.frame_history, device_crc)
+        return Response(frame, media_type=FRAME_MIMETYPE,
+                        headers={'x-next-refresh': str(aggregate['next_refresh_seconds'])})
+    except AssetsMissing as e:
+        logger.error(f"Cannot render frames: {e}")
+        return JSONResponse({
+            'error': str(e),
+            'timestamp': datetime.utcnow().isoformat()
+        }, status_code=503)
+    except Exception as e:
+        logger.error(f"Error rendering frame: {e}")
+        return JSONResponse({
+            'error': str(e),
+            'timestamp': datetime.utcnow().isoformat()
+        }, status_code=500)
+
+async def get_metrics(request):
+    """Prometheus metrics of this worker process"""
+    return Response(metrics.render(), headers={'content-type': METRICS_CONTENT_TYPE})
+
+def _source_endpoint(name):
+    async def endpoint(request):
+        client_ip = request.client.host if request.client else 'unknown'
+        logger.info(f"Received request from {client_ip} for {name} data")
+        data = await get_source_data(name, get_request_device_id(request))
+        return conditional(request, data, JSONResponse(data).body, 'json', 'application/json')
+    endpoint.__name__ = f"get_{name}"
+    endpoint.__doc__ = f"Endpoint for {name} data only"
+    return endpoint
+
+class MetricsMiddleware:
+    """ASGI counterpart of the request hooks in app.py: timing, size and in-flight count per endpoint"""
+
+    def __init__(self, app, endpoints):
+        self.app = app
+        self.endpoints = endpoints
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        labels = (('endpoint', scope['path'] if scope['path'] in self.endpoints else 'unmatched'),)
+        start = time.perf_counter()
+        size = 0
+
+        async def send_and_count(message):
+            nonlocal size
+            if message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        metrics.inc('middleware_requests_in_flight', labels)
+        try:
+            await self.app(scope, receive, send_and_count)
+        finally:
+            metrics.dec('middleware_requests_in_flight', labels)
+            metrics.observe('middleware_request_seconds', labels, time.perf_counter() - start)
+            metrics.observe('middleware_response_bytes', labels, size)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start the async refresh tasks and close the HTTP client on shutdown"""
+    tasks = []
+    if middleware.is_scheduler_enabled():
+        middleware.scheduler_running.set()
+        tasks = [asyncio.create_task(_refresh_loop(name), name=f"refresh-{name}") for name in ASYNC_FETCHERS]
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+    if http_client['client'] is not None:
+        await http_client['client'].aclose()
+
+routes = [
+    Route('/health', health_check, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/api/data', get_aggregated_data, methods=['GET', 'POST']),
+    Route('/api/data.bin', get_aggregated_data, methods=['GET', 'POST']),
+    Route('/api/frame', get_display_frame, methods=['GET']),
+    Route('/api/weather', _source_endpoint('weather'), methods=['GET']),
+    Route('/api/crypto', _source_endpoint('crypto'), methods=['GET']),
+    Route('/api/stock', _source_endpoint('stock'), methods=['GET']),
+    Route('/api/train', _source_endpoint('train'), methods=['GET'])
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(MetricsMiddleware, endpoints={route.path for route in routes})],
+    lifespan=lifespan
+)
@@ -0,0 +1,321 @@
+"""
+LILYGO T5 Weather Display - Middleware font and icon compiler
+Builds smaller drop-in copies of the firmware's font and icon headers.
+
+The Lexend headers in lib/fonts/src come from epdiy's fontconvert with
+printable ASCII and Latin-1 (191 glyphs per size), and the icons in
+lib/icons/src are raw 4bpp bitmaps. The display draws far fewer
+characters than that, so for every font size this keeps only the glyphs in
+FONT_CHARSETS (plus any given with --keep):
+
+- sizes that draw configured or upstream text (city, condition, stations,
+  symbols) keep printable ASCII; the others only what their fixed strings
+  and values need. Lexend32 is not drawn and keeps just the space.
+- every kept glyph is re-deflated with the strategy that gives the
+  smallest zlib stream (never larger than fontconvert's), and identical
+  streams are stored once.
+- icons become zlib streams. The firmware inflates an icon whose data is
+  smaller than width * height / 2 bytes before drawing it, and still draws
+  raw icons as they are.
+
+The headers keep their names, symbols and layout, so the output directory
+can replace lib/ as a whole; the T5-ePaper-S3-compact PlatformIO
+environment builds with it instead of lib/. Epdiy skips characters a font does not have.
+
+Run this module directly to compile the headers into --output, check that
+every kept glyph and icon decodes to exactly the original pixels (and that a
+rendered frame is identical) and report the flash saved.
+"""
+
+import json
+import os
+import shutil
+import zlib
+
+import render
+
+DIGITS = '0123456789'
+MONTHS = 'JanFebMarAprMayJunJulAugSepOctNovDec'
+PRINTABLE_ASCII = ''.join(chr(code_point) for code_point in range(0x20, 0x7F))
+
+# Characters each font size draws (displayWeather, drawBattery and the
+# setup screens in main.ino)
+FONT_CHARSETS = {
+    # Battery level, update time and the following train departures
+    10: 'Battery: %.v' + 'Update: @' + MONTHS + 'Then ,:AMP-' + DIGITS,
+    # Train, stock and crypto lines
+    14: PRINTABLE_ASCII,
+    # High/low, condition, feels like, precipitation, wind and setup messages
+    18: PRINTABLE_ASCII + '°',
+    # City, day and date
+    28: PRINTABLE_ASCII,
+    # Not drawn
+    32: '',
+    # Temperature
+    40: DIGITS + '-°CF'
+}
+
+# Flash taken by an epdiy GFXglyph and UnicodeInterval
+GLYPH_BYTES = 16
+INTERVAL_BYTES = 12
+
+ZLIB_STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE, zlib.Z_HUFFMAN_ONLY)
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'build', 'lib')
+
+
+def deflate(data):
+    """Smallest zlib stream of data over the ZLIB_STRATEGIES (at level 9)"""
+    streams = []
+    for strategy in ZLIB_STRATEGIES:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        streams.append(compressor.compress(data) + compressor.flush())
+    return min(streams, key=len)
+
+
+def font_name(size):
+    return f"Lexend{size}"
+
+
+def font_path(assets_dir, size):
+    return os.path.join(assets_dir, 'fonts', 'src', f"lexend{size}.h")
+
+
+def icon_path(assets_dir, name):
+    return os.path.join(assets_dir, 'icons', 'src', f"{name}.h")
+
+
+def icon_names(assets_dir):
+    return sorted(name[:-2] for name in os.listdir(os.path.join(assets_dir, 'icons', 'src')) if name.endswith('.h'))
+
+
+def font_bytes(bitmap_bytes, glyph_count, interval_count):
+    """Flash taken by a font's bitmap, glyph and interval arrays"""
+    return bitmap_bytes + glyph_count * GLYPH_BYTES + interval_count * INTERVAL_BYTES
+
+
+def subset_font(font, charset):
+    """
+    (bitmap, glyphs, intervals) of a font keeping the space and the
+    characters of charset it has; glyphs are (code point, [width, height,
+    advance_x, left, top, compressed_size, data_offset]).
+    """
+    code_points = sorted({ord(' ')} | {ord(char) for char in charset if font.glyph(ord(char)) is not None})
+
+    bitmap = bytearray()
+    offsets = {}
+    glyphs = []
+    for code_point in code_points:
+        width, height, advance_x, left, top, compressed_size, offset = font.glyph(code_point)
+        stream = deflate(font.glyph_bitmap(code_point))
+        if font.compressed and compressed_size <= len(stream):
+            stream = font.bitmap[offset:offset + compressed_size]
+        stream = bytes(stream)
+        if stream not in offsets:
+            offsets[stream] = len(bitmap)
+            bitmap += stream
+        glyphs.append((code_point, [width, height, advance_x, left, top, len(stream), offsets[stream]]))
+
+    intervals = []
+    for index, (code_point, _) in enumerate(glyphs):
+        if intervals and code_point == intervals[-1][1] + 1:
+            intervals[-1][1] = code_point
+        else:
+            intervals.append([code_point, code_point, index])
+    return bytes(bitmap), glyphs, intervals
+
+
+def _hex_lines(data, per_line, indent):
+    return ''.join(
+        indent + ' '.join(f"0x{value:02X}," for value in data[start:start + per_line]) + '\n'
+        for start in range(0, len(data), per_line)
+    )
+
+
+def _glyph_comment(code_point):
+    # fontconvert's spelling: a trailing backslash would continue the comment
+    return '<backslash>' if code_point == ord('\\') else chr(code_point)
+
+
+def font_header(font, name, bitmap, glyphs, intervals, source):
+    """fontconvert-style header of a subset font"""
+    lines = [
+        '#pragma once',
+        f"// Compiled by middleware/assets.py from {source}: {len(glyphs)} glyphs",
+        '#include "epd_driver.h"',
+        f"const uint8_t {name}Bitmaps[{len(bitmap)}] = {{"
+    ]
+    text = '\n'.join(lines) + '\n' + _hex_lines(bitmap, 16, '    ') + '};\n'
+    text += f"const GFXglyph {name}Glyphs[] = {{\n"
+    for code_point, glyph in glyphs:
+        text += f"    {{ {', '.join(str(value) for value in glyph)} }}, // {_glyph_comment(code_point)}\n"
+    text += f"}};\nconst UnicodeInterval {name}Intervals[] = {{\n"
+    for first, last, offset in intervals:
+        text += f"    {{ 0x{first:X}, 0x{last:X}, 0x{offset:X} }},\n"
+    text += (f"}};\nconst GFXfont {name} = {{\n"
+             f"    (uint8_t*){name}Bitmaps,\n"
+             f"    (GFXglyph*){name}Glyphs,\n"
+             f"    (UnicodeInterval*){name}Intervals,\n"
+             f"    {len(intervals)},\n"
+             f"    1,\n"
+             f"    {font.advance_y},\n"
+             f"    {font.ascender},\n"
+             f"    {font.descender},\n"
+             f"}};\n")
+    return text
+
+
+def icon_header(icon, name, data, source):
+    """Header of an icon with data as a zlib stream (or raw, if that is smaller)"""
+    raw_bytes = icon.width * icon.height // 2
+    format_note = (f"zlib stream of the ({icon.width}*{icon.height})/2-byte bitmap"
+                   if len(data) < raw_bytes else 'raw bitmap')
+    return (f"#pragma once\n"
+            f"// Compiled by middleware/assets.py from {source}: {format_note}\n"
+            f"const uint32_t {name}_width = {icon.width};\n"
+            f"const uint32_t {name}_height = {icon.height};\n"
+            f"const uint8_t {name}_data[{len(data)}] = {{\n" +
+            _hex_lines(data, 16, '    ') +
+            "};\n")
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def compile_assets(source_dir, output_dir, keep=''):
+    """
+    Write compiled copies of the font and icon headers (and the libraries'
+    library.json) under output_dir. Returns report rows (kind, name, kept,
+    total, flash bytes before, after, header bytes before, after).
+    """
+    rows = []
+    for library in ('fonts', 'icons'):
+        manifest = os.path.join(source_dir, library, 'library.json')
+        if os.path.exists(manifest):
+            os.makedirs(os.path.join(output_dir, library), exist_ok=True)
+            shutil.copyfile(manifest, os.path.join(output_dir, library, 'library.json'))
+
+    for size, charset in FONT_CHARSETS.items():
+        name = font_name(size)
+        source = font_path(source_dir, size)
+        font = render.Font(source, name)
+        bitmap, glyphs, intervals = subset_font(font, charset + keep)
+        text = font_header(font, name, bitmap, glyphs, intervals, f"lib/fonts/src/lexend{size}.h")
+        _write(font_path(output_dir, size), text)
+        rows.append(('font', name, len(glyphs), len(font.glyphs),
+                     font_bytes(len(font.bitmap), len(font.glyphs), len(font.intervals)),
+                     font_bytes(len(bitmap), len(glyphs), len(intervals)),
+                     os.path.getsize(source), len(text.encode('utf-8'))))
+
+    for name in icon_names(source_dir):
+        source = icon_path(source_dir, name)
+        icon = render.Icon(source, name)
+        data = min(deflate(icon.data), icon.data, key=len)
+        text = icon_header(icon, name, data, f"lib/icons/src/{name}.h")
+        _write(icon_path(output_dir, name), text)
+        rows.append(('icon', name, 1, 1, len(icon.data), len(data),
+                     os.path.getsize(source), len(text.encode('utf-8'))))
+    return rows
+
+
+def verify_assets(source_dir, output_dir, keep=''):
+    """
+    Raise AssertionError unless every compiled font has the original's
+    metrics, exactly the expected glyphs with the original's metrics and
+    pixels, and every compiled icon the original's pixels.
+    """
+    for size, charset in FONT_CHARSETS.items():
+        name = font_name(size)
+        original = render.Font(font_path(source_dir, size), name)
+        compiled = render.Font(font_path(output_dir, size), name)
+        assert (compiled.advance_y, compiled.ascender, compiled.descender) == \
+            (original.advance_y, original.ascender, original.descender), f"{name}: font metrics differ"
+
+        expected = {ord(' ')} | {ord(char) for char in charset + keep if original.glyph(ord(char)) is not None}
+        for first, last, offset in original.intervals:
+            for code_point in range(first, last + 1):
+                glyph = compiled.glyph(code_point)
+                if code_point not in expected:
+                    assert glyph is None, f"{name}: U+{code_point:04X} should have been left out"
+                    continue
+                assert glyph is not None, f"{name}: U+{code_point:04X} is missing"
+                assert glyph[:5] == original.glyph(code_point)[:5], f"{name}: U+{code_point:04X} metrics differ"
+                assert compiled.glyph_bitmap(code_point) == original.glyph_bitmap(code_point), \
+                    f"{name}: U+{code_point:04X} pixels differ"
+
+    for name in icon_names(source_dir):
+        original = render.Icon(icon_path(source_dir, name), name)
+        compiled = render.Icon(icon_path(output_dir, name), name)
+        assert (compiled.width, compiled.height, compiled.data) == (original.width, original.height, original.data), \
+            f"{name}: icon pixels differ"
+
+
+def _render_with(assets_dir, values, updated_at):
+    """A frame rendered from the headers in assets_dir"""
+    saved = render.ASSETS_DIR
+    with render.assets['lock']:
+        render.ASSETS_DIR = assets_dir
+        render.assets['fonts'].clear()
+        render.assets['icons'].clear()
+    try:
+        return render.render_frame(values, updated_at)
+    finally:
+        with render.assets['lock']:
+            render.ASSETS_DIR = saved
+            render.assets['fonts'].clear()
+            render.assets['icons'].clear()
+
+
+def main():
+    import argparse
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+
+    from payload import SAMPLE_AGGREGATE
+
+    parser = argparse.ArgumentParser(description="Compile subset, recompressed font and icon headers")
+    parser.add_argument('--source', default=render.ASSETS_DIR, help="Directory with fonts/src and icons/src (default: lib/)")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Directory to write the compiled headers to (default: build/lib/)")
+    parser.add_argument('--keep', default='', help="Extra characters to keep at every size (e.g. accented letters in the city)")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.source) == os.path.abspath(args.output):
+        parser.error("--output must not be the --source directory")
+
+    rows = compile_assets(args.source, args.output, args.keep)
+    verify_assets(args.source, args.output, args.keep)
+
+    # Whole frames, with every icon, must come out the same as well
+    tz = ZoneInfo('Australia/Sydney')
+    labels = {'city': 'Sydney', 'crypto_symbol': 'btc', 'stock_symbol': 'AAPL'}
+    updated_at = datetime(2026, 10, 16, 9, 0, tzinfo=tz)
+    condition_types = {'CLEAR': True, 'PARTLY_CLOUDY': False, 'CLOUDY': True, 'RAIN': True, 'SNOW': True,
+                       'HAIL': True, 'THUNDERSTORM': True, 'WINDY': True, 'FOG': True}
+    for condition_type, is_daytime in condition_types.items():
+        aggregate = json.loads(json.dumps(SAMPLE_AGGREGATE))
+        aggregate['weather'].update({'condition_type': condition_type, 'is_daytime': is_daytime})
+        values = render.display_values(aggregate, labels, tz)
+        assert _render_with(args.source, values, updated_at) == \
+            _render_with(args.output, values, updated_at), f"{condition_type}: frames differ"
+
+    print(f"{'asset':<14} {'glyphs':>9} | {'flash':>8} {'compiled':>8} {'saved':>6} | {'header':>8} {'compiled':>8}")
+    totals = {'font': [0, 0, 0, 0], 'icon': [0, 0, 0, 0]}
+    for kind, name, kept, total, flash, compiled, header, compiled_header in rows:
+        glyphs = f"{kept}/{total}" if kind == 'font' else ''
+        print(f"{name:<14} {glyphs:>9} | {flash:>8} {compiled:>8} {1 - compiled / flash:>6.0%} | "
+              f"{header:>8} {compiled_header:>8}")
+        for index, value in enumerate((flash, compiled, header, compiled_header)):
+            totals[kind][index] += value
+    print()
+    for kind, (flash, compiled, header, compiled_header) in totals.items():
+        print(f"{kind + 's':<14} {'':>9} | {flash:>8} {compiled:>8} {1 - compiled / flash:>6.0%} | "
+              f"{header:>8} {compiled_header:>8}")
+    print("\nflash: bytes of bitmap, glyph and interval arrays; header: bytes of C source")
+    print(f"every kept glyph and icon decodes to the original pixels; headers written to {os.path.normpath(args.output)}")
+
+
+if __name__ == '__main__':
+    main()
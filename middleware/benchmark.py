@@ -0,0 +1,115 @@
+"""
+LILYGO T5 Weather Display - Middleware benchmark
+
+Measures the latency of the aggregate endpoint (/api/data) when every request
+has to go to the upstream APIs, with and without HTTP connection pooling.
+
+The scheduler, the result cache and quota counting are disabled (see
+loadtest.inline_config) and the snapshot is cleared before each request, so
+each request refetches all sources inline. The run fails if fewer upstream
+calls were made than requests, i.e. if responses came from a cache.
+
+Against the real APIs this uses real quota that is not counted by the
+middleware: every request makes one call per source, stock included
+(MarketStack's free tier allows 100 a month), so keep the request count small.
+With --offline the mock upstream server (mockupstream.py) is used instead.
+
+Usage:
+    CONFIG_FILE=config/config.json python benchmark.py --requests 5
+    python benchmark.py --offline --requests 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from loadtest import inline_config, offline_config, percentile
+
+UPSTREAM_METRIC = 'middleware_upstream_request_seconds'
+
+
+def clear_snapshot(middleware):
+    """Forget the data served so far, so the next request fetches every source inline"""
+    with middleware.snapshot['lock']:
+        for entry in middleware.snapshot['sources'].values():
+            entry['data'] = entry['timestamp'] = None
+
+
+def count_upstream_calls(middleware):
+    """Upstream calls made so far (observations of the upstream latency histogram)"""
+    return sum(sum(counts[:-1]) for (name, _), counts in middleware.metrics.snapshot().items()
+               if name == UPSTREAM_METRIC)
+
+
+def run(middleware, client, requests_count):
+    """Issue sequential /api/data requests and return the latencies in milliseconds"""
+    latencies = []
+    for _ in range(requests_count):
+        clear_snapshot(middleware)
+        start = time.perf_counter()
+        response = client.get('/api/data')
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        if response.status_code != 200:
+            print(f"  request failed with HTTP {response.status_code}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /api/data aggregate endpoint')
+    parser.add_argument('--requests', type=int, default=20, help='requests per mode (default: 20)')
+    parser.add_argument('--offline', action='store_true', help='benchmark against the mock upstream server')
+    parser.add_argument('--latency', type=float, default=50, help='mock upstream latency in ms (default: 50)')
+    args = parser.parse_args()
+
+    mock = None
+    directory = tempfile.TemporaryDirectory()
+    if args.offline:
+        from mockupstream import MockUpstream
+
+        # Throwaway config, so the mock's data never reaches the real cache files
+        mock = MockUpstream(latency_ms=args.latency).start()
+        config_file = os.path.join(directory.name, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(offline_config(mock.upstreams(), scheduler=False), f)
+        os.environ['CONFIG_FILE'] = config_file
+    os.environ['SCHEDULER_ENABLED'] = 'false'
+
+    import app as middleware
+
+    middleware.logger.setLevel(logging.WARNING)
+    inline_config(middleware.config)
+    middleware.rate_budget.quotas = middleware.get_budget_quotas()
+    client = middleware.app.test_client()
+
+    short = []
+    try:
+        print(f"{'mode':<10} {'requests':>8} {'upstream':>8} {'p50 ms':>10} {'p99 ms':>10}")
+        for mode, pooling in (('unpooled', False), ('pooled', True)):
+            middleware.config.setdefault('http', {})['pooling'] = pooling
+            # Warm-up request (geocode cache, pooled connections)
+            clear_snapshot(middleware)
+            client.get('/api/data')
+            calls = count_upstream_calls(middleware)
+            latencies = run(middleware, client, args.requests)
+            calls = count_upstream_calls(middleware) - calls
+            print(f"{mode:<10} {len(latencies):>8} {calls:>8} "
+                  f"{percentile(latencies, 50):>10.1f} {percentile(latencies, 99):>10.1f}")
+            if calls < args.requests:
+                short.append(f"{mode}: {calls} upstream calls for {args.requests} requests")
+    finally:
+        if mock is not None:
+            mock.stop()
+        directory.cleanup()
+
+    for line in short:
+        print(f"CACHED:     {line}, responses did not all come from the upstreams")
+    if short:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+LILYGO T5 Weather Display - Middleware upstream circuit breakers
+Skips calls to an upstream that keeps failing instead of waiting for a
+timeout on every request.
+
+Each upstream has a breaker with three states:
+
+- closed: calls go through; consecutive failures (connection errors,
+  timeouts, HTTP 429 and 5xx) are counted, and failure_threshold of them
+  in a row open the breaker.
+- open: calls fail at once with CircuitOpen (without using quota) for
+  open_seconds. Fetches then fail fast and the result cache serves the last
+  good value.
+- half-open: after open_seconds one trial call is let through. Success
+  closes the breaker, failure opens it again for twice as long (up to
+  max_open_seconds), so a long outage costs few trial timeouts.
+
+Breakers are per process: with several workers, each finds out about a
+failing upstream on its own.
+
+Run this module directly to replay a provider outage against a breaker.
+"""
+
+import threading
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_OPEN_SECONDS = 30
+DEFAULT_MAX_OPEN_SECONDS = 600
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """An upstream call was skipped because the upstream's circuit breaker is open"""
+
+
+def is_failure_status(status_code):
+    """HTTP statuses that say the provider is failing or overloaded (not that the request was wrong)"""
+    return status_code == 429 or status_code >= 500
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker of one upstream"""
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, open_seconds=DEFAULT_OPEN_SECONDS,
+                 max_open_seconds=DEFAULT_MAX_OPEN_SECONDS, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.open_for = open_seconds
+        self.trial = False          # a half-open trial call is in progress
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Let a call through or raise CircuitOpen"""
+        with self.lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_for - self.clock()
+                if remaining > 0:
+                    raise CircuitOpen(f"{self.name} circuit open after {self.failures} failures "
+                                      f"(retrying in {int(remaining) + 1}s)")
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.trial:
+                    raise CircuitOpen(f"{self.name} circuit half-open, trial call in progress")
+                self.trial = True
+
+    def record(self, success):
+        """Record the outcome of a call let through by before_call()"""
+        with self.lock:
+            self.trial = False
+            if success:
+                self.state = CLOSED
+                self.failures = 0
+                self.open_for = self.open_seconds
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.open_for = min(self.open_for * 2, self.max_open_seconds)
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    def release(self):
+        """A call let through by before_call() was not made after all"""
+        with self.lock:
+            self.trial = False
+
+    def get_stats(self):
+        with self.lock:
+            return {'state': self.state, 'failures': self.failures,
+                    'open_seconds': self.open_for if self.state != CLOSED else 0}
+
+
+class CircuitBreakers:
+    """Breakers by upstream name, created on first use"""
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, open_seconds=DEFAULT_OPEN_SECONDS,
+                 max_open_seconds=DEFAULT_MAX_OPEN_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.clock = clock
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            breaker = self.breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.open_seconds, self.max_open_seconds,
+                                         self.clock)
+                self.breakers[name] = breaker
+            return breaker
+
+    def get_stats(self):
+        """{upstream: {'state', 'failures', 'open_seconds'}} of every upstream called so far"""
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return {breaker.name: breaker.get_stats() for breaker in breakers}
+
+
+def main():
+    # The scheduler calls a provider every minute; it times out (10 s per call) for an hour
+    clock = [0.0]
+    breaker = CircuitBreaker('train', clock=lambda: clock[0])
+    outage = (5 * 60, 65 * 60)
+    timeout = 10.0
+
+    made = skipped = 0
+    closed_at = None
+    print(f"{'minute':>6} {'result':<8} {'breaker':<10}")
+    for minute in range(80):
+        clock[0] = minute * 60.0
+        state = breaker.state
+        failed = outage[0] <= clock[0] < outage[1]
+        try:
+            breaker.before_call()
+        except CircuitOpen:
+            skipped += failed
+            result = 'skipped'
+        else:
+            made += failed
+            breaker.record(not failed)
+            result = 'timeout' if failed else 'ok'
+        if result != 'skipped' and (result == 'timeout' or breaker.state != state):
+            print(f"{minute:>6} {result:<8} {breaker.state:<10}")
+        if state != CLOSED and breaker.state == CLOSED:
+            closed_at = minute
+
+    print(f"\n{made + skipped} calls during the outage: {made} timed out ({made * timeout:.0f}s spent waiting), "
+          f"{skipped} skipped at once")
+    print(f"calls resumed {closed_at - outage[1] // 60} minutes after the provider recovered")
+    assert breaker.state == CLOSED, "breaker did not close after the outage"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+LILYGO T5 Weather Display - Middleware upstream rate budget
+Counts upstream calls per provider against its quotas and paces refreshes
+so each quota lasts its whole billing period.
+
+Counts live in a SQLite table next to the result cache, so they survive
+restarts and are shared by all worker processes. Each provider has one or
+more quota windows (calendar minute, day or month, in UTC):
+
+- acquire() is called before every upstream call and refuses it once a
+  window is used up. The fetch then fails, and the result cache serves the
+  last good value instead (errors are never cached).
+- interval() is the refresh interval that spreads the remaining calls of
+  every window evenly over the time it has left. The scheduler and the
+  cache TTLs use it as a lower bound, so refreshes slow down on the fly
+  when traffic is higher than the quota allows.
+
+Run this module directly to replay a month of traffic from N displays
+against the default quotas and check that the budget holds.
+"""
+
+import calendar
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Free tier quotas: provider -> [(limit, period)]
+DEFAULT_QUOTAS = {
+    'google': [(28500, 'month')],                       # Geocoding + Weather API
+    'coingecko': [(30, 'minute'), (10000, 'month')],    # Demo API plan
+    'marketstack': [(100, 'month')],
+    'transportnsw': [(60000, 'day')]
+}
+
+QUOTA_PERIODS = ('minute', 'day', 'month')
+
+# Share of each quota kept back when pacing, for restarts, geocoding and retries
+DEFAULT_RESERVE = 0.05
+
+# How long counts read from the database are reused before reading them again
+# (other worker processes' calls show up after at most this long)
+COUNT_REFRESH_SECONDS = 5
+
+
+class QuotaExceeded(Exception):
+    """An upstream call was refused because a provider's quota is used up"""
+
+
+def window_bounds(period, now):
+    """(key, start, end) in unix seconds of the calendar window containing now"""
+    moment = datetime.fromtimestamp(now, tz=timezone.utc)
+    if period == 'minute':
+        start = moment.replace(second=0, microsecond=0)
+        return start.strftime('%Y-%m-%dT%H:%M'), start.timestamp(), start.timestamp() + 60
+    if period == 'day':
+        start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        return start.strftime('%Y-%m-%d'), start.timestamp(), start.timestamp() + 86400
+    if period == 'month':
+        start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        days = calendar.monthrange(start.year, start.month)[1]
+        return start.strftime('%Y-%m'), start.timestamp(), start.timestamp() + days * 86400
+    raise ValueError(f"Unknown quota period: {period}")
+
+
+class RateBudget:
+    """Persisted per-provider call counts and quota-aware pacing"""
+
+    def __init__(self, path, quotas=None, reserve=DEFAULT_RESERVE, clock=time.time,
+                 count_refresh=COUNT_REFRESH_SECONDS):
+        self.path = path
+        self.quotas = quotas if quotas is not None else DEFAULT_QUOTAS
+        self.reserve = reserve
+        self.clock = clock
+        self.count_refresh = count_refresh
+        for provider, quotas in self.quotas.items():
+            for limit, period in quotas:
+                if period not in QUOTA_PERIODS:
+                    raise ValueError(f"Unknown quota period for {provider}: {period} (use {', '.join(QUOTA_PERIODS)})")
+        self.counts = {}    # (provider, period) -> (window key, count, read at)
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS budget ('
+                'provider TEXT NOT NULL, period TEXT NOT NULL, window TEXT NOT NULL, '
+                'count INTEGER NOT NULL, PRIMARY KEY (provider, period))'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _used(self, provider, period, window, now):
+        """Calls made in the current window, read from the database at most every few seconds"""
+        with self.lock:
+            cached = self.counts.get((provider, period))
+        if cached is not None and cached[0] == window and now - cached[2] < self.count_refresh:
+            return cached[1]
+
+        try:
+            with self._connect() as conn:
+                row = conn.execute('SELECT window, count FROM budget WHERE provider = ? AND period = ?',
+                                   (provider, period)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Budget read failed for {provider}: {e}")
+            return cached[1] if cached is not None and cached[0] == window else 0
+
+        used = row[1] if row is not None and row[0] == window else 0
+        with self.lock:
+            self.counts[(provider, period)] = (window, used, now)
+        return used
+
+    def acquire(self, provider, calls=1):
+        """
+        Count calls against every quota window of a provider, or raise
+        QuotaExceeded (counting nothing) if any window would go over its limit.
+        Providers without quotas are not counted.
+        """
+        quotas = self.quotas.get(provider)
+        if not quotas:
+            return
+
+        now = self.clock()
+        try:
+            conn = self._connect()
+            try:
+                # One write transaction at a time across processes: check all windows, then count
+                conn.execute('BEGIN IMMEDIATE')
+                updates = []
+                for limit, period in quotas:
+                    window, _, end = window_bounds(period, now)
+                    row = conn.execute('SELECT window, count FROM budget WHERE provider = ? AND period = ?',
+                                       (provider, period)).fetchone()
+                    used = row[1] if row is not None and row[0] == window else 0
+                    if used + calls > limit:
+                        conn.rollback()
+                        raise QuotaExceeded(f"{provider} quota of {limit} calls per {period} used up "
+                                            f"(resets in {int(end - now)}s)")
+                    updates.append((period, window, used + calls))
+
+                for period, window, count in updates:
+                    conn.execute('INSERT OR REPLACE INTO budget (provider, period, window, count) VALUES (?, ?, ?, ?)',
+                                 (provider, period, window, count))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Never block upstream calls because the counter store is unavailable
+            logger.warning(f"Budget write failed for {provider}: {e}")
+            return
+
+        with self.lock:
+            for period, window, count in updates:
+                self.counts[(provider, period)] = (window, count, now)
+
+    def interval(self, provider, calls_per_refresh=1):
+        """
+        Seconds between refreshes (of calls_per_refresh calls each) that make
+        every quota window of a provider last until it resets; 0 if unlimited.
+        """
+        now = self.clock()
+        interval = 0.0
+        for limit, period in self.quotas.get(provider, []):
+            window, _, end = window_bounds(period, now)
+            remaining = limit * (1 - self.reserve) - self._used(provider, period, window, now)
+            refreshes = remaining / calls_per_refresh
+            if refreshes < 1:
+                interval = max(interval, end - now)
+            else:
+                interval = max(interval, (end - now) / refreshes)
+        return interval
+
+    def get_stats(self):
+        """{provider: {period: {'used', 'limit', 'resets_in'}}} for the current windows"""
+        now = self.clock()
+        stats = {}
+        for provider, quotas in self.quotas.items():
+            for limit, period in quotas:
+                window, _, end = window_bounds(period, now)
+                stats.setdefault(provider, {})[period] = {
+                    'used': self._used(provider, period, window, now),
+                    'limit': limit,
+                    'resets_in': int(end - now)
+                }
+        return stats
+
+
+def simulate(displays, days, wake_minutes, intervals, quotas, path, start=None):
+    """
+    Replay traffic from N displays against a budget with a simulated clock. Every display wakes every wake_minutes and reads all
+    sources; a source is fetched when its data is older than the larger of
+    its configured interval and the budget interval (the middleware without
+    a scheduler, where display traffic drives the upstream calls). Each
+    display has its own weather location and train trip (the worst case:
+    nothing is shared), while crypto and stock are batched into one call.
+
+    Returns ({(provider, period, window): calls made}, {source: max data age
+    in seconds}, {source: refreshes refused}).
+    """
+    clock = [start if start is not None else datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()]
+    # A single process sees its own calls immediately, so counts never need re-reading
+    budget = RateBudget(path, quotas, clock=lambda: clock[0], count_refresh=float('inf'))
+    providers = {'weather': 'google', 'crypto': 'coingecko', 'stock': 'marketstack', 'train': 'transportnsw'}
+    calls_per_refresh = {'weather': displays, 'crypto': 1, 'stock': 1, 'train': displays}
+
+    fetched_at = {name: None for name in providers}
+    max_age = {name: 0.0 for name in providers}
+    refused = {name: 0 for name in providers}
+    made = {}
+
+    end = clock[0] + days * 86400
+    # Displays wake staggered over their interval; a wake at least every minute
+    # is simulated as one per minute, which only rounds the data ages
+    step = max(wake_minutes * 60 / displays, 60)
+    while clock[0] < end:
+        now = clock[0]
+        for name, provider in providers.items():
+            interval = max(intervals[name], budget.interval(provider, calls_per_refresh[name]))
+            if fetched_at[name] is None or now - fetched_at[name] >= interval:
+                try:
+                    budget.acquire(provider, calls_per_refresh[name])
+                except QuotaExceeded:
+                    refused[name] += 1
+                else:
+                    fetched_at[name] = now
+                    for _, period in quotas.get(provider, []):
+                        key = (provider, period, window_bounds(period, now)[0])
+                        made[key] = made.get(key, 0) + calls_per_refresh[name]
+            if fetched_at[name] is not None:
+                max_age[name] = max(max_age[name], now - fetched_at[name])
+        clock[0] += step
+
+    return made, max_age, refused
+
+
+def main():
+    import argparse
+    import os
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Replay traffic from N displays against the upstream quotas")
+    parser.add_argument('--displays', type=int, default=10, help="Number of displays (default: 10)")
+    parser.add_argument('--days', type=int, default=31, help="Days to replay (default: 31)")
+    parser.add_argument('--wake-minutes', type=float, default=5, help="Display update interval (default: 5)")
+    args = parser.parse_args()
+
+    intervals = {'weather': 600, 'crypto': 300, 'stock': 3600, 'train': 60}
+    with tempfile.TemporaryDirectory() as directory:
+        made, max_age, refused = simulate(args.displays, args.days, args.wake_minutes, intervals,
+                                          DEFAULT_QUOTAS, os.path.join(directory, 'budget.sqlite3'))
+
+    print(f"{args.displays} displays waking every {args.wake_minutes:g} min for {args.days} days\n")
+    print(f"{'provider':<14} {'period':<8} {'limit':>7} {'max used':>9} {'windows':>8}")
+    held = True
+    for provider, quotas in DEFAULT_QUOTAS.items():
+        for limit, period in quotas:
+            counts = [count for (p, q, _), count in made.items() if p == provider and q == period]
+            peak = max(counts, default=0)
+            held = held and peak <= limit
+            print(f"{provider:<14} {period:<8} {limit:>7} {peak:>9} {len(counts):>8}")
+
+    print(f"\n{'source':<10} {'max data age':>13} {'refused':>8}")
+    for name, age in max_age.items():
+        print(f"{name:<10} {age / 3600:>12.1f}h {refused[name]:>8}")
+
+    print(f"\nbudget {'held' if held else 'EXCEEDED'}")
+    if not held:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+LILYGO T5 Weather Display - Middleware result cache
+SQLite-backed cache for upstream results, shared by all worker processes.
+
+Results survive container restarts (the database lives next to config.json
+on the mounted volume) and a per-key file lock makes sure only one process
+calls an upstream API when an entry expires, so running several gunicorn
+workers does not multiply the upstream calls.
+
+Within a process, concurrent callers for the same key are coalesced onto a
+single in-flight fetch. Callers that already have a (stale) value never wait
+for it: they get the stale value while the refresh runs. No lock is held
+across network I/O except the fetch lock, which only the fetching thread
+takes.
+
+FrameHistory keeps the last frames served to each display in the same
+database, for /api/frame diffs.
+"""
+
+import fcntl
+import json
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Key/value cache of JSON results with their fetch time"""
+
+    def __init__(self, path):
+        self.path = path
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0,          # served fresh from the cache
+            'fetches': 0,       # upstream fetches started by this process
+            'coalesced': 0,     # callers that joined an in-flight fetch instead of starting one
+            'stale_served': 0   # callers that got a stale value while a refresh was running
+        }
+        with self._connect() as conn:
+            # WAL lets readers in other workers proceed while one writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at TEXT NOT NULL)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        """Return (value, stored_at) for a key, or None if it was never stored"""
+        try:
+            with self._connect() as conn:
+                row = conn.execute('SELECT value, stored_at FROM cache WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read failed for {key}: {e}")
+            return None
+
+        if row is None:
+            return None
+        return json.loads(row[0]), datetime.fromisoformat(row[1])
+
+    def get_fresh(self, key, ttl):
+        """Return (value, stored_at) if the entry is younger than ttl seconds, otherwise None"""
+        entry = self.get(key)
+        if entry is not None and (datetime.utcnow() - entry[1]).total_seconds() < ttl:
+            return entry
+        return None
+
+    def set(self, key, value):
+        """Store a value with the current time and return its stored_at"""
+        stored_at = datetime.utcnow()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), stored_at.isoformat())
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed for {key}: {e}")
+        return stored_at
+
+    def acquire(self, key):
+        """
+        Take the cross-process fetch lock for a key (blocking).
+
+        flock() locks belong to the open file, so the lock also serializes
+        threads of the same process and can be released from any thread.
+        """
+        lock_file = open(f"{self.path}.{key}.lock", 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def release(self, lock_file):
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def resolve(self, key, value):
+        """
+        Store a freshly fetched value and return (value, stored_at).
+
+        Error results ({'error': ...}) are never stored; the last good value
+        is returned instead when there is one.
+        """
+        if isinstance(value, dict) and 'error' in value:
+            stale = self.get(key)
+            if stale is not None:
+                logger.warning(f"Fetching {key} failed ({value['error']}), returning stale cached data "
+                               f"(age: {datetime.utcnow() - stale[1]})")
+                return stale
+            return value, datetime.utcnow()
+
+        return value, self.set(key, value)
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def claim(self, key, ttl):
+        """
+        Look up a key on behalf of a caller that may have to fetch it.
+
+        Returns (entry, future, leader):
+        - entry: the cached (value, stored_at), possibly stale, or None
+        - future: None if entry is fresh, otherwise the in-flight fetch
+        - leader: True if this caller created the future and must run the
+          fetch, then call finish()
+        """
+        entry = self.get(key)
+        if entry is not None and (datetime.utcnow() - entry[1]).total_seconds() < ttl:
+            self.count('hits')
+            return entry, None, False
+
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return entry, future, False
+
+            future = Future()
+            self.inflight[key] = future
+            self.stats['fetches'] += 1
+            return entry, future, True
+
+    def finish(self, key, future, entry=None, exception=None):
+        """Complete an in-flight fetch and wake up the callers waiting on it"""
+        with self.lock:
+            self.inflight.pop(key, None)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(entry)
+
+    def _run_fetch(self, key, ttl, fetch, future, on_complete):
+        """Leader side of a fetch: take the cross-process lock, fetch unless another process just did, publish"""
+        try:
+            lock_file = self.acquire(key)
+            try:
+                entry = self.get_fresh(key, ttl) or self.resolve(key, fetch())
+            finally:
+                self.release(lock_file)
+            if on_complete is not None:
+                on_complete(*entry)
+        except Exception as e:
+            logger.error(f"Fetching {key} failed: {e}")
+            self.finish(key, future, exception=e)
+            return
+        self.finish(key, future, entry)
+
+    def get_or_fetch(self, key, ttl, fetch, background=None, on_complete=None):
+        """
+        Return (value, stored_at) for a key, calling fetch() only when the
+        cached entry is missing or older than ttl seconds.
+
+        Concurrent callers share one fetch. If a stale value exists and an
+        executor is passed as 'background', the fetch runs there and the
+        stale value is returned immediately (stale-while-revalidate);
+        on_complete(value, stored_at) is called once the fetch is done.
+        """
+        entry, future, leader = self.claim(key, ttl)
+        if future is None:
+            return entry
+
+        if leader:
+            if entry is not None and background is not None:
+                background.submit(self._run_fetch, key, ttl, fetch, future, on_complete)
+                self.count('stale_served')
+                return entry
+            self._run_fetch(key, ttl, fetch, future, on_complete)
+        elif entry is not None:
+            self.count('stale_served')
+            return entry
+
+        return future.result()
+
+
+class FrameHistory:
+    """
+    The last frames served to each device (encoded full frames, see
+    render.py), in the cache database so that every worker process can
+    diff against the frame a display shows, whichever worker sent it.
+    """
+
+    def __init__(self, path, keep):
+        self.path = path
+        self.keep = keep
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS frames ('
+                'device TEXT NOT NULL, crc INTEGER NOT NULL, values_key TEXT NOT NULL, '
+                'frame BLOB NOT NULL, stored_at TEXT NOT NULL, PRIMARY KEY (device, crc))'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def store(self, device, crc, values_key, frame):
+        """Remember a frame rendered for a device, dropping all but its last `keep` frames"""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO frames (device, crc, values_key, frame, stored_at) VALUES (?, ?, ?, ?, ?)',
+                    (device or '', crc, values_key, frame, datetime.utcnow().isoformat())
+                )
+                conn.execute(
+                    'DELETE FROM frames WHERE device = ? AND crc NOT IN ('
+                    'SELECT crc FROM frames WHERE device = ? ORDER BY stored_at DESC LIMIT ?)',
+                    (device or '', device or '', self.keep)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Frame history write failed for {device or 'default'}: {e}")
+
+    def _frame(self, query, params):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(query, params).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Frame history read failed: {e}")
+            return None
+        return row[0] if row is not None else None
+
+    def get(self, device, crc):
+        """Encoded frame with a CRC served to a device, or None"""
+        return self._frame('SELECT frame FROM frames WHERE device = ? AND crc = ?', (device or '', crc))
+
+    def find(self, device, values_key):
+        """Newest encoded frame rendered for a device from the same values (by any worker), or None"""
+        return self._frame('SELECT frame FROM frames WHERE device = ? AND values_key = ? '
+                           'ORDER BY stored_at DESC LIMIT 1', (device or '', values_key))
@@ -0,0 +1,214 @@
+"""
+LILYGO T5 Weather Display - Middleware conditional and compressed responses
+Lets a display skip downloading (and redrawing) data it already shows.
+
+Responses of /api/data and the per-source endpoints carry an ETag: a hash
+of the content the display shows. Fields that change on every request
+without the data changing ('timestamp', 'age_seconds' and
+'next_refresh_seconds') are left out, so the tag is weak (W/"...") and stays
+the same until a value on screen could change. A request whose
+If-None-Match holds the current tag is answered with 304 Not Modified and
+no body.
+
+Bodies of at least MIN_COMPRESS_BYTES are gzip or deflate (zlib) compressed
+when the request's Accept-Encoding allows it. The firmware's HTTP client
+sends "identity;q=1,chunked;q=0.1,*;q=0" and gets plain bodies.
+
+Run this module directly to compare bytes on the wire per day of a display
+polling with and without ETags and compression.
+"""
+
+import gzip
+import hashlib
+import json
+import zlib
+
+# Fields that change with the clock, not with the data on screen
+VOLATILE_FIELDS = ('timestamp', 'age_seconds', 'next_refresh_seconds')
+
+# Smaller bodies (such as the 195-byte binary payload) gain little or grow
+MIN_COMPRESS_BYTES = 256
+
+# Encodings in the order they are preferred at equal quality
+ENCODINGS = ('gzip', 'deflate')
+
+COMPRESS_LEVEL = 6
+
+
+def _stable(data):
+    """Copy of a response without VOLATILE_FIELDS, at any depth"""
+    if isinstance(data, dict):
+        return {key: _stable(value) for key, value in data.items() if key not in VOLATILE_FIELDS}
+    if isinstance(data, list):
+        return [_stable(value) for value in data]
+    return data
+
+
+def content_etag(data, representation='json'):
+    """Weak ETag of the data a response shows; each representation (json, binary) gets its own"""
+    content = json.dumps(_stable(data), sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.blake2b(f"{representation}:{content}".encode('utf-8'), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header with an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+
+def _parse_accept_encoding(header):
+    """{coding: quality} of an Accept-Encoding header"""
+    qualities = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def choose_encoding(accept_encoding):
+    """The best of ENCODINGS the client accepts, or None for an uncompressed body"""
+    if not accept_encoding:
+        return None
+    qualities = _parse_accept_encoding(accept_encoding)
+    best, best_quality = None, 0.0
+    for coding in ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+    if encoding == 'deflate':
+        # HTTP 'deflate' is the zlib format, as the firmware's tinfl reads it
+        return zlib.compress(body, COMPRESS_LEVEL)
+    return body
+
+
+def conditional_response(data, body, representation, if_none_match, accept_encoding):
+    """
+    (status, body, headers) answering a request for data already encoded as
+    body: 304 with no body if the client holds the current ETag, otherwise
+    the body, compressed if the client accepts it.
+    """
+    etag = content_etag(data, representation)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+    if etag_matches(if_none_match, etag):
+        return 304, b'', headers
+    encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding is not None:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return 200, body, headers
+
+
+# Typical HTTP/1.1 exchange around a body: the firmware's request (with
+# If-None-Match when it holds a tag) and the headers of the response
+REQUEST_HEADERS = ("GET /api/data HTTP/1.1\r\nHost: 192.168.1.50:5000\r\nUser-Agent: ESP32HTTPClient\r\n"
+                   "Connection: keep-alive\r\nAccept-Encoding: {accept}\r\n{conditional}\r\n")
+RESPONSE_HEADERS = ("HTTP/1.1 {status}\r\nServer: gunicorn\r\nDate: Fri, 16 Oct 2026 09:00:00 GMT\r\n"
+                    "Connection: keep-alive\r\nContent-Type: {mimetype}\r\nContent-Length: {length}\r\n"
+                    "{extra}\r\n")
+
+
+def _exchange_bytes(status, body, headers, mimetype, accept, if_none_match):
+    conditional = f"If-None-Match: {if_none_match}\r\n" if if_none_match else ''
+    extra = ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+    request = REQUEST_HEADERS.format(accept=accept, conditional=conditional)
+    response = RESPONSE_HEADERS.format(status=status, mimetype=mimetype, length=len(body), extra=extra)
+    return len(request) + len(response) + len(body)
+
+
+def _aggregate_at(base, minute, changes):
+    """The sample aggregate as served at a minute, each source moved on by its changes so far"""
+    aggregate = json.loads(json.dumps(base))
+    aggregate['timestamp'] = f"2026-10-16T{minute // 60 % 24:02d}:{minute % 60:02d}:00"
+    aggregate['next_refresh_seconds'] = 60
+    for name, every in changes.items():
+        version = minute // every
+        section = aggregate[name]
+        section['age_seconds'] = minute % every * 60
+        if name == 'weather':
+            section['temp'] = round(section['temp'] + version % 7 * 0.1, 1)
+        elif name == 'crypto':
+            section['price'] = section['price'] + version % 50
+        elif name == 'stock':
+            section['price'] = round(section['price'] + version * 0.01, 2)
+        else:
+            section['departure_time'] = f"{version:08d}"
+            for index, departure in enumerate(section['departures']):
+                departure['departure_time'] = f"{version + index:08d}"
+    return aggregate
+
+
+def main():
+    from payload import PAYLOAD_MIMETYPE, SAMPLE_AGGREGATE, encode_payload
+
+    # Minutes between changes of what each source shows (the scheduler
+    # defaults; trains every 7-8 minutes)
+    changes = {'weather': 10, 'crypto': 5, 'stock': 24 * 60, 'train': 8}
+    identity = 'identity;q=1,chunked;q=0.1,*;q=0'
+    setups = [
+        ('json', identity, False),
+        ('json', 'gzip, deflate', False),
+        ('json', identity, True),
+        ('json', 'gzip, deflate', True),
+        ('binary', identity, False),
+        ('binary', identity, True)
+    ]
+
+    print("Bytes on the wire per day (request and response headers included), one display:\n")
+    print(f"{'poll':>5} | {'format':<7} {'encoding':<9} {'etag':<5} | {'200':>5} {'304':>5} | {'KB/day':>8} {'vs json':>8}")
+    for poll_minutes in (1, 5):
+        baseline = None
+        for representation, accept, use_etag in setups:
+            held = None
+            total = full = not_modified = 0
+            for minute in range(0, 24 * 60, poll_minutes):
+                aggregate = _aggregate_at(SAMPLE_AGGREGATE, minute, changes)
+                if representation == 'json':
+                    body, mimetype = json.dumps(aggregate, separators=(',', ':')).encode('utf-8'), 'application/json'
+                else:
+                    body, mimetype = encode_payload(aggregate), PAYLOAD_MIMETYPE
+                if_none_match = held if use_etag else None
+                status, sent, headers = conditional_response(aggregate, body, representation, if_none_match, accept)
+                if not use_etag:
+                    del headers['ETag']
+                total += _exchange_bytes('200 OK' if status == 200 else '304 Not Modified', sent, headers,
+                                         mimetype, accept, if_none_match)
+                if status == 304:
+                    not_modified += 1
+                else:
+                    full += 1
+                    held = headers.get('ETag')
+            baseline = baseline or total
+            encoding = accept.split(',')[0].split(';')[0]
+            print(f"{poll_minutes:>4}m | {representation:<7} {encoding:<9} {'yes' if use_etag else 'no':<5} | "
+                  f"{full:>5} {not_modified:>5} | {total / 1024:>8.1f} {total / baseline:>7.0%}")
+        print()
+
+    assert choose_encoding(identity) is None
+    assert choose_encoding('gzip;q=0.5, deflate') == 'deflate'
+    assert etag_matches('W/"a", "b"', 'W/"b"') and not etag_matches('W/"a"', 'W/"b"')
+
+
+if __name__ == '__main__':
+    main()
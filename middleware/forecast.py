@@ -0,0 +1,239 @@
+"""
+LILYGO T5 Weather Display - Middleware hourly forecast series
+Serves weather between upstream calls from the hourly forecast.
+
+Every weather fetch gets the current conditions and the hourly forecast
+for the next FORECAST_HOURS. ForecastSeries holds them as a time series
+that starts at the current conditions (at the fetch time) and continues
+with the forecast hours. The numeric fields sit in arrays, one per field.
+Until the next fetch, the "current" weather is read from the series:
+
+- temperature, feels-like, precipitation probability and wind speed are
+  interpolated linearly between the two points around the moment;
+- condition and daytime are those of the last point before it.
+
+Values are read at the start of SERVE_STEP_SECONDS steps, so they change
+every 10 minutes like the current conditions used to, and responses in
+between are identical (ETags, next-refresh hints).
+
+Run this module directly to replay two days of synthetic weather and
+compare the error of the interpolated values with fetching the current
+conditions every 10 minutes.
+"""
+
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+# Hours of forecast fetched at a time (one page of the Google Weather API)
+FORECAST_HOURS = 24
+
+SERVE_STEP_SECONDS = 600
+
+# Interpolated fields and the decimals they are served with
+INTERPOLATED_FIELDS = {
+    'temp': 1,
+    'feels_like': 1,
+    'precipitation_prob': 0,
+    'wind_speed': 1
+}
+
+# Fields taken from the last point at or before the moment
+STEP_FIELDS = ('condition', 'condition_type', 'is_daytime')
+
+
+def _unix(moment):
+    """Naive UTC datetime to unix seconds"""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+
+def serve_time(now):
+    """Start of the serve step a moment (naive UTC) falls in"""
+    seconds = _unix(now)
+    return _datetime(seconds - seconds % SERVE_STEP_SECONDS)
+
+
+def next_serve_time(now):
+    """Start of the serve step after the one a moment falls in"""
+    return serve_time(now) + timedelta(seconds=SERVE_STEP_SECONDS)
+
+
+class ForecastSeries:
+    """Weather points at increasing times, the numeric fields in arrays"""
+
+    def __init__(self, times, values, steps):
+        self.times = array('d', times)
+        self.values = {field: array('d', values[field]) for field in INTERPOLATED_FIELDS}
+        self.steps = {field: list(steps[field]) for field in STEP_FIELDS}
+
+    @classmethod
+    def from_points(cls, points):
+        """Series of (naive UTC datetime, {field: value}) points in time order"""
+        return cls([_unix(moment) for moment, _ in points],
+                   {field: [float(values.get(field) or 0) for _, values in points] for field in INTERPOLATED_FIELDS},
+                   {field: [values.get(field) for _, values in points] for field in STEP_FIELDS})
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['times'], data, data)
+
+    def to_dict(self):
+        """Plain lists, as stored in the result cache"""
+        data = {'times': list(self.times)}
+        data.update({field: list(values) for field, values in self.values.items()})
+        data.update(self.steps)
+        return data
+
+    @property
+    def end(self):
+        """Time (naive UTC) of the last point"""
+        return _datetime(self.times[-1])
+
+    def at(self, moment):
+        """{field: value} at a moment (naive UTC); before the first or after the last point, that point's"""
+        seconds = _unix(moment)
+        index = bisect_right(self.times, seconds)
+        last = len(self.times) - 1
+        before = min(max(index - 1, 0), last)
+        after = min(index, last)
+        span = self.times[after] - self.times[before]
+        share = (seconds - self.times[before]) / span if span > 0 else 0.0
+        share = min(max(share, 0.0), 1.0)
+
+        result = {}
+        for field, decimals in INTERPOLATED_FIELDS.items():
+            values = self.values[field]
+            value = values[before] + (values[after] - values[before]) * share
+            result[field] = round(value, decimals) if decimals else int(round(value))
+        for field in STEP_FIELDS:
+            result[field] = self.steps[field][before]
+        return result
+
+    def hourly(self, moment, count):
+        """The forecast points after a moment (not the starting conditions), at most count of them"""
+        index = max(bisect_right(self.times, _unix(moment)), 1)
+        hours = []
+        for i in range(index, min(index + count, len(self.times))):
+            hour = {'time': _datetime(self.times[i]).strftime('%Y-%m-%dT%H:%M:%SZ')}
+            hour.update(self.at(_datetime(self.times[i])))
+            hours.append(hour)
+        return hours
+
+
+def _synthetic_truth(start, days, seed=7):
+    """Minute-by-minute weather: a daily cycle, a cool change on the second afternoon, gusty wind"""
+    import math
+    import random
+
+    rng = random.Random(seed)
+    truth = []
+    wind = 4.0
+    for minute in range(days * 24 * 60 + 1):
+        moment = start + timedelta(minutes=minute)
+        hour = minute / 60.0
+        # Daily cycle peaking mid afternoon local time (start is local midnight)
+        temp = 21.0 + 4.5 * math.sin(2 * math.pi * (hour % 24 - 9) / 24)
+        # Cool change: 6 degrees down and rain likely over three hours from 15:00 on day two
+        change = min(max((hour - 39) / 3, 0.0), 1.0)
+        temp -= 6.0 * change
+        precipitation = 10 + 70 * change * max(0.0, 1 - max(hour - 45, 0) / 6)
+        wind += rng.gauss(0, 0.15) + (3.0 + 6.0 * change - wind) * 0.02
+        truth.append((moment, {
+            'temp': temp + rng.gauss(0, 0.1),
+            'feels_like': temp - 0.3 * wind + 1.5,
+            'precipitation_prob': precipitation,
+            'wind_speed': max(wind, 0.0),
+            'condition': 'Rain' if precipitation > 50 else 'Partly cloudy',
+            'condition_type': 'RAIN' if precipitation > 50 else 'PARTLY_CLOUDY',
+            'is_daytime': 6 <= hour % 24 < 19
+        }))
+    return truth
+
+
+def _forecast_points(truth, fetched_minute, seed):
+    """What a fetch at a minute returns: the conditions then and hourly forecasts with growing error"""
+    import random
+
+    rng = random.Random(seed * 100003 + fetched_minute)
+    fetched_at, current = truth[fetched_minute]
+    points = [(fetched_at, current)]
+    first_hour = (fetched_minute // 60 + 1) * 60
+    for minute in range(first_hour, min(first_hour + FORECAST_HOURS * 60, len(truth)), 60):
+        moment, values = truth[minute]
+        lead = (minute - fetched_minute) / 60.0
+        # Forecast error grows with lead time, and beyond two hours ahead forecasts run an hour behind
+        shifted = truth[max(minute - 60, 0)][1] if lead > 2 else values
+        forecast = dict(shifted)
+        forecast['temp'] = shifted['temp'] + rng.gauss(0, 0.3 + 0.05 * lead)
+        forecast['feels_like'] = shifted['feels_like'] + rng.gauss(0, 0.4 + 0.05 * lead)
+        forecast['wind_speed'] = max(shifted['wind_speed'] + rng.gauss(0, 0.5 + 0.05 * lead), 0.0)
+        forecast['precipitation_prob'] = min(max(shifted['precipitation_prob'] + rng.gauss(0, 5), 0), 100)
+        points.append((moment, forecast))
+    return points
+
+
+def replay(truth, fetch_minutes, interpolate, seed=7):
+    """
+    Serve every minute of a truth series from fetches every fetch_minutes,
+    interpolated over the forecast or (without) the conditions at the last
+    fetch. Returns (fetches, {field: (mean absolute error, 95th percentile)},
+    share of minutes with the wrong condition).
+    """
+    errors = {field: [] for field in INTERPOLATED_FIELDS}
+    wrong_condition = 0
+    series = current = None
+    fetches = 0
+    for minute, (moment, actual) in enumerate(truth):
+        if minute % fetch_minutes == 0:
+            fetches += 1
+            points = _forecast_points(truth, minute, seed)
+            series = ForecastSeries.from_points(points)
+            current = points[0][1]
+        served = series.at(serve_time(moment)) if interpolate else current
+        for field in INTERPOLATED_FIELDS:
+            errors[field].append(abs(served[field] - actual[field]))
+        wrong_condition += served['condition_type'] != actual['condition_type']
+
+    summary = {}
+    for field, values in errors.items():
+        values.sort()
+        summary[field] = (sum(values) / len(values), values[int(len(values) * 0.95)])
+    return fetches, summary, wrong_condition / len(truth)
+
+
+def main():
+    days = 2
+    truth = _synthetic_truth(datetime(2026, 3, 1, 13, 0), days)
+    setups = [
+        ('current', 10, False),
+        ('current', 180, False),
+        ('forecast', 60, True),
+        ('forecast', 180, True),
+        ('forecast', 360, True),
+        ('forecast', 720, True)
+    ]
+
+    print(f"{days} days of synthetic weather (a cool change on day two), served every minute\n")
+    print(f"{'served from':<11} {'fetch':>6} {'calls/day':>10} | {'temp':>11} {'feels':>11} {'rain %':>11} "
+          f"{'wind m/s':>11} | {'condition':>9}")
+    print(f"{'':<11} {'':>6} {'':>10} | " + ' '.join(f"{'mean':>5} {'p95':>5}" for _ in INTERPOLATED_FIELDS) +
+          f" | {'wrong':>9}")
+    results = {}
+    for source, fetch_minutes, interpolate in setups:
+        fetches, errors, wrong = replay(truth, fetch_minutes, interpolate)
+        results[(source, fetch_minutes)] = errors
+        calls = fetches * (2 if interpolate else 1) / days
+        print(f"{source:<11} {fetch_minutes:>5}m {calls:>10.0f} | " +
+              ' '.join(f"{mean:>5.2f} {p95:>5.2f}" for mean, p95 in errors.values()) + f" | {wrong:>8.1%}")
+    print("\ncalls/day counts the forecast call made with the current conditions")
+
+    # Between three-hourly fetches, the forecast keeps the temperature far closer than the last conditions
+    assert results[('forecast', 180)]['temp'][0] < results[('current', 180)]['temp'][0] / 2
+
+
+if __name__ == '__main__':
+    main()
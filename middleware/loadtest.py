@@ -0,0 +1,232 @@
+"""
+LILYGO T5 Weather Display - Middleware load test
+
+Simulates many displays waking at the same time: a number of concurrent
+clients each issue requests against a running middleware server, then the
+throughput and latency percentiles are reported.
+
+Run it once against each serving mode to compare their concurrency, e.g.
+with every request going upstream:
+
+    SCHEDULER_ENABLED=false SERVER_MODE=flask python app.py   # terminal 1
+    python loadtest.py --url http://localhost:5000/api/data --concurrency 20
+
+    SCHEDULER_ENABLED=false SERVER_MODE=asgi python app.py    # terminal 1
+    python loadtest.py --url http://localhost:5000/api/data --concurrency 20
+
+With --offline no server or API keys are needed: the mock upstream server
+(mockupstream.py) and a middleware with a throwaway config and cache are
+started, measured and stopped again. Save a run with --save and check a
+later run against it with --compare to catch regressions:
+
+    python loadtest.py --offline --mode asgi --save baseline.json
+    python loadtest.py --offline --mode asgi --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Allowed slowdown against a saved baseline before --compare fails
+DEFAULT_TOLERANCE = 0.2
+
+# Quota providers of the upstreams (see budget.py)
+PROVIDERS = ('google', 'coingecko', 'marketstack', 'transportnsw')
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_client(url, method, requests_count):
+    """One simulated display: sequential requests on its own connection"""
+    latencies = []
+    errors = 0
+    with requests.Session() as session:
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=30)
+                if response.status_code != 200:
+                    errors += 1
+            except requests.exceptions.RequestException:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies, errors
+
+
+def run_load(url, method, concurrency, requests_count):
+    """Run the simulated displays and return the summary results"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: run_client(url, method, requests_count), range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        'requests': len(latencies),
+        'errors': sum(client_errors for _, client_errors in results),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99)
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def offline_config(upstreams, scheduler):
+    """Config with placeholder keys, every upstream on the mock server and no quota counting"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(directory, 'config.template.json'), 'r') as f:
+        config = json.load(f)
+
+    for section in ('weather', 'crypto', 'stock', 'train'):
+        config[section]['api_key'] = 'offline'
+    config['weather'].update({'city': 'Sydney', 'country': 'AU'})
+    config['train'].update({'origin': '10101100', 'destination': '10101331'})
+    config['upstreams'] = upstreams
+    config['budget'] = {'quotas': {provider: {} for provider in PROVIDERS}}
+    if not scheduler:
+        # Requests refetch every source (stock included) from the mock; concurrent ones share a fetch
+        inline_config(config)
+    return config
+
+
+def inline_config(config):
+    """Disable the scheduler, result caching and quota counting so requests refetch from the upstreams"""
+    zero = {name: 0 for name in ('weather', 'crypto', 'stock', 'train')}
+    config['scheduler'] = {'enabled': False, 'intervals_seconds': zero}
+    config['cache'] = {'ttl_seconds': zero}
+    config['budget'] = {'quotas': {provider: {} for provider in PROVIDERS}}
+    return config
+
+
+def start_middleware(config, mode, directory):
+    """Start app.py in a subprocess on a free port and wait until /health answers"""
+    config_file = os.path.join(directory, 'config.json')
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+
+    port = _free_port()
+    env = dict(os.environ, CONFIG_FILE=config_file, SERVER_MODE=mode, PORT=str(port), HOST='127.0.0.1',
+               SCHEDULER_ENABLED=str(config['scheduler'].get('enabled', True)).lower())
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    process = subprocess.Popen([sys.executable, app_path], env=env, cwd=directory,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Middleware exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Middleware did not start within 30 seconds")
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing regressions beyond tolerance against a saved baseline"""
+    regressions = []
+    for key in ('p50', 'p95', 'p99'):
+        if results[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key} latency {results[key]:.1f} ms vs {baseline[key]:.1f} ms")
+    if results['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f"throughput {results['throughput']:.1f} req/s vs {baseline['throughput']:.1f} req/s")
+    if results['errors'] > baseline['errors']:
+        regressions.append(f"errors {results['errors']} vs {baseline['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a running middleware server')
+    parser.add_argument('--url', default='http://localhost:5000/api/data', help='endpoint to request')
+    parser.add_argument('--method', default='GET', choices=['GET', 'POST'], help='HTTP method (firmware uses GET)')
+    parser.add_argument('--concurrency', type=int, default=10, help='number of simulated displays (default: 10)')
+    parser.add_argument('--requests', type=int, default=10, help='requests per display (default: 10)')
+
+    offline = parser.add_argument_group('offline', 'start the mock upstream and a middleware instead of using --url')
+    offline.add_argument('--offline', action='store_true', help='benchmark against the mock upstream server')
+    offline.add_argument('--mode', default='flask', choices=['flask', 'asgi'], help='serving mode (default: flask)')
+    offline.add_argument('--path', default='/api/data', help='endpoint to request (default: /api/data)')
+    offline.add_argument('--inline', action='store_true',
+                         help='disable the scheduler and caching so requests refetch from the upstreams')
+    offline.add_argument('--latency', type=float, default=50, help='upstream latency in ms (default: 50)')
+    offline.add_argument('--jitter', type=float, default=20, help='upstream jitter in ms (default: 20)')
+    offline.add_argument('--error-rate', type=float, default=0.0, help='share of upstream calls that fail')
+
+    parser.add_argument('--save', help='write the results to a JSON file')
+    parser.add_argument('--compare', help='fail if the results are worse than a saved JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'allowed slowdown against the baseline (default: {DEFAULT_TOLERANCE})')
+    args = parser.parse_args()
+
+    url = args.url
+    mock = process = None
+    directory = tempfile.TemporaryDirectory()
+    try:
+        if args.offline:
+            from mockupstream import MockUpstream
+
+            mock = MockUpstream(latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate).start()
+            process, base_url = start_middleware(offline_config(mock.upstreams(), not args.inline), args.mode,
+                                                 directory.name)
+            url = base_url + args.path
+            # Warm-up request (cold snapshot, geocoding, connection pools)
+            requests.request(args.method, url, timeout=30)
+
+        results = run_load(url, args.method, args.concurrency, args.requests)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if mock is not None:
+            mock.stop()
+        directory.cleanup()
+
+    print(f"url:         {url}" + (f" ({args.mode}, mock upstream)" if args.offline else ''))
+    print(f"displays:    {args.concurrency} x {args.requests} requests")
+    print(f"errors:      {results['errors']}")
+    print(f"throughput:  {results['throughput']:.1f} req/s")
+    print(f"p50 latency: {results['p50']:.1f} ms")
+    print(f"p95 latency: {results['p95']:.1f} ms")
+    print(f"p99 latency: {results['p99']:.1f} ms")
+    if mock is not None:
+        upstream_calls = mock.get_stats()
+        print(f"upstream:    {sum(upstream_calls.values())} calls "
+              f"({', '.join(f'{name} {count}' for name, count in upstream_calls.items())})")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION:  {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+LILYGO T5 Weather Display - Middleware metrics
+Counters, gauges and histograms exposed in the Prometheus text format on /metrics.
+
+Recording is lock-free: every thread updates its own shard of plain dicts
+(the GIL makes each update safe), and only a scrape adds the shards up.
+The lock is taken when a thread records its first value and during a
+scrape, never on the hot path. Values that other modules already count
+(such as the result cache statistics) are read by collectors at scrape
+time instead of being recorded twice.
+
+Metrics are per process: with several workers, each scrape reports the
+worker that answered it.
+
+Run this module directly to measure the cost of recording a value.
+"""
+
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'middleware_upstream_request_seconds': (
+        'histogram', 'Latency of upstream API calls', LATENCY_BUCKETS),
+    'middleware_upstream_errors_total': (
+        'counter', 'Upstream API calls that failed or returned an HTTP error', None),
+    'middleware_upstream_in_flight': (
+        'gauge', 'Upstream API calls in progress', None),
+    'middleware_budget_refused_total': (
+        'counter', 'Upstream API calls refused because the provider quota was used up', None),
+    'middleware_circuit_skipped_total': (
+        'counter', 'Upstream API calls skipped because the upstream circuit breaker was open', None),
+    'middleware_deadline_missed_total': (
+        'counter', 'Sources answered with their last good value because they missed the response deadline', None),
+    'middleware_snapshot_reads_total': (
+        'counter', 'Source reads by result: fresh, stale (refreshed in the background) or miss (fetched inline)', None),
+    'middleware_not_modified_total': (
+        'counter', 'Requests answered with 304 Not Modified because the client already had the data, by endpoint', None),
+    'middleware_request_seconds': (
+        'histogram', 'Time to handle a request, by endpoint', LATENCY_BUCKETS),
+    'middleware_response_bytes': (
+        'histogram', 'Response body size, by endpoint', SIZE_BUCKETS),
+    'middleware_requests_in_flight': (
+        'gauge', 'Requests being handled, by endpoint', None)
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metrics:
+    """Registry of per-thread metric shards"""
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self.local = threading.local()
+        self.shards = []        # (thread, shard) of every thread that recorded a value
+        self.retired = {}       # totals of shards whose thread has exited
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self.local.shard = shard
+            with self.lock:
+                self._retire_dead_shards()
+                self.shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        """Fold shards of exited threads into self.retired (lock held)"""
+        alive = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self.retired, shard)
+        self.shards = alive
+
+    def inc(self, name, labels=(), value=1):
+        """Add to a counter or gauge; labels is a tuple of (label, value) pairs"""
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def dec(self, name, labels=(), value=1):
+        self.inc(name, labels, -value)
+
+    def observe(self, name, labels, value):
+        """Record a histogram observation"""
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        buckets = self.definitions[name][2]
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum
+            counts = [0] * (len(buckets) + 2)
+            shard[key] = counts
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def add_collector(self, collector):
+        """Register a function returning [(name, type, help, labels, value)] read at scrape time"""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        """Totals of all shards: {(name, labels): value or histogram counts}"""
+        with self.lock:
+            self._retire_dead_shards()
+            totals = {}
+            _merge(totals, self.retired)
+            for _, shard in self.shards:
+                _merge(totals, shard)
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        series = {}
+        for (name, labels), value in sorted(self.snapshot().items()):
+            series.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            if name not in series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series[name]:
+                if kind != 'histogram':
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+        collected = {}
+        for collector in self.collectors:
+            for name, kind, help_text, labels, value in collector():
+                collected.setdefault((name, kind, help_text), []).append((labels, value))
+        for (name, kind, help_text), values in collected.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(totals, shard):
+    # list() copies the items in one step, so a thread recording meanwhile can't break the iteration
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+metrics = Metrics(METRICS)
+
+
+def main():
+    import timeit
+
+    runs = 200000
+    labels = (('upstream', 'weather'),)
+    registry = Metrics(METRICS)
+    lock = threading.Lock()
+    counts = {}
+
+    def locked_inc():
+        with lock:
+            counts[labels] = counts.get(labels, 0) + 1
+
+    results = [
+        ('inc (counter)', lambda: registry.inc('middleware_upstream_errors_total', labels)),
+        ('observe (histogram)', lambda: registry.observe('middleware_upstream_request_seconds', labels, 0.042)),
+        ('dict + lock, for reference', locked_inc)
+    ]
+    for name, record in results:
+        ns = timeit.timeit(record, number=runs) / runs * 1e9
+        print(f"{name:<28} {ns:>6.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+LILYGO T5 Weather Display - Mock upstream server
+Stand-in for the Google Geocoding/Weather, CoinGecko, MarketStack and
+Transport NSW APIs, so the middleware can be run and benchmarked offline.
+
+Responses are recorded fixtures (fixtures/*.json) in the shapes app.py
+parses. CoinGecko and MarketStack answers are filtered to the requested
+coins and symbols, trip times are shifted so the first recorded
+departure leaves a few minutes from now, and the hourly forecast starts
+at the current hour. Every response waits a latency
+plus random jitter, and a share of them fail with an HTTP error.
+
+Point the middleware at it with the 'upstreams' config section:
+
+    "upstreams": {
+      "geocode": "http://localhost:8081",
+      "weather": "http://localhost:8081",
+      "crypto": "http://localhost:8081",
+      "stock": "http://localhost:8081",
+      "train": "http://localhost:8081"
+    }
+
+Usage:
+    python mockupstream.py --port 8081 --latency 80 --jitter 40 --error-rate 0.01
+
+GET /_stats returns the number of requests served per upstream.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.getenv('FIXTURES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+
+# Request path -> upstream name and fixture file
+ROUTES = {
+    '/maps/api/geocode/json': 'geocode',
+    '/v1/currentConditions:lookup': 'weather',
+    '/v1/forecast/hours:lookup': 'forecast',
+    '/api/v3/simple/price': 'crypto',
+    '/v1/eod/latest': 'stock',
+    '/v1/tp/trip': 'train'
+}
+
+# The first recorded departure is moved this far into the future
+TRAIN_LEAD_MINUTES = 3
+
+
+def load_fixtures(directory=FIXTURES_DIR):
+    """{upstream: parsed fixture} for every route"""
+    fixtures = {}
+    for upstream in ROUTES.values():
+        with open(os.path.join(directory, f"{upstream}.json"), 'r', encoding='utf-8') as f:
+            fixtures[upstream] = json.load(f)
+    return fixtures
+
+
+def _parse_time(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+def _shift_times(data, shift):
+    """Copy of a trip or forecast response with every departure/arrival and interval time moved by shift"""
+    if isinstance(data, dict):
+        return {key: (_parse_time(value) + shift).strftime('%Y-%m-%dT%H:%M:%SZ')
+                if key.startswith(('departureTime', 'arrivalTime', 'startTime', 'endTime'))
+                else _shift_times(value, shift)
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [_shift_times(value, shift) for value in data]
+    return data
+
+
+def crypto_response(fixture, query):
+    """simple/price answers only the requested ids; unknown ids are left out"""
+    ids = query.get('ids', [''])[0].split(',')
+    return {coin_id: fixture[coin_id] for coin_id in ids if coin_id in fixture}
+
+
+def stock_response(fixture, query):
+    """eod/latest answers one entry per requested symbol it knows"""
+    symbols = query.get('symbols', [''])[0].upper().split(',')
+    data = [entry for entry in fixture['data'] if entry['symbol'] in symbols]
+    return {'pagination': dict(fixture['pagination'], count=len(data), total=len(data)), 'data': data}
+
+
+def train_response(fixture, query, now=None):
+    """Recorded journeys moved so the first one departs TRAIN_LEAD_MINUTES from now"""
+    first = _parse_time(fixture['journeys'][0]['legs'][0]['origin']['departureTimePlanned'])
+    now = (now or datetime.now(timezone.utc)).replace(second=0, microsecond=0)
+    return _shift_times(fixture, now + timedelta(minutes=TRAIN_LEAD_MINUTES) - first)
+
+
+def forecast_response(fixture, query, now=None):
+    """Recorded forecast hours moved so the first one is the current hour, as many as requested"""
+    first = _parse_time(fixture['forecastHours'][0]['interval']['startTime'])
+    now = (now or datetime.now(timezone.utc)).replace(minute=0, second=0, microsecond=0)
+    hours = int(query.get('pageSize', query.get('hours', ['24']))[0])
+    shifted = _shift_times(fixture, now - first)
+    return dict(shifted, forecastHours=shifted['forecastHours'][:hours])
+
+
+RESPONDERS = {
+    'forecast': forecast_response,
+    'crypto': crypto_response,
+    'stock': stock_response,
+    'train': train_response
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that stop reading a body early (the streamed trip parser) reset the connection
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockUpstream:
+    """Fixture server with latency, jitter and an error rate, run on a background thread"""
+
+    def __init__(self, port=0, latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=503,
+                 fixtures_dir=FIXTURES_DIR, host='127.0.0.1'):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fixtures = load_fixtures(fixtures_dir)
+        self.stats = {upstream: 0 for upstream in ROUTES.values()}
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def upstreams(self):
+        """'upstreams' config section pointing every upstream at this server"""
+        return {upstream: self.url for upstream in ROUTES.values()}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-upstream', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def respond(self, path, query):
+        """(status, body) for a request, after the simulated latency"""
+        upstream = ROUTES.get(path)
+        if path == '/_stats':
+            return 200, self.get_stats()
+        if upstream is None:
+            return 404, {'error': f'No mock for {path}'}
+
+        with self.lock:
+            self.stats[upstream] += 1
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if random.random() < self.error_rate:
+            return self.error_status, {'error': 'Simulated upstream error'}
+
+        fixture = self.fixtures[upstream]
+        responder = RESPONDERS.get(upstream)
+        return 200, responder(fixture, query) if responder else fixture
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, body = mock.respond(url.path, parse_qs(url.query))
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded upstream API responses for offline testing')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8081, help='port to listen on (default: 8081)')
+    parser.add_argument('--latency', type=float, default=50, help='response latency in ms (default: 50)')
+    parser.add_argument('--jitter', type=float, default=20, help='random +/- jitter in ms (default: 20)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests that fail (default: 0)')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status of failures (default: 503)')
+    args = parser.parse_args()
+
+    mock = MockUpstream(args.port, args.latency, args.jitter, args.error_rate, args.error_status, host=args.host)
+    print(f"Mock upstream on {mock.url} (latency {args.latency:g}+/-{args.jitter:g} ms, "
+          f"error rate {args.error_rate:g})")
+    print(json.dumps({'upstreams': mock.upstreams()}, indent=2))
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+LILYGO T5 Weather Display - Middleware binary payload
+Compact fixed-layout encoding of the /api/data aggregate for the ESP32.
+
+The firmware reads the payload straight into a packed C struct (see
+`MiddlewarePayload` in src/main.ino), so it needs no JSON parser and no
+dynamic allocation. All integers are little-endian, strings are fixed-size,
+UTF-8 and always NUL-terminated. Every section is always present; a section
+whose data is missing or an error has its flag bit cleared and is zeroed.
+
+Layout (version 3, 195 bytes):
+
+    header   magic "LW", version u8, flags u8, timestamp u32 (unix seconds),
+             next_refresh_seconds u16 (0 if unknown)
+    weather  temp, feels_like, temp_max, temp_min (i16, x10),
+             precipitation_prob u8, is_daytime u8, units u8 (0 metric, 1 imperial),
+             wind_speed u16 (x10), age_seconds u32,
+             condition_type char[20], condition char[32], city char[24]
+    crypto   price i32, change_24h i32 (x100), symbol char[8], age_seconds u32
+    stock    price i32 (x100), change i32 (x100), currency char[4],
+             symbol char[8], age_seconds u32
+    train    departure_time u32 (unix seconds, 0 if unknown), via char[32],
+             age_seconds u32, later_departures u32[2] (the next departures
+             after departure_time, 0 if none)
+
+Run this module directly to compare size and encode time with the JSON path.
+"""
+
+import struct
+from datetime import datetime, timezone
+
+PAYLOAD_MAGIC = b'LW'
+PAYLOAD_VERSION = 3
+PAYLOAD_MIMETYPE = 'application/octet-stream'
+
+# Flag bits telling which sections hold valid data
+FLAG_WEATHER = 0x01
+FLAG_CRYPTO = 0x02
+FLAG_STOCK = 0x04
+FLAG_TRAIN = 0x08
+
+UNITS = ['metric', 'imperial']
+
+# Schema: (field, struct format, scale). Numbers are stored as round(value * scale);
+# a scale of None marks a string, 'time' an ISO 8601 timestamp stored as unix seconds
+# and 'units' an index into UNITS.
+HEADER_SCHEMA = [
+    ('magic', '2s', None),
+    ('version', 'B', 1),
+    ('flags', 'B', 1),
+    ('timestamp', 'I', 'time'),
+    ('next_refresh_seconds', 'H', 1)
+]
+
+SECTION_SCHEMAS = {
+    'weather': [
+        ('temp', 'h', 10),
+        ('feels_like', 'h', 10),
+        ('temp_max', 'h', 10),
+        ('temp_min', 'h', 10),
+        ('precipitation_prob', 'B', 1),
+        ('is_daytime', 'B', 1),
+        ('units', 'B', 'units'),
+        ('wind_speed', 'H', 10),
+        ('age_seconds', 'I', 1),
+        ('condition_type', '20s', None),
+        ('condition', '32s', None),
+        ('city', '24s', None)
+    ],
+    'crypto': [
+        ('price', 'i', 1),
+        ('change_24h', 'i', 100),
+        ('symbol', '8s', None),
+        ('age_seconds', 'I', 1)
+    ],
+    'stock': [
+        ('price', 'i', 100),
+        ('change', 'i', 100),
+        ('currency', '4s', None),
+        ('symbol', '8s', None),
+        ('age_seconds', 'I', 1)
+    ],
+    'train': [
+        ('departure_time', 'I', 'time'),
+        ('via', '32s', None),
+        ('age_seconds', 'I', 1),
+        ('later_departure_1', 'I', 'time'),
+        ('later_departure_2', 'I', 'time')
+    ]
+}
+
+SECTION_FLAGS = {
+    'weather': FLAG_WEATHER,
+    'crypto': FLAG_CRYPTO,
+    'stock': FLAG_STOCK,
+    'train': FLAG_TRAIN
+}
+
+
+def _struct(schema):
+    return struct.Struct('<' + ''.join(fmt for _, fmt, _ in schema))
+
+
+HEADER_STRUCT = _struct(HEADER_SCHEMA)
+SECTION_STRUCTS = {name: _struct(schema) for name, schema in SECTION_SCHEMAS.items()}
+PAYLOAD_SIZE = HEADER_STRUCT.size + sum(s.size for s in SECTION_STRUCTS.values())
+
+# Value ranges of the integer formats, used to clamp out-of-range values
+_INT_RANGES = {
+    'B': (0, 0xFF),
+    'h': (-0x8000, 0x7FFF),
+    'H': (0, 0xFFFF),
+    'i': (-0x80000000, 0x7FFFFFFF),
+    'I': (0, 0xFFFFFFFF)
+}
+
+
+def _to_unix(value):
+    """ISO 8601 timestamp (naive timestamps are UTC) to unix seconds, 0 if missing or invalid"""
+    if not value:
+        return 0
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return 0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _from_unix(value):
+    if not value:
+        return ''
+    return datetime.fromtimestamp(value, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _encode_string(value, size):
+    """UTF-8, truncated on a character boundary so the last byte stays NUL"""
+    encoded = str(value or '').encode('utf-8')[:size - 1]
+    return encoded.decode('utf-8', 'ignore').encode('utf-8')
+
+
+def _encode_values(schema, data):
+    values = []
+    for field, fmt, scale in schema:
+        value = data.get(field)
+        if scale is None:
+            values.append(_encode_string(value, int(fmt[:-1])))
+            continue
+        if scale == 'time':
+            number = _to_unix(value)
+        elif scale == 'units':
+            number = UNITS.index(value) if value in UNITS else 0
+        else:
+            number = int(round(float(value or 0) * scale))
+        low, high = _INT_RANGES[fmt]
+        values.append(min(max(number, low), high))
+    return values
+
+
+def _decode_values(schema, values):
+    data = {}
+    for (field, fmt, scale), value in zip(schema, values):
+        if scale is None:
+            data[field] = value.split(b'\0', 1)[0].decode('utf-8')
+        elif scale == 'time':
+            data[field] = _from_unix(value)
+        elif scale == 'units':
+            data[field] = UNITS[value] if value < len(UNITS) else UNITS[0]
+        elif scale == 1:
+            data[field] = value
+        else:
+            data[field] = value / scale
+    return data
+
+
+def _flatten_departures(train):
+    """Train section with the departures after the first one as later_departure_N fields"""
+    flat = dict(train)
+    for index, departure in enumerate(train.get('departures', [])[1:3]):
+        flat[f'later_departure_{index + 1}'] = departure.get('departure_time')
+    return flat
+
+
+def encode_payload(aggregate):
+    """Encode an /api/data aggregate dict to the binary payload"""
+    flags = 0
+    sections = b''
+    for name, section_struct in SECTION_STRUCTS.items():
+        data = aggregate.get(name)
+        if isinstance(data, dict) and 'error' not in data:
+            if name == 'train':
+                data = _flatten_departures(data)
+            flags |= SECTION_FLAGS[name]
+            sections += section_struct.pack(*_encode_values(SECTION_SCHEMAS[name], data))
+        else:
+            sections += bytes(section_struct.size)
+
+    header = HEADER_STRUCT.pack(PAYLOAD_MAGIC, PAYLOAD_VERSION, flags, _to_unix(aggregate.get('timestamp')),
+                                min(max(int(aggregate.get('next_refresh_seconds') or 0), 0), 0xFFFF))
+    return header + sections
+
+
+def decode_payload(payload):
+    """Decode a binary payload back to an aggregate dict (sections without data are None)"""
+    if len(payload) != PAYLOAD_SIZE:
+        raise ValueError(f"Payload is {len(payload)} bytes, expected {PAYLOAD_SIZE}")
+
+    magic, version, flags, timestamp, next_refresh_seconds = HEADER_STRUCT.unpack_from(payload, 0)
+    if magic != PAYLOAD_MAGIC or version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported payload (magic {magic!r}, version {version})")
+
+    aggregate = {'timestamp': _from_unix(timestamp), 'next_refresh_seconds': next_refresh_seconds}
+    offset = HEADER_STRUCT.size
+    for name, section_struct in SECTION_STRUCTS.items():
+        if flags & SECTION_FLAGS[name]:
+            aggregate[name] = _decode_values(SECTION_SCHEMAS[name], section_struct.unpack_from(payload, offset))
+        else:
+            aggregate[name] = None
+        offset += section_struct.size
+    return aggregate
+
+
+SAMPLE_AGGREGATE = {
+    'timestamp': '2026-01-02T03:04:05.123456',
+    'next_refresh_seconds': 295,
+    'weather': {
+        'temp': 21.3, 'feels_like': 20.9, 'temp_max': 25.1, 'temp_min': 15.4,
+        'precipitation_prob': 20, 'wind_speed': 4.2, 'condition': 'Partly cloudy',
+        'condition_type': 'PARTLY_CLOUDY', 'is_daytime': True, 'city': 'Sydney',
+        'units': 'metric', 'age_seconds': 42
+    },
+    'crypto': {'symbol': 'BTC', 'price': 65012, 'change_24h': -1.23, 'age_seconds': 12},
+    'stock': {'symbol': 'AAPL', 'price': 189.84, 'currency': 'USD', 'change': 1.52, 'age_seconds': 3600},
+    'train': {
+        'departure_time': '2026-01-02T03:15:00Z', 'via': 'Central', 'age_seconds': 5,
+        'departures': [
+            {'departure_time': '2026-01-02T03:15:00Z', 'via': 'Central'},
+            {'departure_time': '2026-01-02T03:22:00Z', 'via': 'Central'},
+            {'departure_time': '2026-01-02T03:29:00Z', 'via': 'Central'}
+        ]
+    }
+}
+
+
+def main():
+    import json
+    import timeit
+
+    decoded = decode_payload(encode_payload(SAMPLE_AGGREGATE))
+    for name in SECTION_SCHEMAS:
+        for field, value in _flatten_departures(SAMPLE_AGGREGATE[name]).items():
+            if field == 'departures':
+                continue
+            expected = _from_unix(_to_unix(value)) if 'departure' in field else value
+            assert decoded[name][field] == expected, f"{name}.{field}: {decoded[name][field]!r} != {expected!r}"
+    assert decoded['next_refresh_seconds'] == SAMPLE_AGGREGATE['next_refresh_seconds']
+    print("round trip:  OK")
+
+    json_bytes = json.dumps(SAMPLE_AGGREGATE, separators=(',', ':')).encode('utf-8')
+    runs = 20000
+    json_us = timeit.timeit(lambda: json.dumps(SAMPLE_AGGREGATE).encode('utf-8'), number=runs) / runs * 1e6
+    binary_us = timeit.timeit(lambda: encode_payload(SAMPLE_AGGREGATE), number=runs) / runs * 1e6
+
+    print(f"{'format':<8} {'bytes':>6} {'encode us':>10}")
+    print(f"{'json':<8} {len(json_bytes):>6} {json_us:>10.1f}")
+    print(f"{'binary':<8} {PAYLOAD_SIZE:>6} {binary_us:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,713 @@
+"""
+LILYGO T5 Weather Display - Middleware frame renderer
+Renders the display layout of src/main.ino (displayWeather) to a 960x540,
+4-bit-per-pixel framebuffer, so the board only has to inflate and blit it.
+
+Fonts and icons are loaded from the firmware's own headers in lib/ (set
+ASSETS_DIR when the middleware runs outside the repository), so the frame
+uses exactly the glyphs and bitmaps the board would draw itself. Text is
+placed the way epdiy places it: glyph rows start at baseline - top, and
+a glyph only ever darkens the pixels under it.
+
+The framebuffer uses the epdiy layout: row-major, two pixels per byte with
+the left pixel in the low nibble, 0 black to 15 white.
+
+Frame format (version 1), served by /api/frame:
+
+    header   magic "LF", version u8, kind u8 (0 full frame, 1 diff),
+             width u16, height u16, crc32 u32 of the resulting framebuffer
+    full     zlib stream of the framebuffer (width * height / 2 bytes)
+    diff     zlib stream of: base crc32 u32, rect count u16, then per rect
+             x u16, y u16, width u16, height u16 (x and width even) and
+             height rows of width / 2 bytes
+
+A device that sends the CRC of the frame it shows gets a diff against it,
+so it only has to refresh the changed rectangles instead of the whole panel.
+
+Run this module directly to render a sample frame, report render time and
+compressed size and replay a recorded data sequence through the diff path;
+--preview writes the sample frame as a PNG.
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+EPD_WIDTH = 960
+EPD_HEIGHT = 540
+FRAME_BYTES = EPD_WIDTH * EPD_HEIGHT // 2
+
+FRAME_MAGIC = b'LF'
+FRAME_VERSION = 1
+FRAME_KIND_FULL = 0
+FRAME_KIND_DIFF = 1
+FRAME_MIMETYPE = 'application/octet-stream'
+FRAME_HEADER = struct.Struct('<2sBBHHI')
+
+# Diff body: base frame crc32, rectangle count, then per rectangle x, y,
+# width, height and its packed pixel rows
+DIFF_HEADER = struct.Struct('<IH')
+DIFF_RECT = struct.Struct('<HHHH')
+# The board inflates diffs into a frame-sized buffer; larger diffs are sent as full frames
+MAX_DIFF_BYTES = FRAME_BYTES
+
+DIFF_TILE_BYTES = 8     # rectangles are aligned to 16 pixels horizontally
+DIFF_MERGE_ROWS = 8     # changed rows closer than this share a rectangle
+DIFF_MERGE_TILES = 2    # so do changed tiles closer than this in a row
+FRAME_HISTORY = 4       # frames remembered per device to diff against
+
+ASSETS_DIR = os.getenv(
+    'ASSETS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib')
+)
+
+
+class AssetsMissing(Exception):
+    """A font or icon header is not in ASSETS_DIR, so no frame can be rendered"""
+
+
+def _asset_path(kind, name):
+    """Path of a font or icon header in ASSETS_DIR, raising AssetsMissing if it isn't there"""
+    path = os.path.join(ASSETS_DIR, kind, 'src', f"{name}.h")
+    if not os.path.isfile(path):
+        raise AssetsMissing(f"{path} not found: set ASSETS_DIR to the repository's lib/ directory "
+                            f"(in Docker, mount it at /app/lib)")
+    return path
+
+
+# Parsed fonts and icons, loaded on first use
+assets = {
+    'fonts': {},
+    'icons': {},
+    'lock': threading.Lock()
+}
+
+_HEX_BYTE = re.compile(r'0x([0-9A-Fa-f]{2})')
+_NUMBER = re.compile(r'-?(?:0x[0-9A-Fa-f]+|\d+)')
+
+
+def _c_array(source, name):
+    """Body of the C array initializer `name[...] = { ... };`"""
+    match = re.search(re.escape(name) + r'\s*\[[^\]]*\]\s*=\s*\{(.*?)\n\s*\};', source, re.S)
+    if match is None:
+        raise ValueError(f"Array {name} not found")
+    return match.group(1)
+
+
+def _c_bytes(source, name):
+    return bytes(int(value, 16) for value in _HEX_BYTE.findall(_c_array(source, name)))
+
+
+def _c_rows(source, name):
+    """Rows of a C struct array, one `{ ... }` per line (comments after the row are ignored)"""
+    rows = []
+    for line in _c_array(source, name).splitlines():
+        match = re.match(r'\s*\{([^}]*)\}', line)
+        if match:
+            rows.append([int(value, 0) for value in _NUMBER.findall(match.group(1))])
+    return rows
+
+
+class Font:
+    """An epdiy GFXfont parsed from a fontconvert header (lib/fonts/src/lexend*.h)"""
+
+    def __init__(self, path, name):
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+
+        self.bitmap = _c_bytes(source, f"{name}Bitmaps")
+        # width, height, advance_x, left, top, compressed_size, data_offset
+        self.glyphs = _c_rows(source, f"{name}Glyphs")
+        # first, last, offset into glyphs
+        self.intervals = _c_rows(source, f"{name}Intervals")
+
+        fields = re.search(r'GFXfont\s+' + re.escape(name) + r'\s*=\s*\{(.*?)\};', source, re.S).group(1)
+        _, self.compressed, self.advance_y, self.ascender, self.descender = [
+            int(value) for value in re.findall(r'^\s*(-?\d+),?\s*$', fields, re.M)
+        ]
+        self.pixels = {}
+
+    def glyph(self, code_point):
+        for first, last, offset in self.intervals:
+            if first <= code_point <= last:
+                return self.glyphs[offset + code_point - first]
+        return None
+
+    def glyph_bitmap(self, code_point):
+        """Packed 4bpp alpha rows of a glyph, (width + 1) // 2 bytes each, the left pixel in the low nibble"""
+        width, height, _, _, _, compressed_size, offset = self.glyph(code_point)
+        if self.compressed:
+            return zlib.decompress(self.bitmap[offset:offset + compressed_size])
+        return self.bitmap[offset:offset + (width + 1) // 2 * height]
+
+    def glyph_pixels(self, code_point):
+        """Non-white pixels of a glyph as (dx, dy, color) relative to the cursor on the baseline"""
+        pixels = self.pixels.get(code_point)
+        if pixels is None:
+            width, height, _, left, top, _, _ = self.glyph(code_point)
+            byte_width = (width + 1) // 2
+            bitmap = self.glyph_bitmap(code_point)
+
+            pixels = []
+            for y in range(height):
+                for x in range(width):
+                    alpha = (bitmap[y * byte_width + x // 2] >> ((x % 2) * 4)) & 0xF
+                    if alpha:
+                        # Black text on white: color = bg + alpha * (fg - bg) / 15
+                        pixels.append((left + x, y - top, 15 - alpha))
+            self.pixels[code_point] = pixels
+        return pixels
+
+
+class Icon:
+    """
+    A 4bpp weather icon parsed from lib/icons/src/<name>.h; data shorter than
+    the bitmap is a zlib stream (headers compiled by assets.py), inflated here
+    like the firmware does before drawing.
+    """
+
+    def __init__(self, path, name):
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+
+        self.width = int(re.search(re.escape(name) + r'_width\s*=\s*(\d+)', source).group(1))
+        self.height = int(re.search(re.escape(name) + r'_height\s*=\s*(\d+)', source).group(1))
+        self.data = _c_bytes(source, f"{name}_data")
+        if len(self.data) < self.width * self.height // 2:
+            self.data = zlib.decompress(self.data)
+
+
+def get_font(size):
+    """Lexend font of the given size (10, 14, 18, 28, 32 or 40), loaded on first use"""
+    with assets['lock']:
+        font = assets['fonts'].get(size)
+        if font is None:
+            font = Font(_asset_path('fonts', f"lexend{size}"), f"Lexend{size}")
+            assets['fonts'][size] = font
+        return font
+
+
+def get_icon(name):
+    """Weather icon by header name (e.g. 'clear_day'), loaded on first use"""
+    with assets['lock']:
+        icon = assets['icons'].get(name)
+        if icon is None:
+            icon = Icon(_asset_path('icons', name), name)
+            assets['icons'][name] = icon
+        return icon
+
+
+def text_bounds(font, text, x, y):
+    """(x1, y1, w, h) of a string drawn at (x, y), computed like epdiy's get_text_bounds"""
+    if not text:
+        return x, y, 0, 0
+
+    min_x, min_y, max_x, max_y = 100000, 100000, -1, -1
+    cursor_x = x
+    for char in text:
+        glyph = font.glyph(ord(char))
+        if glyph is None:
+            continue
+        width, height, advance_x, left, top, _, _ = glyph
+        x1 = cursor_x + left
+        y1 = y + top - height
+        min_x, min_y = min(min_x, x1), min(min_y, y1)
+        max_x, max_y = max(max_x, x1 + width), max(max_y, y1 + height)
+        cursor_x += advance_x
+
+    x1 = min(x, min_x)
+    return x1, min_y, max_x - x1, max_y - min_y
+
+
+def _darken(frame, x, y, color):
+    if 0 <= x < EPD_WIDTH and 0 <= y < EPD_HEIGHT:
+        index = y * (EPD_WIDTH // 2) + x // 2
+        old = frame[index]
+        if x % 2:
+            if color < old >> 4:
+                frame[index] = (old & 0x0F) | (color << 4)
+        elif color < old & 0x0F:
+            frame[index] = (old & 0xF0) | color
+
+
+def draw_text(frame, font, text, x, y):
+    """Draw a single line of text with its baseline at y (writeln)"""
+    cursor_x = x
+    for char in text:
+        glyph = font.glyph(ord(char))
+        if glyph is None:
+            continue
+        for dx, dy, color in font.glyph_pixels(ord(char)):
+            _darken(frame, cursor_x + dx, y + dy, color)
+        cursor_x += glyph[2]
+
+
+def draw_icon(frame, icon, x, y):
+    """Draw a 4bpp image with its top-left corner at (x, y) (epd_draw_grayscale_image)"""
+    row_bytes = icon.width // 2
+    for row in range(icon.height):
+        for column in range(icon.width):
+            value = icon.data[row * row_bytes + column // 2]
+            color = (value >> 4) if column % 2 else (value & 0x0F)
+            if color < 15:
+                _darken(frame, x + column, y + row, color)
+
+
+def icon_name(condition_type, is_daytime):
+    """Icon for a Google Weather condition type, same mapping as getIconData() in main.ino"""
+    condition = condition_type.lower()
+    clear = 'clear_day' if is_daytime else 'clear_night'
+
+    if 'thunder' in condition:
+        return 'thunderstorms'
+    if 'hail' in condition:
+        return 'hail'
+    if 'snow' in condition:
+        return 'snow'
+    if 'storm' in condition:
+        return 'thunderstorms'
+    if 'rain' in condition or 'shower' in condition or 'drizzle' in condition:
+        return 'rain'
+    if 'mostly_clear' in condition or 'partly' in condition:
+        return clear
+    if 'cloud' in condition or 'overcast' in condition:
+        return 'cloudy'
+    if 'clear' in condition or 'sunny' in condition:
+        return clear
+    if 'wind' in condition or 'breezy' in condition or 'gust' in condition:
+        return 'windy'
+    return 'unknown'
+
+
+def _fixed(value, digits=0):
+    """Arduino String(value, digits): rounds halves away from zero"""
+    quantum = Decimal(1).scaleb(-digits)
+    return str(Decimal(str(float(value))).quantize(quantum, rounding=ROUND_HALF_UP))
+
+
+def _signed(value):
+    return f"{float(value):+.2f}"
+
+
+def _local_time(value, tz):
+    """ISO 8601 UTC timestamp to local HH:MMAM/PM (formatLocalTime in main.ino)"""
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return '--:--'
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(tz).strftime('%I:%M%p')
+
+
+def _valid(section):
+    return isinstance(section, dict) and 'error' not in section
+
+
+def display_values(aggregate, labels, tz):
+    """
+    The strings main.ino shows for an /api/data aggregate.
+
+    labels holds the device's configured city, crypto_symbol and
+    stock_symbol; sections without data keep the firmware's defaults.
+    """
+    now = datetime.now(tz)
+    values = {
+        'city': labels.get('city', ''),
+        'day': now.strftime('%a'),
+        'date': now.strftime('%d %b'),
+        'temp': '--',
+        'feels_like': '--',
+        'temp_max': '--',
+        'temp_min': '--',
+        'precipitation': '--',
+        'wind_speed': '--',
+        'condition': 'Loading...',
+        'icon': 'unknown',
+        'crypto': f"{labels.get('crypto_symbol', '').upper()}: USD --, --",
+        'stock': f"{labels.get('stock_symbol', '').upper()}: -- --, --",
+        'train_departure_time': '--:--',
+        'train_via': '--',
+        'train_later': ''
+    }
+
+    weather = aggregate.get('weather')
+    if _valid(weather):
+        unit_symbol = '°F' if weather.get('units') == 'imperial' else '°C'
+        values.update({
+            'temp': _fixed(weather.get('temp', 0)) + unit_symbol,
+            'feels_like': _fixed(weather.get('feels_like', 0)) + unit_symbol,
+            'temp_max': _fixed(weather.get('temp_max', 0)),
+            'temp_min': _fixed(weather.get('temp_min', 0)),
+            'precipitation': f"{int(weather.get('precipitation_prob', 0))}%",
+            'wind_speed': _fixed(weather.get('wind_speed', 0)) + ' m/s',
+            'condition': weather.get('condition', 'Unknown'),
+            'icon': icon_name(weather.get('condition_type', 'UNKNOWN'), weather.get('is_daytime', True))
+        })
+
+    crypto = aggregate.get('crypto')
+    if _valid(crypto):
+        values['crypto'] = (f"{labels.get('crypto_symbol', '').upper()}: USD {int(crypto.get('price', 0))}, "
+                            f"{_signed(crypto.get('change_24h', 0))}")
+
+    stock = aggregate.get('stock')
+    if _valid(stock):
+        values['stock'] = (f"{labels.get('stock_symbol', '').upper()}: {stock.get('currency', 'USD')} "
+                           f"{float(stock.get('price', 0)):.2f}, {_signed(stock.get('change', 0))}")
+
+    train = aggregate.get('train')
+    if _valid(train):
+        values['train_departure_time'] = _local_time(train.get('departure_time'), tz)
+        values['train_via'] = train.get('via', '')
+        later = [_local_time(departure.get('departure_time'), tz) for departure in train.get('departures', [])[1:3]]
+        if later:
+            values['train_later'] = 'Then ' + ', '.join(later)
+
+    return values
+
+
+def _draw_centered(frame, font, text, center_x, y):
+    _, _, w, h = text_bounds(font, text, center_x, y)
+    draw_text(frame, font, text, center_x - w // 2, y + h)
+
+
+def render_frame(values, updated_at):
+    """Render the display for display_values() to a packed 4bpp framebuffer (displayWeather in main.ino)"""
+    frame = bytearray(b'\xff' * FRAME_BYTES)
+    lexend10, lexend14, lexend18, lexend28, lexend40 = (get_font(size) for size in (10, 14, 18, 28, 40))
+
+    # LEFT COLUMN: city, icon, temperature, high/low, train
+    _draw_centered(frame, lexend28, values['city'], 240, 40)
+    draw_icon(frame, get_icon(values['icon']), 190, 120)
+    _draw_centered(frame, lexend40, values['temp'], 240, 240)
+    _draw_centered(frame, lexend18, f"H {values['temp_max']} - L {values['temp_min']}", 240, 320)
+    draw_text(frame, lexend14, f"Train to city : {values['train_departure_time']}", 20, 420)
+    draw_text(frame, lexend14, values['train_via'], 20, 460)
+    if values['train_later']:
+        draw_text(frame, lexend10, values['train_later'], 20, 490)
+
+    # RIGHT COLUMN: date, condition and details, markets
+    draw_text(frame, lexend28, f"{values['day']} {values['date']}", 500, 80)
+    draw_text(frame, lexend18, values['condition'], 500, 160)
+    draw_text(frame, lexend18, f"Feels like: {values['feels_like']}", 500, 220)
+    draw_text(frame, lexend18, f"Precipitation: {values['precipitation']}", 500, 280)
+    draw_text(frame, lexend18, f"Wind: {values['wind_speed']}", 500, 340)
+    draw_text(frame, lexend14, values['stock'], 500, 420)
+    draw_text(frame, lexend14, values['crypto'], 500, 460)
+
+    # BOTTOM: when the frame was rendered; the board draws its own battery level at (500, 520)
+    draw_text(frame, lexend10, updated_at.strftime('Update: %d %b %Y @ %H:%M'), 20, EPD_HEIGHT - 20)
+
+    return bytes(frame)
+
+
+def encode_frame(framebuffer):
+    """Header plus zlib-compressed framebuffer"""
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_KIND_FULL,
+                               EPD_WIDTH, EPD_HEIGHT, zlib.crc32(framebuffer))
+    return header + zlib.compress(framebuffer, 9)
+
+
+def _runs(mask, count, gap):
+    """(first, last) runs of set bits in mask, merging runs fewer than gap bits apart"""
+    runs = []
+    for bit in range(count):
+        if mask >> bit & 1:
+            if runs and bit - runs[-1][1] <= gap:
+                runs[-1][1] = bit
+            else:
+                runs.append([bit, bit])
+    return runs
+
+
+def frame_diff_rects(old, new):
+    """Rectangles (x, y, width, height) in pixels covering every pixel that differs"""
+    row_bytes = EPD_WIDTH // 2
+    tiles = row_bytes // DIFF_TILE_BYTES
+
+    # Bit mask of changed tiles per row
+    masks = []
+    for y in range(EPD_HEIGHT):
+        start = y * row_bytes
+        mask = 0
+        if old[start:start + row_bytes] != new[start:start + row_bytes]:
+            for tile in range(tiles):
+                offset = start + tile * DIFF_TILE_BYTES
+                if old[offset:offset + DIFF_TILE_BYTES] != new[offset:offset + DIFF_TILE_BYTES]:
+                    mask |= 1 << tile
+        masks.append(mask)
+
+    rects = []
+    for top, bottom in _runs(sum(1 << y for y, mask in enumerate(masks) if mask), EPD_HEIGHT, DIFF_MERGE_ROWS):
+        band_mask = 0
+        for mask in masks[top:bottom + 1]:
+            band_mask |= mask
+        # Split each band of rows into column runs, then trim the rows each run doesn't touch
+        for first, last in _runs(band_mask, tiles, DIFF_MERGE_TILES):
+            run_mask = ((1 << (last + 1)) - 1) ^ ((1 << first) - 1)
+            rows = [y for y in range(top, bottom + 1) if masks[y] & run_mask]
+            x = first * DIFF_TILE_BYTES * 2
+            rects.append((x, rows[0], (last - first + 1) * DIFF_TILE_BYTES * 2, rows[-1] - rows[0] + 1))
+    return rects
+
+
+def encode_frame_diff(old, new, base_crc):
+    """
+    Header plus zlib-compressed diff turning the frame with base_crc into
+    new, or None if the diff would not be smaller than a full frame.
+    """
+    rects = frame_diff_rects(old, new)
+    body = bytearray(DIFF_HEADER.pack(base_crc, len(rects)))
+    for x, y, width, height in rects:
+        body += DIFF_RECT.pack(x, y, width, height)
+        for row in range(y, y + height):
+            start = row * (EPD_WIDTH // 2) + x // 2
+            body += new[start:start + width // 2]
+
+    if len(body) > MAX_DIFF_BYTES:
+        return None
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_KIND_DIFF,
+                               EPD_WIDTH, EPD_HEIGHT, zlib.crc32(new))
+    return header + zlib.compress(bytes(body), 9)
+
+
+def decode_frame(payload, previous=None):
+    """
+    Reference decoder (what the board does): returns (framebuffer, crc32)
+    of a full frame, or of a diff applied to the previous framebuffer.
+    """
+    magic, version, kind, width, height, crc = FRAME_HEADER.unpack_from(payload, 0)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION or kind not in (FRAME_KIND_FULL, FRAME_KIND_DIFF):
+        raise ValueError(f"Unsupported frame (magic {magic!r}, version {version}, kind {kind})")
+    if (width, height) != (EPD_WIDTH, EPD_HEIGHT):
+        raise ValueError(f"Unexpected frame size {width}x{height}")
+
+    body = zlib.decompress(payload[FRAME_HEADER.size:])
+    if kind == FRAME_KIND_FULL:
+        framebuffer = body
+    else:
+        base_crc, count = DIFF_HEADER.unpack_from(body, 0)
+        if previous is None or zlib.crc32(previous) != base_crc:
+            raise ValueError("Diff does not apply to the previous frame")
+        framebuffer = bytearray(previous)
+        offset = DIFF_HEADER.size
+        for _ in range(count):
+            x, y, rect_width, rect_height = DIFF_RECT.unpack_from(body, offset)
+            offset += DIFF_RECT.size
+            if x % 2 or rect_width % 2 or x + rect_width > EPD_WIDTH or y + rect_height > EPD_HEIGHT:
+                raise ValueError(f"Invalid rectangle {rect_width}x{rect_height} at {x},{y}")
+            for row in range(y, y + rect_height):
+                start = row * (EPD_WIDTH // 2) + x // 2
+                framebuffer[start:start + rect_width // 2] = body[offset:offset + rect_width // 2]
+                offset += rect_width // 2
+        framebuffer = bytes(framebuffer)
+
+    if len(framebuffer) != FRAME_BYTES or zlib.crc32(framebuffer) != crc:
+        raise ValueError("Corrupt frame")
+    return framebuffer, crc
+
+
+# Current frame per device in this process, kept until the displayed values
+# change. The frames served before it are in the shared FrameHistory.
+frame_cache = {
+    'frames': {},
+    'lock': threading.Lock()
+}
+
+
+def _values_key(values):
+    return hashlib.blake2b(json.dumps(values, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _current_frame(device_id, values, tz, history):
+    key = _values_key(values)
+    with frame_cache['lock']:
+        cached = frame_cache['frames'].get(device_id)
+    if cached is not None and cached['key'] == key:
+        return cached
+
+    # Another worker may have rendered these values already; reuse its frame
+    # (and update line) so the display gets the same frame from every worker
+    full = history.find(device_id, key)
+    if full is not None:
+        framebuffer, crc = decode_frame(full)
+    else:
+        framebuffer = render_frame(values, datetime.now(tz))
+        full = encode_frame(framebuffer)
+        crc = zlib.crc32(framebuffer)
+        history.store(device_id, crc, key, full)
+
+    cached = {
+        'key': key,
+        'framebuffer': framebuffer,
+        'crc': crc,
+        'full': full,
+        'diffs': {}
+    }
+    with frame_cache['lock']:
+        frame_cache['frames'][device_id] = cached
+    return cached
+
+
+def parse_frame_crc(value):
+    """Frame CRC reported by a device (8 hex digits), None if missing or invalid"""
+    try:
+        return int(value, 16) if value else None
+    except ValueError:
+        return None
+
+
+def get_frame(device_id, aggregate, labels, tz, history, device_crc=None):
+    """
+    Encoded frame update for a device. Frames are re-rendered only when the
+    values on screen change; the update line shows when that happened.
+
+    history is the cache.FrameHistory of the frames served to each device.
+    device_crc is the CRC-32 of the frame the device shows. If it is one of
+    the last frames served to the device, only the changed rectangles are
+    sent (none if it is already current); otherwise the full frame.
+    """
+    current = _current_frame(device_id, display_values(aggregate, labels, tz), tz, history)
+    if device_crc is None:
+        return current['full']
+
+    with frame_cache['lock']:
+        diff = current['diffs'].get(device_crc)
+    if diff is not None:
+        return diff
+    if device_crc == current['crc']:
+        previous = current['framebuffer']
+    else:
+        served = history.get(device_id, device_crc)
+        if served is None:
+            return current['full']
+        previous = decode_frame(served)[0]
+
+    diff = encode_frame_diff(previous, current['framebuffer'], device_crc) or current['full']
+    with frame_cache['lock']:
+        current['diffs'][device_crc] = diff
+    return diff
+
+
+def write_png(path, framebuffer):
+    """Write a framebuffer as an 8-bit grayscale PNG (for previews)"""
+    rows = bytearray()
+    for y in range(EPD_HEIGHT):
+        rows.append(0)
+        for value in framebuffer[y * EPD_WIDTH // 2:(y + 1) * EPD_WIDTH // 2]:
+            rows += bytes(((value & 0x0F) * 17, (value >> 4) * 17))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', EPD_WIDTH, EPD_HEIGHT, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(bytes(rows), 9)))
+        f.write(chunk(b'IEND', b''))
+
+
+# Recorded sequence of /api/data changes between display wakes (applied
+# cumulatively to payload.SAMPLE_AGGREGATE) for the diff replay in main()
+REPLAY_SEQUENCE = [
+    ('crypto tick', {'crypto': {'price': 65230, 'change_24h': -0.91}}),
+    ('no change', {}),
+    ('next train', {'train': {'departure_time': '2026-01-02T03:22:00Z', 'via': 'Central',
+                              'departures': [{'departure_time': '2026-01-02T03:22:00Z', 'via': 'Central'},
+                                             {'departure_time': '2026-01-02T03:29:00Z', 'via': 'Central'},
+                                             {'departure_time': '2026-01-02T03:36:00Z', 'via': 'Central'}]}}),
+    ('crypto tick', {'crypto': {'price': 64980, 'change_24h': -1.29}}),
+    ('weather update', {'weather': {'temp': 22.4, 'feels_like': 22.0, 'precipitation_prob': 40,
+                                    'condition': 'Light rain', 'condition_type': 'LIGHT_RAIN'}}),
+    ('stock close', {'stock': {'price': 191.12, 'change': 1.28}}),
+    ('weather error', {'weather': {'error': 'HTTP 503'}})
+]
+
+
+def replay(aggregate, sequence, labels, tz):
+    """
+    Replay a data sequence through the diff path like a board would: returns
+    (name, full bytes, diff bytes, rectangles) per step and checks that
+    every decoded frame matches the rendered one exactly.
+    """
+    aggregate = {name: dict(value) if isinstance(value, dict) else value for name, value in aggregate.items()}
+    updated_at = datetime(2026, 1, 2, 14, 0, tzinfo=tz)
+    values = display_values(aggregate, labels, tz)
+    framebuffer = render_frame(values, updated_at)
+    shown = decode_frame(encode_frame(framebuffer))[0]
+
+    results = []
+    for step, (name, changes) in enumerate(sequence, 1):
+        for section, fields in changes.items():
+            aggregate[section] = {**aggregate[section], **fields} if 'error' not in fields else fields
+        # Like get_frame(): only re-render (with a new update line) when a displayed value changed
+        new_values = display_values(aggregate, labels, tz)
+        new = framebuffer if new_values == values else render_frame(new_values, updated_at.replace(minute=step))
+        values = new_values
+
+        full = encode_frame(new)
+        diff = encode_frame_diff(framebuffer, new, zlib.crc32(shown))
+        shown = decode_frame(diff or full, shown)[0]
+        if shown != new:
+            raise AssertionError(f"Step {step} ({name}): decoded frame differs from the rendered one")
+
+        results.append((name, len(full), len(diff) if diff else None, frame_diff_rects(framebuffer, new)))
+        framebuffer = new
+    return results
+
+
+def main():
+    import argparse
+    import time
+    from zoneinfo import ZoneInfo
+
+    from payload import SAMPLE_AGGREGATE
+
+    parser = argparse.ArgumentParser(description="Render a sample frame and report its cost")
+    parser.add_argument('--preview', default=None, help="PNG preview to write (default: none)")
+    args = parser.parse_args()
+
+    tz = ZoneInfo('Australia/Sydney')
+    labels = {'city': 'Sydney', 'crypto_symbol': 'btc', 'stock_symbol': 'AAPL'}
+    values = display_values(SAMPLE_AGGREGATE, labels, tz)
+
+    start = time.perf_counter()
+    render_frame(values, datetime.now(tz))
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    framebuffer = render_frame(values, datetime.now(tz))
+    render_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    frame = encode_frame(framebuffer)
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    assert decode_frame(frame)[0] == framebuffer
+    if args.preview:
+        write_png(args.preview, framebuffer)
+
+    print(f"render (cold, loading fonts): {cold_ms:.1f} ms")
+    print(f"render (warm):                {render_ms:.1f} ms")
+    print(f"compress:                     {encode_ms:.1f} ms")
+    print(f"frame: {FRAME_BYTES} bytes raw, {len(frame)} bytes served")
+    if args.preview:
+        print(f"preview written to {args.preview}")
+
+    print(f"\n{'step':<16} {'full':>6} {'diff':>6} {'rects':>6} {'pixels':>7}")
+    for name, full_bytes, diff_bytes, rects in replay(SAMPLE_AGGREGATE, REPLAY_SEQUENCE, labels, tz):
+        pixels = sum(width * height for _, _, width, height in rects)
+        print(f"{name:<16} {full_bytes:>6} {diff_bytes or '-':>6} {len(rects):>6} {pixels:>7}")
+        if diff_bytes is not None and diff_bytes >= full_bytes:
+            raise AssertionError(f"{name}: diff ({diff_bytes} bytes) is not smaller than the full frame")
+    print("replay: every diff reproduces its frame exactly")
+
+
+if __name__ == '__main__':
+    main()
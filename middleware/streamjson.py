@@ -0,0 +1,412 @@
+"""
+LILYGO T5 Weather Display - Middleware streaming JSON field extractor
+Reads selected fields from a JSON document as it arrives, without building
+the whole document.
+
+The Transport NSW trip response is large (every journey carries stop
+sequences, path coordinates, fares and notices) but the display needs the
+departure times and destinations from the first leg of each journey.
+FieldExtractor is fed the body chunk by chunk. Short containers (up to
+_LOOKAHEAD characters) are decoded by the C JSON scanner once complete: the
+wanted fields are looked up in them, skipped ones are dropped right away.
+Longer containers on the way to the wanted paths are walked. Longer skipped
+ones are followed as they arrive, looking only at the new text with the
+bracket depth and any string left open carried over, and decoded once when
+they close (found bracket by bracket instead if they outgrow
+MAX_SKIP_BUFFER). Parsing reports done as soon as every wanted field has
+been seen, so the rest of the body is never read. Memory stays at a few
+chunks plus the wanted values.
+
+Documents up to MAX_WHOLE_DOCUMENT bytes are not streamed: their chunks are
+held back and parsed by json.loads when the document ends, which needs more
+memory but much less CPU time than walking it in Python.
+
+A path is a tuple of object keys and array indexes, e.g.
+('journeys', 0, 'legs', 0, 'origin', 'departureTimeEstimated').
+
+Run this module directly to compare parse time and peak memory of
+json.loads, the extractor and the extractor forced to stream for the departure timetable of the recorded trip response
+(fixtures/train.json).
+"""
+
+import codecs
+import json
+import re
+
+# Size of the chunks read from a streamed upstream response
+CHUNK_SIZE = 8192
+
+# Largest unfinished skipped container kept in the buffer to be decoded when it closes
+MAX_SKIP_BUFFER = 8 * CHUNK_SIZE
+
+# Containers up to this many characters are decoded whole once complete
+_LOOKAHEAD = 2048
+
+# Documents up to this many bytes are held back and parsed whole by json.loads,
+# which takes about a third of the CPU time of the streamed parse; only larger
+# ones are streamed, which keeps memory bounded
+MAX_WHOLE_DOCUMENT = 256 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+_SCALAR = re.compile(r'-?[0-9][0-9.eE+-]*|true|false|null')
+# Containers that are complete in the buffer are parsed in C
+_DECODER = json.JSONDecoder()
+# Anything but brackets, with complete strings consumed whole
+_SKIP_RUN = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*', re.DOTALL)
+# Brackets (both kinds as '[' and ']'), quotes and backslashes of UTF-8 text;
+# none of them occurs inside a multi-byte character
+_NEST = bytes.maketrans(b'{}', b'[]')
+_NOT_STRUCTURE = bytes(set(range(256)) - set(b'[]{}"\\'))
+
+# What the parser expects next
+_VALUE = 0          # any value
+_KEY = 1            # an object key, or '}' right after '{'
+_COLON = 2
+_NEXT = 3           # ',' or the end of the enclosing container
+_SKIP = 4           # inside a skipped container
+_DONE = 5
+
+
+class FieldExtractor:
+    """Push parser returning the values at a set of paths of a JSON document"""
+
+    def __init__(self, paths, max_whole=MAX_WHOLE_DOCUMENT):
+        self.pending = set(paths)
+        self.prefixes = {path[:i] for path in self.pending for i in range(len(path))}
+        self.results = {}
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.stack = []             # [kind ('{' or '['), key or index] of the open containers
+        self.state = _VALUE
+        self.first = False          # right after '{' or '[' (the container may be empty)
+        self.skip_depth = 0         # brackets of a skipped container still open before pos
+        self.skip_start = None      # where that container starts, while it is kept in the buffer
+        self.capture = None         # path of a wanted container being skipped over
+        self.max_whole = max_whole
+        self.held = []              # chunks held back while the document may be parsed whole
+        self.held_size = 0
+
+    @property
+    def done(self):
+        return self.state == _DONE
+
+    def feed(self, data):
+        """Parse the next chunk (bytes or str); True once every wanted field was found"""
+        if self.state == _DONE:
+            return True
+        if self.held is not None:
+            self.held.append(data)
+            self.held_size += len(data)
+            if self.held_size <= self.max_whole:
+                return False
+            # Too large to parse whole: stream what was held back
+            held, self.held = self.held, None
+            return any(self._feed(chunk) for chunk in held)
+        return self._feed(data)
+
+    def _feed(self, data):
+        self.buffer += self.decoder.decode(data) if isinstance(data, bytes) else data
+        self._parse(final=False)
+        # Keep only what is not parsed yet, and a skipped container to be decoded
+        keep = self.skip_start if self.skip_start is not None else self.pos
+        if keep:
+            if self.skip_start is not None:
+                self.skip_start = 0
+            self.buffer = self.buffer[keep:]
+            self.pos -= keep
+        return self.state == _DONE
+
+    def close(self):
+        """Finish a document that ended before every field was found; returns the results"""
+        if self.held is not None:
+            held, self.held = self.held, None
+            joined = b''.join if held and isinstance(held[0], bytes) else ''.join
+            self._found_in((), json.loads(joined(held)))
+        elif self.state != _DONE:
+            self.buffer += self.decoder.decode(b'', final=True)
+            self._parse(final=True)
+        return self.results
+
+    def _path(self):
+        return tuple(frame[1] for frame in self.stack)
+
+    def _found(self, path, value):
+        self.results[path] = value
+        self.pending.discard(path)
+        if not self.pending:
+            self.state = _DONE
+
+    def _parse(self, final):
+        buffer = self.buffer
+        while self.state != _DONE:
+            if self.state == _SKIP:
+                if not self._skip(final):
+                    return
+                continue
+
+            pos = _WHITESPACE.match(buffer, self.pos).end()
+            if pos >= len(buffer):
+                self.pos = pos
+                if final and (self.stack or self.state != _NEXT):
+                    raise ValueError("JSON document ended early")
+                return
+            char = buffer[pos]
+
+            if self.state == _KEY:
+                if char == '}' and self.first:
+                    self.pos = pos
+                    self.state = _NEXT
+                    continue
+                if char != '"':
+                    raise ValueError(f"Expected an object key at offset {pos}")
+                match = _STRING.match(buffer, pos)
+                if match is None:
+                    if not final:
+                        self.pos = pos
+                        return
+                    raise ValueError(f"Expected an object key at offset {pos}")
+                key = match.group(1)
+                self.stack[-1][1] = json.loads(match.group(0)) if '\\' in key else key
+                self.pos = match.end()
+                self.state = _COLON
+            elif self.state == _COLON:
+                if char != ':':
+                    raise ValueError(f"Expected ':' at offset {pos}")
+                self.pos = pos + 1
+                self.state = _VALUE
+                self.first = False
+            elif self.state == _NEXT:
+                self.pos = pos + 1
+                if char == ',':
+                    frame = self.stack[-1]
+                    if frame[0] == '[':
+                        frame[1] += 1
+                        self.state = _VALUE
+                    else:
+                        self.state = _KEY
+                    self.first = False
+                elif char in '}]' and self.stack and self.stack[-1][0] == ('{' if char == '}' else '['):
+                    self._close_container()
+                else:
+                    raise ValueError(f"Unexpected {char!r} at offset {pos}")
+            else:
+                if char == ']' and self.first:
+                    # Empty array
+                    self.pos = pos
+                    self.state = _NEXT
+                    continue
+                if not self._value(pos, char, final):
+                    return
+
+    def _value(self, pos, char, final):
+        """Handle the value starting at pos; False if more data is needed"""
+        path = self._path()
+        if char in '{[':
+            if path in self.pending:
+                self.capture = path
+            if path in self.pending or path not in self.prefixes:
+                self.pos = pos
+                self.skip_depth = 0
+                self.state = _SKIP
+                return True
+            small = _decode_small(self.buffer, pos)
+            if small is not None:
+                # On the way to wanted fields: they are looked up in it
+                value, self.pos = small
+                self._found_in(path, value)
+                return True
+            self.stack.append([char, 0 if char == '[' else None])
+            self.pos = pos + 1
+            self.state = _KEY if char == '{' else _VALUE
+            self.first = True
+            return True
+
+        match = (_STRING if char == '"' else _SCALAR).match(self.buffer, pos)
+        if match is None or (match.end() == len(self.buffer) and char != '"' and not final):
+            if not final:
+                return False
+            raise ValueError(f"Invalid value at offset {pos}")
+        self.pos = match.end()
+        self.state = _NEXT
+        if path in self.pending:
+            self._found(path, json.loads(match.group(0)))
+        return True
+
+    def _skip(self, final):
+        """Move past the rest of a skipped container; False if more data is needed"""
+        buffer = self.buffer
+        if self.skip_depth == 0:
+            small = _decode_small(buffer, self.pos)
+            if small is not None:
+                return self._skipped(*small)
+            # A longer one is followed as it arrives
+            self.skip_start = self.pos
+            self.pos += 1
+            self.skip_depth = 1
+
+        end, closed, opened = _count_brackets(buffer, self.pos)
+        if closed < self.skip_depth:
+            if final:
+                raise ValueError("JSON document ended early")
+            self.pos = end
+            self.skip_depth += opened - closed
+            if self.skip_start is not None and self.capture is None and end - self.skip_start > MAX_SKIP_BUFFER:
+                self.skip_start = None
+            return False
+
+        if self.skip_start is not None:
+            # It closes in what has arrived: decode it, once
+            return self._skipped(*_DECODER.raw_decode(buffer, self.skip_start))
+
+        # Too large to keep: find its closing bracket in this chunk
+        while True:
+            self.pos = _SKIP_RUN.match(buffer, self.pos).end()
+            if buffer[self.pos] in '{[':
+                try:
+                    # Containers opened here are complete
+                    self.pos = _DECODER.raw_decode(buffer, self.pos)[1]
+                except ValueError:
+                    self.pos += 1
+                    self.skip_depth += 1
+                    continue
+            else:
+                self.pos += 1
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    return self._skipped(None, self.pos)
+
+    def _skipped(self, value, end):
+        """Finish a skipped container (value is its content) that ends at end"""
+        self.pos = end
+        self.skip_depth = 0
+        self.skip_start = None
+        self.state = _NEXT
+        if self.capture is not None:
+            self._found_in(self.capture, value)
+            self.capture = None
+        return True
+
+    def _found_in(self, path, value):
+        """Take the wanted fields inside value, the container decoded at path"""
+        for wanted in [wanted for wanted in self.pending if wanted[:len(path)] == path]:
+            try:
+                self._found(wanted, _lookup(value, wanted[len(path):]))
+            except LookupError:
+                # Not in the document
+                self.pending.discard(wanted)
+        self.state = _NEXT if self.pending else _DONE
+
+    def _close_container(self):
+        self.stack.pop()
+        # Wanted paths inside the closed container can no longer appear
+        closed = self._path()
+        self.pending = {path for path in self.pending if path[:len(closed)] != closed}
+        self.state = _NEXT if self.pending else _DONE
+
+
+def _decode_small(buffer, pos):
+    """(value, end) of the container at pos if it ends within _LOOKAHEAD, else None"""
+    try:
+        value, end = _DECODER.raw_decode(buffer[pos:pos + _LOOKAHEAD])
+    except ValueError:
+        return None
+    return value, pos + end
+
+
+def _count_brackets(buffer, pos):
+    """(end, closed, opened) for the brackets outside strings from pos: end is
+    where a string still open at the end of the buffer starts (else the end of
+    the buffer), closed counts the brackets closing ones opened before pos and
+    opened the ones left open before end"""
+    text = buffer[pos:]
+    structure = text.encode('utf-8', 'surrogatepass').translate(_NEST, _NOT_STRUCTURE)
+    if b'\\' in structure:
+        # Escapes: strip the strings with the regular expression
+        stripped = _STRING.sub('', text)
+        open_string = stripped.find('"')
+        if open_string >= 0:
+            text = text[:len(text) - len(stripped) + open_string]
+            stripped = stripped[:open_string]
+        structure = stripped.encode('utf-8', 'surrogatepass').translate(_NEST, _NOT_STRUCTURE)
+    elif structure.count(b'"') % 2:
+        text = text[:text.rfind('"')]
+        structure = structure[:structure.rfind(b'"')]
+    # Strings without brackets in them (dropping a pair of quotes does not
+    # change which brackets are inside strings), then the rest of the strings
+    structure = structure.replace(b'""', b'')
+    if b'"' in structure:
+        structure = b''.join(structure.split(b'"')[::2])
+    # Drop matching pairs; what is left is ']' * closed + '[' * opened
+    while b'[]' in structure:
+        structure = structure.replace(b'[]', b'')
+    closed = structure.count(b']')
+    return pos + len(text), closed, len(structure) - closed
+
+
+def extract_fields(chunks, paths, max_whole=MAX_WHOLE_DOCUMENT):
+    """{path: value} for the paths found in a document read from an iterable of chunks, stopping early"""
+    extractor = FieldExtractor(paths, max_whole)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            return extractor.results
+    return extractor.close()
+
+
+def _lookup(data, path):
+    for part in path:
+        if not isinstance(data, dict if isinstance(part, str) else list):
+            raise LookupError(path)
+        data = data[part]
+    return data
+
+
+def main():
+    import os
+    import timeit
+    import tracemalloc
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'train.json')
+    with open(path, 'rb') as f:
+        body = f.read()
+    # The same document as it comes off the wire (compact)
+    compact = json.dumps(json.loads(body), separators=(',', ':')).encode('utf-8')
+    # The departure timetable app.py reads: the first leg of every journey
+    journeys = len(json.loads(body)['journeys'])
+    paths = [('journeys', j, 'legs', 0) + field for j in range(journeys)
+             for field in (('origin', 'departureTimeEstimated'), ('origin', 'departureTimePlanned'),
+                           ('transportation', 'destination', 'name'))]
+
+    for name, document in (('recorded', body), ('compact', compact)):
+        chunks = [document[i:i + CHUNK_SIZE] for i in range(0, len(document), CHUNK_SIZE)]
+
+        def full():
+            data = json.loads(b''.join(chunks))
+            return {path: _lookup(data, path) for path in paths}
+
+        def extracted():
+            return extract_fields(iter(chunks), paths)
+
+        def streamed():
+            return extract_fields(iter(chunks), paths, max_whole=0)
+
+        assert full() == extracted() == streamed(), f"{streamed()} != {full()}"
+        print(f"{name}: {len(document)} bytes in {len(chunks)} chunks of {CHUNK_SIZE}")
+        print(f"  {'parser':<10} {'time us':>9} {'peak KB':>9} {'chunks read':>12}")
+        for parser, run in (('json', full), ('extractor', extracted), ('streamed', streamed)):
+            runs = 20
+            us = min(timeit.repeat(run, number=runs, repeat=10)) / runs * 1e6
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            read = len(chunks)
+            if parser == 'streamed':
+                extractor = FieldExtractor(paths, max_whole=0)
+                read = next(i + 1 for i, chunk in enumerate(chunks) if extractor.feed(chunk))
+            print(f"  {parser:<10} {us:>9.0f} {peak / 1024:>9.1f} {read:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+LILYGO T5 Weather Display - Middleware next-wake hint
+Works out when the data a display shows can next change, so the board can
+sleep until then instead of waking on a fixed interval to find the same
+values.
+
+Each source changes when the middleware next fetches it (its cache TTL or
+refresh interval after the last fetch), and some change on a schedule of
+their own:
+
+- weather: values interpolated over the hourly forecast move on every
+  serve step (10 minutes, see forecast.py) between fetches.
+- stock: MarketStack end-of-day prices only change once the next US market
+  close (16:00 New York, weekdays) is published, so a refetch before then
+  brings the same prices.
+- train: the next departure moves on when that train leaves.
+
+/api/data carries the result as 'next_refresh_seconds'. The firmware never
+wakes sooner than its own update interval, so the hint only ever saves
+wakes.
+
+Run this module directly to replay a week of display wakes with and
+without the hint.
+"""
+
+import math
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from forecast import next_serve_time
+
+# Bounds of the hint (the firmware applies its update interval on top)
+MIN_WAKE_SECONDS = 60
+MAX_WAKE_SECONDS = 3600
+
+# Time for a due refresh to complete before the display asks for it
+REFRESH_SLACK_SECONDS = 10
+
+MARKET_TIMEZONE = ZoneInfo('America/New_York')
+MARKET_CLOSE = time(16, 0)
+EOD_PUBLISH_DELAY = timedelta(minutes=30)
+
+
+def _parse_utc(value):
+    """ISO 8601 timestamp to naive UTC, None if missing or invalid"""
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def next_eod_publish(after):
+    """First time (naive UTC) after a moment that a new end-of-day price is published"""
+    local = after.replace(tzinfo=timezone.utc).astimezone(MARKET_TIMEZONE)
+    for days in range(8):
+        day = local.date() + timedelta(days=days)
+        if day.weekday() >= 5:
+            continue
+        published = datetime.combine(day, MARKET_CLOSE, MARKET_TIMEZONE) + EOD_PUBLISH_DELAY
+        published = published.astimezone(timezone.utc).replace(tzinfo=None)
+        if published > after:
+            return published
+    raise AssertionError("no weekday within a week")
+
+
+def weather_change(section, fetched_at, change_at, now):
+    # Interpolated values move on at the next serve step
+    if 'hourly' not in section:
+        return change_at
+    return min(change_at, next_serve_time(now))
+
+
+def stock_change(section, fetched_at, change_at, now):
+    # A refetch before the next close is published returns the same prices
+    return max(change_at, next_eod_publish(fetched_at))
+
+
+def train_change(section, fetched_at, change_at, now):
+    # The display moves on to the following train once this one has left
+    departure = _parse_utc(section.get('departure_time'))
+    return min(change_at, departure + timedelta(seconds=1)) if departure else change_at
+
+
+# Changes of a source's data other than refetches
+CHANGE_SCHEDULES = {
+    'weather': weather_change,
+    'stock': stock_change,
+    'train': train_change
+}
+
+
+def next_change(name, section, fetched_at, refresh_at, now):
+    """
+    Earliest time (naive UTC) a served source section can change: fetched_at
+    is when its data was fetched, refresh_at when the middleware fetches it
+    again.
+    """
+    if section.get('stale') or refresh_at <= now:
+        # A refresh is due or already running; its result is in shortly
+        return now + timedelta(seconds=REFRESH_SLACK_SECONDS)
+    change_at = refresh_at + timedelta(seconds=REFRESH_SLACK_SECONDS)
+    schedule = CHANGE_SCHEDULES.get(name)
+    if schedule is not None and 'error' not in section:
+        change_at = schedule(section, fetched_at, change_at, now)
+    return max(change_at, now)
+
+
+def next_wake_seconds(changes, now):
+    """Seconds from now until the first of the changes, within MIN_WAKE_SECONDS and MAX_WAKE_SECONDS"""
+    if not changes:
+        return MAX_WAKE_SECONDS
+    seconds = math.ceil((min(changes) - now).total_seconds())
+    return min(max(seconds, MIN_WAKE_SECONDS), MAX_WAKE_SECONDS)
+
+
+def simulate(update_minutes, hinted, start, days=1, intervals=None, headway_minutes=7.5,
+             service=(time(5, 0), time(0, 30)), tz=ZoneInfo('Australia/Sydney')):
+    """
+    Replay display wakes against the middleware's refresh schedule (the
+    scheduler defaults: weather every 10 minutes, crypto every 5, stock once
+    a day, the train timetable every 10) and trains every headway_minutes
+    during service hours. Without the hint the display wakes every
+    update_minutes; with it, it wakes after the larger of update_minutes and
+    next_refresh_seconds, like the firmware.
+
+    Returns (wakes, wakes that showed nothing new, mean minutes a change
+    waited before it was shown).
+    """
+    intervals = intervals or {'weather': 600, 'crypto': 300, 'stock': 86400, 'train': 600}
+    end = start + timedelta(days=days)
+
+    departures = []
+    day = (start.replace(tzinfo=timezone.utc).astimezone(tz) - timedelta(days=1)).date()
+    while True:
+        first = datetime.combine(day, service[0], tz)
+        last = datetime.combine(day + timedelta(days=service[1] < service[0]), service[1], tz)
+        if first.astimezone(timezone.utc).replace(tzinfo=None) > end + timedelta(days=1):
+            break
+        moment = first
+        while moment <= last:
+            departures.append(moment.astimezone(timezone.utc).replace(tzinfo=None))
+            moment += timedelta(minutes=headway_minutes)
+        day += timedelta(days=1)
+
+    def fetched_at(name, moment):
+        # Fetches run every interval, the first one at the start of the replay
+        return start + timedelta(seconds=(moment - start).total_seconds() // intervals[name] * intervals[name])
+
+    def shown(moment):
+        """What the display shows at a moment: fetch time of each source and the next departure"""
+        upcoming = next((departure for departure in departures if departure > moment), None)
+        return tuple(fetched_at(name, moment) for name in intervals) + (upcoming,)
+
+    # Every moment the shown data changes, to measure how long each waited to be displayed
+    changes = []
+    for name, interval in intervals.items():
+        moment = start + timedelta(seconds=interval)
+        while moment < end:
+            changes.append(moment)
+            moment += timedelta(seconds=interval)
+    changes += [departure + timedelta(seconds=1) for departure in departures if start <= departure < end]
+    changes.sort()
+
+    wakes = []
+    moment = start
+    while moment < end:
+        wakes.append(moment)
+        sleep = update_minutes * 60
+        if hinted:
+            sections = {name: {} for name in intervals}
+            upcoming = shown(moment)[-1]
+            if upcoming is not None:
+                sections['train'] = {'departure_time': upcoming.isoformat()}
+            hint = next_wake_seconds(
+                [next_change(name, section, fetched_at(name, moment),
+                             fetched_at(name, moment) + timedelta(seconds=intervals[name]), moment)
+                 for name, section in sections.items()],
+                moment)
+            sleep = max(sleep, hint)
+        moment += timedelta(seconds=sleep)
+
+    idle = sum(1 for previous, wake in zip(wakes, wakes[1:]) if shown(previous) == shown(wake))
+    delays = []
+    index = 0
+    for change in changes:
+        while index < len(wakes) and wakes[index] < change:
+            index += 1
+        if index < len(wakes):
+            delays.append((wakes[index] - change).total_seconds() / 60)
+    return len(wakes), idle, sum(delays) / len(delays) if delays else 0.0
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay display wakes with and without the next-wake hint")
+    parser.add_argument('--days', type=int, default=7, help="Days to replay, from a Monday (default: 7)")
+    args = parser.parse_args()
+
+    start = datetime(2026, 3, 1, 13, 0)     # Monday 00:00 in Sydney
+    print(f"{args.days} days from {start:%Y-%m-%d %H:%M} UTC, per day:\n")
+    print(f"{'interval':>8} | {'fixed':>6} {'idle':>5} {'delay':>6} | {'hinted':>6} {'idle':>5} {'delay':>6} | {'saved':>6}")
+    for minutes in (1, 2, 5, 10, 15):
+        fixed = simulate(minutes, False, start, args.days)
+        hinted = simulate(minutes, True, start, args.days)
+        saved = (fixed[0] - hinted[0]) / args.days
+        print(f"{minutes:>6}m | {fixed[0] / args.days:>6.0f} {fixed[1] / args.days:>5.0f} {fixed[2]:>5.1f}m | "
+              f"{hinted[0] / args.days:>6.0f} {hinted[1] / args.days:>5.0f} {hinted[2]:>5.1f}m | {saved:>6.0f}")
+        assert hinted[0] <= fixed[0], "the hint must never add wakes"
+    print("\nidle: wakes that showed nothing new; delay: mean time a change waited to be shown")
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,13 @@
 #include <LittleFS.h>
 #include <Timezone.h>
 #include <StreamUtils.h>
+#if CONFIG_IDF_TARGET_ESP32S3
+#include <esp32s3/rom/miniz.h>
+#include <esp32s3/rom/crc.h>
+#else
+#include <rom/miniz.h>
+#include <rom/crc.h>
+#endif
 
 // Weather icons
 #include <clear_day.h>
@@ -42,6 +49,8 @@ String password = "";
 // Middleware configuration (loaded from config.json)
 bool middleware_enabled = false;
 String middleware_url = "";
+bool middleware_binary = false;  // Request the compact binary payload instead of JSON
+String middleware_frame_url = "";  // Blit the frame rendered by the middleware (/api/frame) when set
 
 // Google Weather API (loaded from config.json)
 String google_api_key = "";
@@ -75,6 +84,9 @@ Timezone ausET(aEDT, aEST);
 // Update interval (in milliseconds) - default 5 minutes
 unsigned long UPDATE_INTERVAL = 300000;
 
+// Longest wait between updates the middleware's next-refresh hint can ask for (1 hour)
+#define MAX_HINTED_INTERVAL 3600000UL
+
 // Sleep schedule configuration (loaded from config.json)
 String sleep_time = "";
 String wakeup_time = "";
@@ -95,6 +107,8 @@ uint8_t *framebuffer = NULL;
 
 // ===== GLOBALS =====
 unsigned long last_update = 0;
+uint32_t next_refresh_hint = 0;  // Seconds until the middleware's data can next change (0: no hint)
+String middleware_etag = "";  // ETag of the middleware data on screen, sent as If-None-Match
 int loop_count = 0;  // Counter for loop iterations
 String current_temp = "--";
 String current_condition = "Loading...";
@@ -120,12 +134,100 @@ String stock_change = "--";
 // Train data
 String train_departure_time = "--:--";
 String train_via = "--";
+String train_later_departures = "";  // "Then 08:12PM, 08:19PM" from the middleware timetable
+
+// Binary middleware payload (see middleware/payload.py for the schema)
+// Fixed layout, little-endian like the ESP32, read straight into a static
+// struct so no JSON document or String is allocated.
+#define PAYLOAD_VERSION 3
+#define PAYLOAD_FLAG_WEATHER 0x01
+#define PAYLOAD_FLAG_CRYPTO  0x02
+#define PAYLOAD_FLAG_STOCK   0x04
+#define PAYLOAD_FLAG_TRAIN   0x08
+
+// One /api/data.bin response: header, then a fixed-size record per section
+struct __attribute__((packed)) MiddlewarePayload {
+    char magic[2];              // "LW"
+    uint8_t version;
+    uint8_t flags;              // PAYLOAD_FLAG_* of the sections holding valid data
+    uint32_t timestamp;         // Unix seconds
+    uint16_t next_refresh_seconds;  // Seconds until any section can change, 0 if unknown
+    struct __attribute__((packed)) {
+        int16_t temp_x10;
+        int16_t feels_like_x10;
+        int16_t temp_max_x10;
+        int16_t temp_min_x10;
+        uint8_t precipitation_prob;
+        uint8_t is_daytime;
+        uint8_t units;          // 0 metric, 1 imperial
+        uint16_t wind_speed_x10;
+        uint32_t age_seconds;
+        char condition_type[20];
+        char condition[32];
+        char city[24];
+    } weather;
+    struct __attribute__((packed)) {
+        int32_t price;
+        int32_t change_24h_x100;
+        char symbol[8];
+        uint32_t age_seconds;
+    } crypto;
+    struct __attribute__((packed)) {
+        int32_t price_x100;
+        int32_t change_x100;
+        char currency[4];
+        char symbol[8];
+        uint32_t age_seconds;
+    } stock;
+    struct __attribute__((packed)) {
+        uint32_t departure_time;  // Unix seconds, 0 if unknown
+        char via[32];
+        uint32_t age_seconds;
+        uint32_t later_departures[2];  // Unix seconds of the next departures, 0 if none
+    } train;
+};
+
+static_assert(sizeof(MiddlewarePayload) == 195, "MiddlewarePayload must match middleware/payload.py");
+
+MiddlewarePayload middleware_payload;
+
+// Frame rendered by the middleware (see middleware/render.py for the format)
+#define FRAME_VERSION 1
+#define FRAME_KIND_FULL 0
+#define FRAME_KIND_DIFF 1
+#define FRAME_BYTES (EPD_DISPLAY_WIDTH * EPD_DISPLAY_HEIGHT / 2)
+
+struct __attribute__((packed)) FrameHeader {
+    char magic[2];              // "LF"
+    uint8_t version;
+    uint8_t kind;               // FRAME_KIND_FULL or FRAME_KIND_DIFF, followed by the zlib stream
+    uint16_t width;
+    uint16_t height;
+    uint32_t crc32;             // CRC-32 of the resulting framebuffer
+};
+
+// Inflated diff body: header, then per rectangle a FrameRect and its packed pixel rows
+struct __attribute__((packed)) FrameDiffHeader {
+    uint32_t base_crc32;        // CRC-32 of the frame the diff applies to
+    uint16_t rect_count;
+};
+
+struct __attribute__((packed)) FrameRect {
+    uint16_t x;                 // Even, like width
+    uint16_t y;
+    uint16_t width;
+    uint16_t height;
+};
+
+// CRC-32 of the frame currently in the framebuffer and on screen (0 = none)
+uint32_t frame_crc = 0;
 
 // Structure to hold icon data and dimensions
 struct IconData {
     const uint8_t *data;
     uint16_t width;
     uint16_t height;
+    size_t size;  // Less than width * height / 2: a zlib stream (headers compiled by middleware/assets.py)
 };
 
 // Get icon data based on Google Weather API condition type and day/night status
@@ -136,35 +238,35 @@ IconData getIconData(const String &condition_type, bool is_daytime) {
     
     // Check for thunderstorm conditions (but not snowstorm)
     if (condition_lower.indexOf("thunder") >= 0) {
-        return {thunderstorms_data, thunderstorms_width, thunderstorms_height};
+        return {thunderstorms_data, thunderstorms_width, thunderstorms_height, sizeof(thunderstorms_data)};
     }
     
     // Check for hail (check before rain since HAIL_SHOWERS contains "showers")
     if (condition_lower.indexOf("hail") >= 0) {
-        return {hail_data, hail_width, hail_height};
+        return {hail_data, hail_width, hail_height, sizeof(hail_data)};
     }
     
     // Check for snow conditions (check before "storm" to handle SNOWSTORM)
     if (condition_lower.indexOf("snow") >= 0 || condition_lower.indexOf("blowing_snow") >= 0) {
-        return {snow_data, snow_width, snow_height};
+        return {snow_data, snow_width, snow_height, sizeof(snow_data)};
     }
     
     // Check for thunderstorm by "storm" (after snow check to avoid catching SNOWSTORM)
     if (condition_lower.indexOf("storm") >= 0) {
-        return {thunderstorms_data, thunderstorms_width, thunderstorms_height};
+        return {thunderstorms_data, thunderstorms_width, thunderstorms_height, sizeof(thunderstorms_data)};
     }
     
     // Check for rain conditions (covers all rain and shower types)
     if (condition_lower.indexOf("rain") >= 0 || condition_lower.indexOf("shower") >= 0 || condition_lower.indexOf("drizzle") >= 0) {
-        return {rain_data, rain_width, rain_height};
+        return {rain_data, rain_width, rain_height, sizeof(rain_data)};
     }
     
     // Check for mostly clear (before generic "clear" check)
     if (condition_lower.indexOf("mostly_clear") >= 0) {
         if (is_daytime) {
-            return {clear_day_data, clear_day_width, clear_day_height};
+            return {clear_day_data, clear_day_width, clear_day_height, sizeof(clear_day_data)};
         } else {
-            return {clear_night_data, clear_night_width, clear_night_height};
+            return {clear_night_data, clear_night_width, clear_night_height, sizeof(clear_night_data)};
         }
     }
     
@@ -172,38 +274,38 @@ IconData getIconData(const String &condition_type, bool is_daytime) {
     if (condition_lower.indexOf("partly") >= 0) {
         // Use clear icon with sun for partly cloudy
         if (is_daytime) {
-            return {clear_day_data, clear_day_width, clear_day_height};
+            return {clear_day_data, clear_day_width, clear_day_height, sizeof(clear_day_data)};
         } else {
-            return {clear_night_data, clear_night_width, clear_night_height};
+            return {clear_night_data, clear_night_width, clear_night_height, sizeof(clear_night_data)};
         }
     }
     
     // Check for mostly cloudy (before generic "cloudy" check)
     if (condition_lower.indexOf("mostly_cloudy") >= 0) {
-        return {cloudy_data, cloudy_width, cloudy_height};
+        return {cloudy_data, cloudy_width, cloudy_height, sizeof(cloudy_data)};
     }
     
     // Check for cloudy conditions (after specific cloudy variants)
     if (condition_lower.indexOf("cloud") >= 0 || condition_lower.indexOf("overcast") >= 0) {
-        return {cloudy_data, cloudy_width, cloudy_height};
+        return {cloudy_data, cloudy_width, cloudy_height, sizeof(cloudy_data)};
     }
     
     // Check for clear conditions (after mostly_clear)
     if (condition_lower.indexOf("clear") >= 0 || condition_lower.indexOf("sunny") >= 0) {
         if (is_daytime) {
-            return {clear_day_data, clear_day_width, clear_day_height};
+            return {clear_day_data, clear_day_width, clear_day_height, sizeof(clear_day_data)};
         } else {
-            return {clear_night_data, clear_night_width, clear_night_height};
+            return {clear_night_data, clear_night_width, clear_night_height, sizeof(clear_night_data)};
         }
     }
     
     // Check for windy conditions (last weather check)
     if (condition_lower.indexOf("wind") >= 0 || condition_lower.indexOf("breezy") >= 0 || condition_lower.indexOf("gust") >= 0) {
-        return {windy_data, windy_width, windy_height};
+        return {windy_data, windy_width, windy_height, sizeof(windy_data)};
     }
     
     // Default fallback to unknown icon
-    return {unknown_data, unknown_width, unknown_height};
+    return {unknown_data, unknown_width, unknown_height, sizeof(unknown_data)};
 }
 
 void setup() {
@@ -283,28 +385,33 @@ void setup() {
     // Clear the screen
     epd_clear();
 
-    // Fetch data from middleware or individual APIs
-    if (middleware_enabled) {
-        Serial.println("Using middleware mode");
-        fetchMiddlewareData();
+    // Show the frame rendered by the middleware, or fetch data and draw it here
+    if (middleware_enabled && middleware_frame_url.length() > 0 && displayMiddlewareFrame()) {
+        Serial.println("Using middleware frame mode");
     } else {
-        Serial.println("Using direct API mode");
-        // Fetch weather data
-        fetchWeatherData();
-        
-        // Fetch crypto data
-        fetchCryptoData();
-        
-        // Fetch stock data
-        fetchStockData();
+        // Fetch data from middleware or individual APIs
+        if (middleware_enabled) {
+            Serial.println("Using middleware mode");
+            fetchMiddlewareData();
+        } else {
+            Serial.println("Using direct API mode");
+            // Fetch weather data
+            fetchWeatherData();
+            
+            // Fetch crypto data
+            fetchCryptoData();
+            
+            // Fetch stock data
+            fetchStockData();
+            
+            // Fetch train data
+            fetchTrainData();
+        }
         
-        // Fetch train data
-        fetchTrainData();
+        // Display weather
+        displayWeather();
     }
     
-    // Display weather
-    displayWeather();
-    
     // Power down display to save power
     epd_poweroff_all();
     
@@ -323,35 +430,46 @@ void loop() {
     }
     
     // Check if it's time to update
-    if (millis() - last_update > UPDATE_INTERVAL) {
+    if (millis() - last_update > nextUpdateInterval()) {
         Serial.println("\nTime to refresh data...");
+        next_refresh_hint = 0;
         
         // Power up display
         epd_poweron();
-        epd_clear();
         
-        // Fetch data from middleware or individual APIs
-        if (middleware_enabled) {
-            Serial.println("Using middleware mode");
-            fetchMiddlewareData();
+        // Show the frame rendered by the middleware (clearing only what changed), or fetch data and draw it here
+        if (middleware_enabled && middleware_frame_url.length() > 0 && displayMiddlewareFrame()) {
+            Serial.println("Using middleware frame mode");
         } else {
-            Serial.println("Using direct API mode");
-            // Fetch and display
-            fetchWeatherData();
-            
-            // Fetch train data
-            fetchTrainData();
+            // Fetch data from middleware or individual APIs
+            bool changed = true;
+            if (middleware_enabled) {
+                Serial.println("Using middleware mode");
+                changed = fetchMiddlewareData();
+            } else {
+                Serial.println("Using direct API mode");
+                // Fetch and display
+                fetchWeatherData();
+                
+                // Fetch train data
+                fetchTrainData();
+                
+                // Only update crypto/stock data every 12 loops
+                loop_count++;
+                if (loop_count % 12 == 0) {
+                    fetchCryptoData();
+                    fetchStockData();
+                }
+            }
             
-            // Only update crypto/stock data every 12 loops
-            loop_count++;
-            if (loop_count % 12 == 0) {
-                fetchCryptoData();
-                fetchStockData();
+            if (changed) {
+                epd_clear();
+                displayWeather();
+            } else {
+                Serial.println("Middleware data unchanged, keeping the display");
             }
         }
         
-        displayWeather();
-        
         // Power down
         epd_poweroff_all();
         
@@ -362,6 +480,16 @@ void loop() {
     delay(10000);  // Check every 10 seconds if update needed
 }
 
+// Time between updates: until the middleware's data can next change (its
+// next_refresh_seconds hint), but never sooner than the configured interval
+unsigned long nextUpdateInterval() {
+    if (next_refresh_hint == 0) {
+        return UPDATE_INTERVAL;
+    }
+    unsigned long hinted = next_refresh_hint * 1000UL;
+    return constrain(hinted, UPDATE_INTERVAL, max(UPDATE_INTERVAL, MAX_HINTED_INTERVAL));
+}
+
 void connectToWiFi() {
     Serial.print("Connecting to WiFi: ");
     Serial.println(ssid);
@@ -413,6 +541,11 @@ String parseUTCToLocal(const String& utc_timestamp) {
     tzset();
     time_t utc_time = mktime(&timeinfo);
     
+    return formatLocalTime(utc_time);
+}
+
+// Helper function to format a UTC time as a local HH:MMAM/PM string
+String formatLocalTime(time_t utc_time) {
     // Convert to local timezone using Timezone library
     TimeChangeRule *tcr;
     time_t local_time = ausET.toLocal(utc_time, &tcr);
@@ -428,22 +561,326 @@ String parseUTCToLocal(const String& utc_timestamp) {
     return String(time_buffer);
 }
 
-void fetchMiddlewareData() {
+// Store weather values for display (shared by the JSON and binary middleware paths)
+void setWeatherValues(float temp, float feels, float t_max, float t_min, int precipitation_prob, float wind,
+                      const char* condition, const char* condition_type, bool daytime, bool imperial) {
+    String unit_symbol = imperial ? "°F" : "°C";
+    current_temp = String(temp, 0) + unit_symbol;
+    feels_like = String(feels, 0) + unit_symbol;
+    temp_max = String(t_max, 0);
+    temp_min = String(t_min, 0);
+    current_precipitation = String(precipitation_prob) + "%";
+    wind_speed = String(wind, 0) + " m/s";
+    current_condition = condition;
+    current_condition_type = condition_type;
+    is_daytime = daytime;
+}
+
+void setCryptoValues(int price, float change) {
+    crypto_price = String(price);
+    
+    char change_buffer[20];
+    if (change >= 0) {
+        snprintf(change_buffer, sizeof(change_buffer), "+%.2f", change);
+    } else {
+        snprintf(change_buffer, sizeof(change_buffer), "%.2f", change);
+    }
+    crypto_change = change_buffer;
+}
+
+void setStockValues(float price, const char* currency, float change) {
+    stock_currency = currency;
+    
+    char price_buffer[20];
+    snprintf(price_buffer, sizeof(price_buffer), "%.2f", price);
+    stock_price = price_buffer;
+    
+    char change_buffer[20];
+    if (change >= 0) {
+        snprintf(change_buffer, sizeof(change_buffer), "+%.2f", change);
+    } else {
+        snprintf(change_buffer, sizeof(change_buffer), "%.2f", change);
+    }
+    stock_change = change_buffer;
+}
+
+// Fetch the compact binary payload from the middleware (middleware.binary = true)
+// Returns false if the middleware answered that the data on screen is current (304)
+bool fetchMiddlewareBinaryData() {
+    HTTPClient http;
+    http.begin(middleware_url);
+    // Content negotiation: the same /api/data URL returns the binary payload
+    http.addHeader("Accept", "application/octet-stream");
+    requestIfModified(http);
+    
+    int httpCode = http.GET();
+    middleware_etag = "";
+    
+    if (httpCode == 304) {
+        return keepMiddlewareData(http);
+    }
+    
+    if (httpCode == 200 && http.getSize() == sizeof(MiddlewarePayload)) {
+        WiFiClient* stream = http.getStreamPtr();
+        size_t received = stream->readBytes((uint8_t*)&middleware_payload, sizeof(MiddlewarePayload));
+        MiddlewarePayload& p = middleware_payload;
+        
+        if (received != sizeof(MiddlewarePayload) || p.magic[0] != 'L' || p.magic[1] != 'W' ||
+            p.version != PAYLOAD_VERSION) {
+            Serial.println("Invalid binary payload from middleware");
+            current_condition = "Parse Error";
+            http.end();
+            return true;
+        }
+        
+        next_refresh_hint = p.next_refresh_seconds;
+        
+        // Strings are NUL-terminated by the middleware; enforce it anyway
+        p.weather.condition_type[sizeof(p.weather.condition_type) - 1] = '\0';
+        p.weather.condition[sizeof(p.weather.condition) - 1] = '\0';
+        p.stock.currency[sizeof(p.stock.currency) - 1] = '\0';
+        p.train.via[sizeof(p.train.via) - 1] = '\0';
+        
+        if (p.flags & PAYLOAD_FLAG_WEATHER) {
+            setWeatherValues(p.weather.temp_x10 / 10.0, p.weather.feels_like_x10 / 10.0,
+                             p.weather.temp_max_x10 / 10.0, p.weather.temp_min_x10 / 10.0,
+                             p.weather.precipitation_prob, p.weather.wind_speed_x10 / 10.0,
+                             p.weather.condition, p.weather.condition_type,
+                             p.weather.is_daytime, p.weather.units == 1);
+            Serial.println("Weather data parsed from middleware");
+        } else {
+            Serial.println("Weather data not available from middleware");
+        }
+        
+        if (p.flags & PAYLOAD_FLAG_CRYPTO) {
+            setCryptoValues(p.crypto.price, p.crypto.change_24h_x100 / 100.0);
+            Serial.println("Crypto data parsed from middleware");
+        } else {
+            Serial.println("Crypto data not available from middleware");
+        }
+        
+        if (p.flags & PAYLOAD_FLAG_STOCK) {
+            setStockValues(p.stock.price_x100 / 100.0, p.stock.currency, p.stock.change_x100 / 100.0);
+            Serial.println("Stock data parsed from middleware");
+        } else {
+            Serial.println("Stock data not available from middleware");
+        }
+        
+        if (p.flags & PAYLOAD_FLAG_TRAIN) {
+            train_via = p.train.via;
+            train_departure_time = p.train.departure_time ? formatLocalTime(p.train.departure_time) : "--:--";
+            train_later_departures = "";
+            for (uint32_t later : p.train.later_departures) {
+                if (later) {
+                    train_later_departures += train_later_departures.length() ? ", " : "Then ";
+                    train_later_departures += formatLocalTime(later);
+                }
+            }
+            Serial.println("Train data parsed from middleware");
+        } else {
+            Serial.println("Train data not available from middleware");
+        }
+        
+        middleware_etag = http.header("ETag");
+        Serial.println("All data fetched successfully from middleware (binary)");
+    } else {
+        Serial.print("Middleware HTTP Error: ");
+        Serial.println(httpCode);
+        current_condition = "Middleware Error";
+    }
+    
+    http.end();
+    return true;
+}
+
+// Send the ETag of the middleware data on screen, so unchanged data is answered with an empty 304
+void requestIfModified(HTTPClient& http) {
+    const char* keys[] = {"ETag", "X-Next-Refresh"};
+    http.collectHeaders(keys, 2);
+    if (middleware_etag.length() > 0) {
+        http.addHeader("If-None-Match", middleware_etag);
+    }
+}
+
+// The data on screen is current (304): keep it and its ETag, take only the next-refresh hint
+bool keepMiddlewareData(HTTPClient& http) {
+    middleware_etag = http.header("ETag");
+    next_refresh_hint = http.header("X-Next-Refresh").toInt();
+    Serial.println("Middleware data not modified since the last update");
+    http.end();
+    return false;
+}
+
+// Fetch the frame rendered by the middleware, inflate it into the framebuffer and draw it.
+// When the middleware still has the frame on screen it only sends the changed rectangles,
+// and only those are cleared and redrawn. Returns false (display untouched) if the frame
+// is unavailable, so the caller can draw locally.
+bool displayMiddlewareFrame() {
+    // Until a frame is shown, the screen no longer matches any frame (the caller draws locally on failure)
+    uint32_t shown_crc = frame_crc;
+    frame_crc = 0;
+    middleware_etag = "";
+    
+    if (WiFi.status() != WL_CONNECTED) {
+        return false;
+    }
+    
+    Serial.print("Fetching frame from middleware: ");
+    Serial.println(middleware_frame_url);
+    
+    HTTPClient http;
+    http.begin(middleware_frame_url);
+    if (shown_crc != 0) {
+        char hash_buffer[9];
+        snprintf(hash_buffer, sizeof(hash_buffer), "%08x", shown_crc);
+        http.addHeader("X-Frame-Hash", hash_buffer);
+    }
+    const char* keys[] = {"X-Next-Refresh"};
+    http.collectHeaders(keys, 1);
+    
+    int httpCode = http.GET();
+    int size = http.getSize();
+    
+    if (httpCode != 200 || size <= (int)sizeof(FrameHeader)) {
+        Serial.print("Middleware frame HTTP Error: ");
+        Serial.println(httpCode);
+        http.end();
+        return false;
+    }
+    next_refresh_hint = http.header("X-Next-Refresh").toInt();
+    
+    // The compressed frame is small (typically 15-30 KB, diffs well under 5 KB); keep it in PSRAM
+    uint8_t *body = (uint8_t *)ps_malloc(size);
+    if (!body) {
+        Serial.println("ERROR: Failed to allocate frame buffer!");
+        http.end();
+        return false;
+    }
+    
+    size_t received = http.getStreamPtr()->readBytes(body, size);
+    http.end();
+    
+    FrameHeader header;
+    memcpy(&header, body, sizeof(header));
+    
+    bool ok = received == (size_t)size && header.magic[0] == 'L' && header.magic[1] == 'F' &&
+              header.version == FRAME_VERSION &&
+              header.width == EPD_DISPLAY_WIDTH && header.height == EPD_DISPLAY_HEIGHT;
+    
+    if (ok && header.kind == FRAME_KIND_FULL) {
+        size_t inflated = tinfl_decompress_mem_to_mem(framebuffer, FRAME_BYTES, body + sizeof(header),
+                                                      size - sizeof(header), TINFL_FLAG_PARSE_ZLIB_HEADER);
+        ok = inflated == FRAME_BYTES && crc32_le(0, framebuffer, FRAME_BYTES) == header.crc32;
+        free(body);
+        
+        if (ok) {
+            epd_clear();
+            epd_draw_grayscale_image(epd_full_screen(), framebuffer);
+            Serial.println("Full frame displayed from middleware");
+        }
+    } else if (ok && header.kind == FRAME_KIND_DIFF) {
+        // Diffs are never larger than a frame (the middleware sends a full frame instead)
+        uint8_t *diff = (uint8_t *)ps_malloc(FRAME_BYTES);
+        size_t inflated = diff ? tinfl_decompress_mem_to_mem(diff, FRAME_BYTES, body + sizeof(header),
+                                                             size - sizeof(header), TINFL_FLAG_PARSE_ZLIB_HEADER)
+                               : TINFL_DECOMPRESS_MEM_TO_MEM_FAILED;
+        free(body);
+        
+        FrameDiffHeader diff_header;
+        ok = inflated != TINFL_DECOMPRESS_MEM_TO_MEM_FAILED && inflated >= sizeof(diff_header);
+        if (ok) {
+            memcpy(&diff_header, diff, sizeof(diff_header));
+            ok = diff_header.base_crc32 == shown_crc;
+        }
+        
+        // Apply all rectangles to the framebuffer and check the result before touching the panel
+        size_t offset = sizeof(diff_header);
+        for (int i = 0; ok && i < diff_header.rect_count; i++) {
+            FrameRect rect;
+            memcpy(&rect, diff + offset, sizeof(rect));
+            offset += sizeof(rect);
+            ok = rect.x % 2 == 0 && rect.width % 2 == 0 &&
+                 rect.x + rect.width <= EPD_DISPLAY_WIDTH && rect.y + rect.height <= EPD_DISPLAY_HEIGHT &&
+                 offset + rect.width / 2 * rect.height <= inflated;
+            for (int row = 0; ok && row < rect.height; row++) {
+                memcpy(framebuffer + (rect.y + row) * (EPD_DISPLAY_WIDTH / 2) + rect.x / 2, diff + offset, rect.width / 2);
+                offset += rect.width / 2;
+            }
+        }
+        ok = ok && crc32_le(0, framebuffer, FRAME_BYTES) == header.crc32;
+        
+        // Partial refresh: clear and redraw only the changed rectangles
+        offset = sizeof(diff_header);
+        for (int i = 0; ok && i < diff_header.rect_count; i++) {
+            FrameRect rect;
+            memcpy(&rect, diff + offset, sizeof(rect));
+            offset += sizeof(rect);
+            Rect_t area = {
+                .x = rect.x,
+                .y = rect.y,
+                .width = rect.width,
+                .height = rect.height,
+            };
+            epd_clear_area(area);
+            epd_draw_grayscale_image(area, diff + offset);
+            offset += rect.width / 2 * rect.height;
+        }
+        if (ok) {
+            Serial.printf("Frame diff displayed from middleware (%d rectangles)\n", diff_header.rect_count);
+        }
+        free(diff);
+    } else {
+        free(body);
+        ok = false;
+    }
+    
+    if (!ok) {
+        Serial.println("Invalid frame from middleware");
+        return false;
+    }
+    frame_crc = header.crc32;
+    
+    // Battery level is only known here, so it is drawn on top of the frame (its area is blank in the frame)
+    Rect_t battery_area = {
+        .x = 500,
+        .y = EPD_DISPLAY_HEIGHT - 45,
+        .width = EPD_DISPLAY_WIDTH - 500,
+        .height = 35,
+    };
+    epd_clear_area(battery_area);
+    drawBattery(500, EPD_DISPLAY_HEIGHT - 20);
+    
+    return true;
+}
+
+// Returns false if the data on screen is still current, so it need not be redrawn
+bool fetchMiddlewareData() {
     if (WiFi.status() != WL_CONNECTED) {
         Serial.println("WiFi not connected, skipping middleware update");
         current_condition = "No WiFi";
-        return;
+        middleware_etag = "";
+        return true;
     }
     
     Serial.println("Fetching data from middleware...");
     Serial.print("Middleware URL: ");
     Serial.println(middleware_url);
     
+    if (middleware_binary) {
+        return fetchMiddlewareBinaryData();
+    }
+    
     HTTPClient http;
     http.begin(middleware_url);
+    requestIfModified(http);
     
     // Use GET method for middleware (RESTful data retrieval)
     int httpCode = http.GET();
+    middleware_etag = "";
+    
+    if (httpCode == 304) {
+        return keepMiddlewareData(http);
+    }
     
     if (httpCode == 200) {
         String payload = http.getString();
@@ -454,6 +891,8 @@ void fetchMiddlewareData() {
         DeserializationError error = deserializeJson(doc, payload);
         
         if (!error) {
+            next_refresh_hint = doc["next_refresh_seconds"] | 0;
+            
             // Parse weather data
             if (doc.containsKey("weather") && !doc["weather"].containsKey("error")) {
                 JsonObject weather = doc["weather"];
@@ -468,16 +907,8 @@ void fetchMiddlewareData() {
                 bool daytime = weather["is_daytime"] | true;
                 const char* unit = weather["units"] | "metric";
                 
-                String unit_symbol = String(unit) == "imperial" ? "°F" : "°C";
-                current_temp = String(temp, 0) + unit_symbol;
-                feels_like = String(feels, 0) + unit_symbol;
-                temp_max = String(t_max, 0);
-                temp_min = String(t_min, 0);
-                current_precipitation = String(precipitation_prob) + "%";
-                wind_speed = String(wind, 0) + " m/s";
-                current_condition = condition;
-                current_condition_type = condition_type;
-                is_daytime = daytime;
+                setWeatherValues(temp, feels, t_max, t_min, precipitation_prob, wind,
+                                 condition, condition_type, daytime, String(unit) == "imperial");
                 
                 Serial.println("Weather data parsed from middleware");
             } else {
@@ -490,15 +921,7 @@ void fetchMiddlewareData() {
                 int price = crypto["price"] | 0;
                 float change = crypto["change_24h"] | 0.0;
                 
-                crypto_price = String(price);
-                
-                char change_buffer[20];
-                if (change >= 0) {
-                    snprintf(change_buffer, sizeof(change_buffer), "+%.2f", change);
-                } else {
-                    snprintf(change_buffer, sizeof(change_buffer), "%.2f", change);
-                }
-                crypto_change = change_buffer;
+                setCryptoValues(price, change);
                 
                 Serial.println("Crypto data parsed from middleware");
             } else {
@@ -512,19 +935,7 @@ void fetchMiddlewareData() {
                 const char* currency = stock["currency"] | "USD";
                 float change = stock["change"] | 0.0;
                 
-                stock_currency = currency;
-                
-                char price_buffer[20];
-                snprintf(price_buffer, sizeof(price_buffer), "%.2f", price);
-                stock_price = price_buffer;
-                
-                char change_buffer[20];
-                if (change >= 0) {
-                    snprintf(change_buffer, sizeof(change_buffer), "+%.2f", change);
-                } else {
-                    snprintf(change_buffer, sizeof(change_buffer), "%.2f", change);
-                }
-                stock_change = change_buffer;
+                setStockValues(price, currency, change);
                 
                 Serial.println("Stock data parsed from middleware");
             } else {
@@ -542,11 +953,20 @@ void fetchMiddlewareData() {
                 // Parse ISO 8601 datetime string and convert to local time
                 train_departure_time = parseUTCToLocal(dep_time_utc);
                 
+                // Following departures from the cached timetable
+                train_later_departures = "";
+                JsonArray departures = train["departures"];
+                for (size_t i = 1; i < departures.size() && i < 3; i++) {
+                    train_later_departures += train_later_departures.length() ? ", " : "Then ";
+                    train_later_departures += parseUTCToLocal(departures[i]["departure_time"] | "");
+                }
+                
                 Serial.println("Train data parsed from middleware");
             } else {
                 Serial.println("Train data not available from middleware");
             }
             
+            middleware_etag = http.header("ETag");
             Serial.println("All data fetched successfully from middleware");
         } else {
             Serial.print("JSON parsing error: ");
@@ -560,6 +980,7 @@ void fetchMiddlewareData() {
     }
     
     http.end();
+    return true;
 }
 
 void fetchWeatherData() {
@@ -790,6 +1211,7 @@ void fetchTrainData() {
     }
     
     Serial.println("Fetching train data...");
+    train_later_departures = "";  // Direct API calls fetch a single trip
     
     // Build API URL with required parameters
     String url = String("https://api.transport.nsw.gov.au/v1/tp/trip?") +
@@ -1034,8 +1456,28 @@ void displayWeather() {
         .width = icon.width,
         .height = icon.height,
     };
-    epd_draw_grayscale_image(area, (uint8_t *)icon.data);
-    epd_draw_image(area, (uint8_t *)icon.data, BLACK_ON_WHITE);
+    
+    // Compressed icons are inflated into PSRAM first
+    size_t icon_bytes = (size_t)icon.width * icon.height / 2;
+    uint8_t *icon_pixels = (uint8_t *)icon.data;
+    if (icon.size < icon_bytes) {
+        icon_pixels = (uint8_t *)ps_malloc(icon_bytes);
+        if (icon_pixels && tinfl_decompress_mem_to_mem(icon_pixels, icon_bytes, icon.data, icon.size,
+                                                       TINFL_FLAG_PARSE_ZLIB_HEADER) != icon_bytes) {
+            free(icon_pixels);
+            icon_pixels = NULL;
+        }
+        if (!icon_pixels) {
+            Serial.println("ERROR: Failed to inflate icon!");
+        }
+    }
+    if (icon_pixels) {
+        epd_draw_grayscale_image(area, icon_pixels);
+        epd_draw_image(area, icon_pixels, BLACK_ON_WHITE);
+        if (icon_pixels != icon.data) {
+            free(icon_pixels);
+        }
+    }
 
     // Temperature (large font)
     left_x = 240;
@@ -1068,6 +1510,13 @@ void displayWeather() {
     left_y += 40;
     writeln((GFXfont *)&Lexend14, train_via.c_str(), &left_x, &left_y, NULL);
 
+    // Following departures
+    if (train_later_departures.length() > 0) {
+        left_x = 20;
+        left_y += 30;
+        writeln((GFXfont *)&Lexend10, train_later_departures.c_str(), &left_x, &left_y, NULL);
+    }
+
     // RIGHT COLUMN: Condition and details
     int right_x = 500;
     int right_y = 80;
@@ -1384,6 +1833,8 @@ bool loadConfig() {
     if (doc.containsKey("middleware")) {
         middleware_enabled = doc["middleware"]["enabled"] | false;
         middleware_url = doc["middleware"]["url"].as<String>();
+        middleware_binary = doc["middleware"]["binary"] | false;
+        middleware_frame_url = doc["middleware"]["frame_url"] | "";
         
         Serial.print("Middleware enabled: ");
         Serial.println(middleware_enabled ? "YES" : "NO");